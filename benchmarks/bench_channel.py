@@ -0,0 +1,99 @@
+"""
+Per-message server cost of posting to a channel as membership grows.
+
+Runs message.py in-process against a throw-away database and times the
+`send_message` handler through the Flask-SocketIO test client, so the numbers
+are pure server work (DB + emits), no network.
+
+    python benchmarks/bench_channel.py
+    python benchmarks/bench_channel.py --sizes 100 1000 10000 50000 --compare-group
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_app():
+    # message.py creates its DB and upload folder relative to the CWD
+    os.chdir(tempfile.mkdtemp(prefix="zylo_bench_"))
+    os.environ.setdefault('ZYLO_RATE_LIMITS', 'send=0,room=0')  # posts back to back
+    sys.path.insert(0, ROOT)
+    import message
+    return message
+
+
+def seed_room(m, room_id, poster_id, members, channel):
+    with m.sqlite3.connect(m.DB_FILE) as conn:
+        user_rows = [(f"U{room_id}{i:07d}", f"user{i}", "x") for i in range(members)]
+        conn.executemany("INSERT INTO users (user_id, username, password) VALUES (?, ?, ?)", user_rows)
+        conn.execute("INSERT INTO users (user_id, username, password) VALUES (?, 'poster', 'x')", (poster_id,))
+        if channel:
+            conn.execute("INSERT INTO rooms (room_id, room_name, is_group, is_channel) VALUES (?, 'Bench', 1, 1)", (room_id,))
+            conn.executemany("INSERT INTO channel_members (room_id, user_id) VALUES (?, ?)",
+                             [(room_id, u[0]) for u in user_rows])
+            conn.execute("INSERT INTO channel_members (room_id, user_id, can_post) VALUES (?, ?, 1)", (room_id, poster_id))
+        else:
+            conn.execute("INSERT INTO rooms (room_id, room_name, is_group) VALUES (?, 'Bench', 1)", (room_id,))
+            conn.executemany("INSERT INTO chat_participants (room_id, user_id, chat_name) VALUES (?, ?, 'Bench')",
+                             [(room_id, u[0]) for u in user_rows] + [(room_id, poster_id)])
+        conn.commit()
+        return [u[0] for u in user_rows]
+
+
+def run_case(m, members, messages, channel, online):
+    kind = "C" if channel else "G"
+    room_id = f"{kind}{members}"
+    poster_id = f"P{room_id}"
+    member_ids = seed_room(m, room_id, poster_id, members, channel)
+
+    poster = m.socketio.test_client(m.app, auth={'token': m.session_tokens.dumps(poster_id)})
+    poster.emit('join_room', {'room_id': room_id, 'user_id': poster_id})
+
+    # A fixed number of connected subscribers so only membership size varies
+    listeners = []
+    for uid in member_ids[:online]:
+        client = m.socketio.test_client(m.app, auth={'token': m.session_tokens.dumps(uid)})
+        listeners.append(client)
+    poster.get_received()
+
+    timings = []
+    for i in range(messages):
+        start = time.perf_counter()
+        poster.emit('send_message', {'room_id': room_id, 'sender_id': poster_id, 'content': f"post {i}"})
+        timings.append((time.perf_counter() - start) * 1000)
+        poster.get_received()
+        for client in listeners:
+            client.get_received()
+
+    for client in listeners + [poster]:
+        client.disconnect()
+    timings.sort()
+    return statistics.mean(timings), timings[int(len(timings) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 50000])
+    parser.add_argument('--messages', type=int, default=200, help="posts timed per size")
+    parser.add_argument('--online', type=int, default=20, help="connected subscribers per room")
+    parser.add_argument('--compare-group', action='store_true',
+                        help="also time a regular group room of the same size (per-member fan-out)")
+    args = parser.parse_args()
+
+    m = load_app()
+    print(f"{'room':<8}{'members':>10}{'mean ms':>12}{'p95 ms':>12}")
+    for size in args.sizes:
+        mean, p95 = run_case(m, size, args.messages, True, args.online)
+        print(f"{'channel':<8}{size:>10}{mean:>12.3f}{p95:>12.3f}")
+        if args.compare_group:
+            mean, p95 = run_case(m, size, max(args.messages // 10, 5), False, args.online)
+            print(f"{'group':<8}{size:>10}{mean:>12.3f}{p95:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
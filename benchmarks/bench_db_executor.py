@@ -0,0 +1,184 @@
+"""
+Tail latency of unrelated sockets while a heavy history query runs.
+
+Seeds one room with a long unread history, starts the server twice (queries
+inline on the eventlet hub, then on the DB executor) and measures round trips of
+small probe clients posting to their own DMs, first alone and then while another
+client keeps running a heavy query against the big room:
+
+* sidebar: get_chats, whose unread count and last-message time scan the whole
+  room history in SQLite but return one row
+* history: sync_room from sequence 0, the full history; most of its cost is
+  formatting and JSON encoding on the hub, which the executor does not move
+
+Load shedding is disabled for the run so the server answers every request.
+
+    python benchmarks/bench_db_executor.py
+    python benchmarks/bench_db_executor.py --heavy history --history 20000
+    python benchmarks/bench_db_executor.py --history 500000 --probes 8 --duration 15
+"""
+import argparse
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from loadgen import ROOT, LocalServer, latency_summary
+
+import requests
+import socketio
+
+
+def seed(workdir, history):
+    # Importing message monkey-patches threading, so the schema is created in a child process
+    subprocess.run([sys.executable, "-W", "ignore", "-c", "import message"], cwd=workdir, check=True,
+                   env=dict(os.environ, PYTHONPATH=ROOT), stdout=subprocess.DEVNULL)
+    conn = sqlite3.connect(os.path.join(workdir, "ZYLO_chat.db"))
+    conn.executemany("INSERT INTO users (user_id, username, password) VALUES (?, ?, 'x')",
+                     [('HEAVY00000', 'heavy'), ('OTHER00000', 'other')])
+    conn.execute("INSERT INTO rooms (room_id, room_name, is_group, seq) VALUES ('BIGROOM000', 'Big', 1, ?)", (history,))
+    conn.executemany("INSERT INTO chat_participants (room_id, user_id, chat_name) VALUES ('BIGROOM000', ?, 'Big')",
+                     [('HEAVY00000',), ('OTHER00000',)])
+    stamp = int(time.time() * 1000)
+    conn.executemany("""
+        INSERT INTO messages (room_id, sender_id, msg_type, content, filename, timestamp, status, seq)
+        VALUES ('BIGROOM000', 'OTHER00000', 'text', ?, '', ?, 'sent', ?)
+    """, ((f"history message {i} with some text", stamp, i) for i in range(1, history + 1)))
+    conn.commit()
+    conn.close()
+
+
+class Probe:
+    def __init__(self, url, index, interval):
+        self.url, self.interval = url, interval
+        self.name = f"probe{index}_{int(time.time() * 1000)}"
+        self.sio = socketio.Client()
+        self.pending = {}
+        self.samples = []
+        self.recording = False
+        self.sio.on('message', self.on_message)
+        self.sio.on('chat_created', lambda data: self.created.set() or setattr(self, 'room_id', data['room_id']))
+        self.created = threading.Event()
+
+    def on_message(self, msg):
+        sent = self.pending.pop(msg.get('content'), None)
+        if sent is not None and self.recording:
+            self.samples.append((time.perf_counter() - sent) * 1000)
+
+    def connect(self, peer_id):
+        res = requests.post(self.url + "/auth", json={"name": self.name, "pass": "x"}).json()
+        self.user_id = res['user']['id']
+        self.sio.connect(self.url, transports=['websocket'], auth={'token': res['token']})
+        self.sio.emit('create_chat', {'my_id': self.user_id, 'target_id': peer_id})
+        self.created.wait(10)
+        self.sio.emit('join_room', {'room_id': self.room_id, 'user_id': self.user_id})
+
+    def run(self, stop):
+        n = 0
+        while not stop.is_set():
+            n += 1
+            key = f"{self.name}:{n}"
+            self.pending[key] = time.perf_counter()
+            self.sio.emit('send_message', {'room_id': self.room_id, 'sender_id': self.user_id, 'content': key})
+            time.sleep(self.interval)
+
+
+HEAVY_QUERIES = {
+    'sidebar': ('get_chats', {'user_id': 'HEAVY00000'}, 'chat_list'),
+    'history': ('sync_room', {'room_id': 'BIGROOM000', 'since_seq': 0}, 'room_delta'),
+}
+
+
+class Heavy:
+    def __init__(self, kind):
+        self.event, self.payload, reply = HEAVY_QUERIES[kind]
+        self.sio = socketio.Client()
+        self.done = threading.Event()
+        self.queries = 0
+        self.sio.on(reply, self.on_reply)
+
+    def on_reply(self, data):
+        self.queries += 1
+        self.done.set()
+
+    def run(self, url, stop):
+        # The seeded user still has a plaintext password, which /auth accepts (and hashes) once
+        token = requests.post(url + "/auth", json={"name": "heavy", "pass": "x"}).json()['token']
+        self.sio.connect(url, transports=['websocket'], auth={'token': token})
+        while not stop.is_set():
+            self.done.clear()
+            self.sio.emit(self.event, self.payload)
+            self.done.wait(60)
+        self.sio.disconnect()
+
+
+def measure(server, args):
+    probes = [Probe(server.url, i, args.interval) for i in range(args.probes)]
+    peer = requests.post(server.url + "/auth", json={"name": f"peer_{time.time()}", "pass": "x"}).json()['user']['id']
+    for probe in probes:
+        probe.connect(peer)
+    # Fresh sockets sometimes sit in delayed-ACK round trips; let the joins settle first
+    time.sleep(1)
+
+    results = {}
+    for phase, heavy in (("idle", False), ("heavy query", True)):
+        stop = threading.Event()
+        threads = [threading.Thread(target=p.run, args=(stop,)) for p in probes]
+        worker = Heavy(args.heavy) if heavy else None
+        if worker:
+            threads.append(threading.Thread(target=worker.run, args=(server.url, stop)))
+        for p in probes:
+            p.samples, p.recording = [], True
+        for t in threads:
+            t.start()
+        time.sleep(args.duration)
+        stop.set()
+        for t in threads:
+            t.join()
+        time.sleep(0.5)
+        samples = [s for p in probes for s in p.samples]
+        results[phase] = latency_summary(samples)
+        results[phase]['history_queries'] = worker.queries if worker else 0
+    for probe in probes:
+        probe.sio.disconnect()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--heavy', choices=sorted(HEAVY_QUERIES), default='sidebar', help="heavy query to run")
+    parser.add_argument('--history', type=int, default=200_000, help="messages in the big room")
+    parser.add_argument('--probes', type=int, default=4, help="unrelated probe sockets")
+    parser.add_argument('--interval', type=float, default=0.02, help="seconds between probe messages")
+    parser.add_argument('--duration', type=float, default=10, help="seconds per phase")
+    args = parser.parse_args()
+
+    rows = []
+    for label, env in (("inline", "0"), ("executor", "1")):
+        server = LocalServer()
+        seed(server.workdir, args.history)
+        os.environ.update(ZYLO_DB_EXECUTOR=env, ZYLO_SHED_LAG_MS='1000000',
+                          ZYLO_RATE_LIMITS='send=0,room=0,chats=0,join=0')
+        server.start()
+        try:
+            results = measure(server, args)
+        finally:
+            server.stop()
+        for phase, res in results.items():
+            rows.append((label, phase, res))
+
+    print(f"\nprobe round trips (ms), {args.probes} probes, {args.heavy} query on {args.history:,} messages")
+    print(f"{'mode':<10}{'phase':<15}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}{'heavy q':>11}")
+    for label, phase, r in rows:
+        if not r['count']:
+            print(f"{label:<10}{phase:<15}{0:>7}")
+            continue
+        print(f"{label:<10}{phase:<15}{r['count']:>7}{r['p50']:>9.1f}{r['p95']:>9.1f}{r['p99']:>9.1f}{r['max']:>9.1f}"
+              f"{r['history_queries']:>11}")
+
+
+if __name__ == "__main__":
+    main()
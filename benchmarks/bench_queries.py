@@ -0,0 +1,173 @@
+"""
+SQL hot-path micro-benchmarks.
+
+Times the exact statements message.py runs for get_chats, the join_room history
+load, mark_read and the /auth username lookup against a large database, for
+both a heavy and a typical target, and records each statement's EXPLAIN QUERY
+PLAN.
+
+Without --db a small dataset is generated first (see gen_dataset.py). With
+--baseline the run fails (exit 1) when a query's median gets slower than the
+threshold allows, or when its plan picks up a full table scan the baseline did
+not have.
+
+    python benchmarks/gen_dataset.py --db big/ZYLO_chat.db
+    python benchmarks/bench_queries.py --db big/ZYLO_chat.db --out baseline.json
+    python benchmarks/bench_queries.py --db big/ZYLO_chat.db --baseline baseline.json --threshold 25
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import gen_dataset
+
+
+def pick_targets(conn):
+    per_user = conn.execute("""
+        SELECT user_id, COUNT(*) AS n FROM chat_participants GROUP BY user_id ORDER BY n
+    """).fetchall()
+    rooms = conn.execute("SELECT room_id FROM rooms WHERE is_channel=0 AND seq>0 ORDER BY seq").fetchall()
+    targets = {
+        'heavy_user': per_user[-1][0],
+        'typical_user': per_user[len(per_user) // 2][0],
+        'new_username': 'no-such-user',
+    }
+    for label, (room_id,) in (('largest_room', rooms[-1]), ('typical_room', rooms[len(rooms) // 2])):
+        (member,) = conn.execute("SELECT user_id FROM chat_participants WHERE room_id=? LIMIT 1", (room_id,)).fetchone()
+        targets[label] = {'room_id': room_id, 'member': member}
+    targets['known_username'] = conn.execute(
+        "SELECT username FROM users WHERE user_id=?", (targets['typical_user'],)).fetchone()
+    return targets
+
+
+def build_cases(m, t):
+    cases = []
+    for who in ('heavy_user', 'typical_user'):
+        uid = t[who]
+        cases.append((f"get_chats/{who}", m.CHAT_LIST_SQL, (uid, uid, uid, uid), False))
+    for room in ('largest_room', 'typical_room'):
+        r = t[room]
+        cases.append((f"join_history/{room}", m.HISTORY_SQL, (r['room_id'],), False))
+        cases.append((f"mark_read/{room}", m.MARK_READ_SQL, (r['room_id'], r['member']), True))
+    for label, name in (('existing', t['known_username'][0]), ('new_user', t['new_username'])):
+        cases.append((f"auth_lookup/{label}", m.USER_LOGIN_SQL, (name, m.LOGIN_MAX_CANDIDATES), False))
+    return cases
+
+
+def query_plan(conn, sql, params):
+    rows = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    depth = {0: 0}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append("  " * (depth[node_id] - 1) + detail)
+    return lines
+
+
+def full_scans(plan):
+    # "SCAN t USING (COVERING) INDEX" still walks a whole index, but only bare table scans are flagged
+    return sorted({line.strip() for line in plan if line.strip().startswith("SCAN ") and "INDEX" not in line})
+
+
+def time_case(conn, sql, params, writes, min_time, max_iterations):
+    timings = []
+    rows = 0
+    deadline = time.perf_counter() + min_time
+    while len(timings) < 3 or (time.perf_counter() < deadline and len(timings) < max_iterations):
+        start = time.perf_counter()
+        cur = conn.execute(sql, params)
+        rows = cur.rowcount if writes else len(cur.fetchall())
+        timings.append((time.perf_counter() - start) * 1000)
+        if writes:
+            conn.rollback()  # keep the dataset unchanged between iterations
+    timings.sort()
+    return {
+        'iterations': len(timings),
+        'rows': rows,
+        'median_ms': statistics.median(timings),
+        'p95_ms': timings[max(0, int(len(timings) * 0.95) - 1)],
+    }
+
+
+def check_regressions(results, baseline, threshold, noise_floor_ms):
+    failures = []
+    for name, res in results['cases'].items():
+        base = baseline.get('cases', {}).get(name)
+        if not base:
+            continue
+        limit = base['median_ms'] * (1 + threshold / 100)
+        if res['median_ms'] > limit and res['median_ms'] - base['median_ms'] > noise_floor_ms:
+            failures.append(f"{name}: median {res['median_ms']:.3f} ms vs baseline {base['median_ms']:.3f} ms")
+        new_scans = set(res['full_scans']) - set(base.get('full_scans', []))
+        if new_scans:
+            failures.append(f"{name}: plan gained full scan(s) {', '.join(sorted(new_scans))}")
+        elif res['plan'] != base.get('plan'):
+            print(f"note: {name} plan changed")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', help="database to benchmark (default: generate a small one)")
+    parser.add_argument('--out', help="write results JSON here")
+    parser.add_argument('--baseline', help="results JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=25.0, help="allowed median slowdown in percent")
+    parser.add_argument('--noise-floor-ms', type=float, default=0.05,
+                        help="ignore slowdowns smaller than this many ms")
+    parser.add_argument('--min-time', type=float, default=0.5, help="seconds to spend per case")
+    parser.add_argument('--max-iterations', type=int, default=1000)
+    parser.add_argument('--plans', action='store_true', help="print every query plan")
+    args = parser.parse_args()
+
+    if args.db:
+        db_path = os.path.abspath(args.db)
+    else:
+        gen_args = argparse.ArgumentParser()
+        gen_dataset.add_arguments(gen_args)
+        db_path = os.path.join(tempfile.mkdtemp(prefix="zylo_queries_"), "ZYLO_chat.db")
+        print(f"generating a small dataset in {db_path}")
+        gen_dataset.generate(db_path, gen_args.parse_args(
+            ['--users', '5000', '--rooms', '2500', '--messages', '300000']), log=lambda _: None)
+    # Importing message runs init_db, so do it away from the database under test
+    m = gen_dataset.load_app()
+    m.DB_FILE = db_path
+
+    conn = m.sqlite3.connect(db_path)
+    counts = {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+              for t in ('users', 'rooms', 'messages')}
+    targets = pick_targets(conn)
+    results = {'db': db_path, 'sqlite': m.sqlite3.sqlite_version, 'counts': counts, 'cases': {}}
+    print(f"{counts['users']:,} users, {counts['rooms']:,} rooms, {counts['messages']:,} messages "
+          f"(SQLite {m.sqlite3.sqlite_version})\n")
+    print(f"{'case':<38}{'median ms':>11}{'p95 ms':>10}{'rows':>9}  full scans")
+    for name, sql, params, writes in build_cases(m, targets):
+        res = time_case(conn, sql, params, writes, args.min_time, args.max_iterations)
+        res['plan'] = query_plan(conn, sql, params)
+        res['full_scans'] = full_scans(res['plan'])
+        results['cases'][name] = res
+        print(f"{name:<38}{res['median_ms']:>11.3f}{res['p95_ms']:>10.3f}{res['rows']:>9}  "
+              f"{'; '.join(res['full_scans']) or '-'}")
+        if args.plans:
+            print("\n".join("      " + line for line in res['plan']))
+    conn.close()
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = check_regressions(results, json.load(f), args.threshold, args.noise_floor_ms)
+        for failure in failures:
+            print(f"REGRESSION {failure}")
+        if failures:
+            sys.exit(1)
+        print(f"\nno regressions past {args.threshold:.0f}% against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
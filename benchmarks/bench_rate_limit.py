@@ -0,0 +1,101 @@
+"""
+Cost of the socket event rate limiter per event.
+
+Times message.py's token-bucket check in a tight loop: an admitted event on a
+warm bucket, a rejected one, sends that also take the room's bucket, and events
+spread over many users (a large bucket table). The "admit_rate" line runs the
+full per-event path, session lookup included, inside a request context. Each
+case reports the median over --repeat runs of --events calls.
+
+    python benchmarks/bench_rate_limit.py
+    python benchmarks/bench_rate_limit.py --events 1000000 --users 500000 --out rate_limit.json
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_app():
+    # message.py creates its DB and upload folder relative to the CWD
+    os.chdir(tempfile.mkdtemp(prefix="zylo_bench_"))
+    sys.path.insert(0, ROOT)
+    import message
+    return message
+
+
+def per_event_us(fn, events, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        fn(events)
+        samples.append((time.perf_counter_ns() - start) / events / 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=200000, help="checks timed per run")
+    parser.add_argument('--users', type=int, default=100000, help="distinct users in the many-users case")
+    parser.add_argument('--repeat', type=int, default=5, help="runs per case (median reported)")
+    parser.add_argument('--out', help="write results JSON here")
+    args = parser.parse_args()
+
+    m = load_app()
+    check = m.rate_limit_check
+    users = [f"U{i:09d}" for i in range(args.users)]
+    room = {'room_id': 'ROOM000001'}
+
+    def admitted(n):
+        for _ in range(n):
+            check('U1', 'typing', room, time.monotonic())
+
+    def send_with_room(n):
+        for _ in range(n):
+            check('U1', 'send_message', room, time.monotonic())
+
+    def many_users(n):
+        for i in range(n):
+            check(users[i % len(users)], 'join_room', room, time.monotonic())
+
+    def rejected(n):
+        for _ in range(n):
+            check('U2', 'get_chats', room, time.monotonic())
+
+    def full_path(n):
+        admit = m.admit_rate
+        for _ in range(n):
+            admit('typing', room)
+
+    unlimited = {'send': (1e12, 1e12), 'join': (1e12, 1e12), 'typing': (1e12, 1e12), 'room': (1e12, 1e12)}
+    m.RATE_LIMITS.update(unlimited)
+    m.RATE_LIMITS['chats'] = (1e-9, 1)  # empty after the first call
+    cases = [('admitted', admitted), ('send + room bucket', send_with_room),
+             (f'{args.users} users', many_users), ('rejected', rejected)]
+    results = []
+    print(f"\n{'case':<24}{'us/event':>10}{'events/s':>14}")
+    for name, fn in cases:
+        us = per_event_us(fn, args.events, args.repeat)
+        results.append({'case': name, 'us_per_event': us})
+        print(f"{name:<24}{us:>10.3f}{1e6 / us:>14,.0f}")
+
+    from flask import request, session
+    with m.app.test_request_context():
+        session['user'] = {'id': 'U3', 'name': 'bench', 'avatar': None}
+        request.sid = 'bench'  # set by Flask-SocketIO for socket events
+        us = per_event_us(full_path, args.events, args.repeat)
+    results.append({'case': 'admit_rate', 'us_per_event': us})
+    print(f"{'admit_rate':<24}{us:>10.3f}{1e6 / us:>14,.0f}")
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'events': args.events, 'repeat': args.repeat, 'results': results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+// Browser-free render benchmark for the embedded message list.
+//
+// Loads MESSAGE_VIEW_JS straight out of message.py into a Node vm context with a
+// small DOM shim, then renders a synthetic room of N messages twice: once with
+// the old one-row-at-a-time renderer (kept below for comparison) and once with
+// the virtualized MessageList. The shim does no real layout, so times are the
+// JavaScript side only; the DOM counters show what a browser would have to lay out.
+//
+//     node benchmarks/bench_render.js
+//     node benchmarks/bench_render.js --count 50000 --runs 3
+
+const fs = require('fs');
+const path = require('path');
+const vm = require('vm');
+const { performance } = require('perf_hooks');
+
+const args = process.argv.slice(2);
+function arg(name, fallback) {
+    const i = args.indexOf(name);
+    return i >= 0 ? Number(args[i + 1]) : fallback;
+}
+const COUNT = arg('--count', 10000);
+const RUNS = arg('--runs', 5);
+const VIEWPORT = 800;
+const GAP = 15;
+
+// --- DOM shim ---
+const counters = { created: 0, attached: 0, htmlParses: 0, layoutReads: 0 };
+
+class ShimNode {
+    constructor() {
+        this.childNodes = [];
+        this.parentNode = null;
+    }
+    get firstChild() { return this.childNodes[0] || null; }
+    get nextSibling() {
+        if (!this.parentNode) return null;
+        const siblings = this.parentNode.childNodes;
+        return siblings[siblings.indexOf(this) + 1] || null;
+    }
+    detach() {
+        if (!this.parentNode) return;
+        const siblings = this.parentNode.childNodes;
+        siblings.splice(siblings.indexOf(this), 1);
+        this.parentNode = null;
+    }
+    insertBefore(node, ref) {
+        const nodes = node.isFragment ? [...node.childNodes] : [node];
+        nodes.forEach(n => n.detach());
+        const at = ref ? this.childNodes.indexOf(ref) : this.childNodes.length;
+        this.childNodes.splice(at, 0, ...nodes);
+        nodes.forEach(n => { n.parentNode = this; });
+        counters.attached += nodes.length;
+        return node;
+    }
+    appendChild(node) { return this.insertBefore(node, null); }
+    removeChild(node) { node.detach(); return node; }
+    replaceChild(node, old) { this.insertBefore(node, old); old.detach(); return old; }
+    remove() { this.detach(); }
+}
+
+class ShimElement extends ShimNode {
+    constructor(tag) {
+        super();
+        counters.created++;
+        this.tagName = tag.toUpperCase();
+        this.className = '';
+        this.style = {};
+        this.dataset = {};
+        this.listeners = {};
+        this.html = '';
+    }
+    set innerHTML(html) {
+        counters.htmlParses++;
+        this.childNodes.forEach(c => { c.parentNode = null; });
+        this.childNodes = [];
+        this.html = html;
+    }
+    get innerHTML() { return this.html; }
+    addEventListener(type, fn) { (this.listeners[type] = this.listeners[type] || []).push(fn); }
+    dispatch(type) { (this.listeners[type] || []).forEach(fn => fn()); }
+    // Rows get a stable pseudo-random height so measured slots vary like real text
+    get offsetHeight() {
+        if (this.className.indexOf('msg-spacer') >= 0) return parseFloat(this.style.height) || 0;
+        const id = Number(this.dataset.messageId) || 0;
+        return 40 + ((id * 2654435761) % 4) * 18;
+    }
+    get offsetTop() {
+        counters.layoutReads++;
+        let top = 0;
+        for (const sibling of this.parentNode.childNodes) {
+            if (sibling === this) break;
+            top += sibling.offsetHeight + GAP;
+        }
+        return top;
+    }
+}
+
+class ShimScroller extends ShimElement {
+    constructor() {
+        super('div');
+        this.top = 0;
+    }
+    get clientHeight() { return VIEWPORT; }
+    get scrollHeight() {
+        return this.childNodes.reduce((sum, c) => sum + c.offsetHeight + GAP, 0);
+    }
+    get scrollTop() { return this.top; }
+    set scrollTop(value) {
+        this.top = Math.max(0, Math.min(value, this.scrollHeight - VIEWPORT));
+        this.dispatch('scroll');
+    }
+}
+
+let frames = [];
+const context = {
+    document: {
+        createElement: (tag) => new ShimElement(tag),
+        createDocumentFragment: () => Object.assign(new ShimNode(), { isFragment: true }),
+    },
+    requestAnimationFrame: (fn) => frames.push(fn),
+    currentUser: { id: 'ME00000000', name: 'Me', avatar: null },
+    roomUsersById: new Map(),
+};
+vm.createContext(context);
+
+// --- Load the shipped renderer from message.py ---
+const source = fs.readFileSync(path.join(__dirname, '..', 'message.py'), 'utf8');
+const match = source.match(/MESSAGE_VIEW_JS = r"""([\s\S]*?)"""/);
+if (!match) throw new Error('MESSAGE_VIEW_JS not found in message.py');
+vm.runInContext(match[1] + '\nthis.MessageList = MessageList; this.buildMessageRow = buildMessageRow;', context);
+
+// --- Synthetic room ---
+const users = [];
+for (let u = 0; u < 50; u++) users.push({ id: `U${String(u).padStart(9, '0')}`, name: `user${u}`, avatar: u % 3 ? `/uploads/avatar_${u}.png` : null });
+context.roomUsersById = new Map(users.map(u => [u.id, u]));
+
+function makeMessages(n) {
+    const msgs = [];
+    for (let i = 1; i <= n; i++) {
+        const sender = i % 7 === 0 ? context.currentUser.id : users[i % users.length].id;
+        const kind = i % 97 === 0 ? 'system' : (i % 31 === 0 ? 'image/png' : (i % 53 === 0 ? 'application/pdf' : 'text'));
+        msgs.push({
+            id: i, seq: i, sender_id: sender, type: kind, status: 'read', time: 1700000000000 + i * 60000,
+            content: kind === 'text' ? `Message number ${i} with a little <b>text</b> to escape` : (kind === 'system' ? 'user1 added user2' : `/uploads/file_${i}`),
+            filename: kind === 'application/pdf' ? `doc_${i}.pdf` : '',
+        });
+    }
+    return msgs;
+}
+
+// The renderer this replaced: every history message became several elements built
+// from innerHTML and appended one by one, with a linear scan for the sender.
+function legacyAppend(container, msg, roomUsers) {
+    const isMe = msg.sender_id === context.currentUser.id;
+    const document = context.document;
+    if (msg.type === 'system') {
+        const row = document.createElement('div');
+        row.className = 'message-row system';
+        row.innerHTML = `<div class="message system">${msg.content}</div>`;
+        container.appendChild(row);
+        return;
+    }
+    const row = document.createElement('div');
+    row.className = `message-row ${isMe ? 'sent' : ''}`;
+    const u = roomUsers.find(x => x.id === msg.sender_id);
+    const avatarSrc = u && u.avatar ? u.avatar : 'https://ui-avatars.com/api/?name=User';
+    const avatarDiv = document.createElement('div');
+    avatarDiv.className = 'msg-avatar';
+    avatarDiv.innerHTML = `<img src="${avatarSrc}" class="msg-avatar-img-${msg.sender_id}">`;
+    const msgBubble = document.createElement('div');
+    msgBubble.className = 'message';
+    msgBubble.innerHTML = `<div>${msg.content}</div><div class="msg-info"><span>${msg.time}</span></div>`;
+    row.dataset.messageId = msg.id;
+    row.appendChild(avatarDiv);
+    row.appendChild(msgBubble);
+    container.appendChild(row);
+}
+
+function flushFrames() {
+    while (frames.length) {
+        const pending = frames;
+        frames = [];
+        pending.forEach(fn => fn());
+    }
+}
+
+function resetCounters() {
+    Object.keys(counters).forEach(k => { counters[k] = 0; });
+}
+
+function median(values) {
+    const sorted = values.slice().sort((a, b) => a - b);
+    return sorted[Math.floor(sorted.length / 2)];
+}
+
+function runLegacy(msgs) {
+    const container = new ShimScroller();
+    resetCounters();
+    const start = performance.now();
+    container.innerHTML = '';
+    msgs.forEach(m => legacyAppend(container, m, users));
+    container.scrollTop = container.scrollHeight;
+    return { ms: performance.now() - start, domRows: container.childNodes.length, ...counters };
+}
+
+function runVirtual(msgs) {
+    const container = new ShimScroller();
+    const list = new context.MessageList(container, context.buildMessageRow);
+    resetCounters();
+    const start = performance.now();
+    list.setMessages(msgs);
+    list.scrollToBottom();
+    flushFrames();
+    const ms = performance.now() - start;
+    const result = { ms, domRows: container.childNodes.length - 2, ...counters };
+
+    // Scroll from the bottom to the top half a viewport per frame
+    const frameTimes = [];
+    while (container.scrollTop > 0) {
+        const t = performance.now();
+        container.scrollTop = container.scrollTop - VIEWPORT / 2;
+        flushFrames();
+        frameTimes.push(performance.now() - t);
+    }
+    frameTimes.sort((a, b) => a - b);
+    result.scrollFrames = frameTimes.length;
+    result.scrollMeanMs = frameTimes.reduce((a, b) => a + b, 0) / Math.max(frameTimes.length, 1);
+    result.scrollP95Ms = frameTimes[Math.floor(frameTimes.length * 0.95)] || 0;
+    result.maxDomRows = container.childNodes.length - 2;
+    return result;
+}
+
+const msgs = makeMessages(COUNT);
+const legacy = [], virtual = [];
+for (let r = 0; r < RUNS; r++) {
+    legacy.push(runLegacy(msgs.map(m => ({ ...m }))));
+    virtual.push(runVirtual(msgs.map(m => ({ ...m }))));
+}
+
+const l = legacy[legacy.length - 1], v = virtual[virtual.length - 1];
+console.log(`messages: ${COUNT}, runs: ${RUNS}, viewport: ${VIEWPORT}px`);
+console.log(`${'renderer'.padEnd(10)}${'render ms'.padStart(12)}${'rows in DOM'.padStart(14)}${'elements'.padStart(11)}${'innerHTML'.padStart(11)}`);
+console.log(`${'legacy'.padEnd(10)}${median(legacy.map(x => x.ms)).toFixed(2).padStart(12)}${String(l.domRows).padStart(14)}${String(l.created).padStart(11)}${String(l.htmlParses).padStart(11)}`);
+console.log(`${'virtual'.padEnd(10)}${median(virtual.map(x => x.ms)).toFixed(2).padStart(12)}${String(v.domRows).padStart(14)}${String(v.created).padStart(11)}${String(v.htmlParses).padStart(11)}`);
+console.log(`virtual scroll: ${v.scrollFrames} frames, mean ${median(virtual.map(x => x.scrollMeanMs)).toFixed(3)} ms, p95 ${median(virtual.map(x => x.scrollP95Ms)).toFixed(3)} ms`);
@@ -0,0 +1,117 @@
+"""
+Encode cost and wire size of history pages per serializer and layout.
+
+Builds synthetic rooms of 1k and 10k messages shaped like HISTORY_SQL rows and
+encodes each page the way message.py would for every ZYLO_SERIALIZER available
+here (stdlib json, orjson, msgpack), both as one dict per message ("rows") and
+as one array per field ("columns", what the page asks for). CPU is process time
+per encode; bytes are the encoded payload as sent in a WebSocket frame. The
+"cached" line is a room cache hit: the page was encoded once and is only spliced
+into the packet.
+
+    python benchmarks/bench_serializer.py
+    python benchmarks/bench_serializer.py --sizes 1000 10000 50000 --repeat 50 --out serializer.json
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORDS = ("hey", "ok", "the", "meeting", "is", "moved", "to", "tomorrow", "lunch", "thanks", "see", "you",
+         "deploy", "done", "can", "someone", "review", "my", "PR", "please", "lol", "sure", "on", "it")
+
+
+def load_app():
+    # message.py creates its DB and upload folder relative to the CWD
+    os.chdir(tempfile.mkdtemp(prefix="zylo_bench_"))
+    sys.path.insert(0, ROOT)
+    import message
+    return message
+
+
+def make_page(count, rng):
+    senders = [''.join(rng.choices('ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789', k=10)) for _ in range(6)]
+    start = 1700000000000
+    page = []
+    for i in range(1, count + 1):
+        is_file = rng.random() < 0.05
+        page.append({
+            'id': i,
+            'sender_id': rng.choice(senders),
+            'type': 'image' if is_file else 'text',
+            'content': f"/uploads/{i}_photo.png" if is_file else ' '.join(rng.choices(WORDS, k=rng.randint(2, 30))),
+            'filename': 'photo.png' if is_file else '',
+            'time': start + i * rng.randint(1000, 120000),
+            'status': 'read' if i < count - 5 else 'sent',
+            'seq': i,
+        })
+    return page
+
+
+def encoders():
+    found = {'stdlib': lambda obj: json.dumps(obj, separators=(',', ':')).encode()}
+    try:
+        import orjson
+        found['orjson'] = lambda obj: orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    except ImportError:
+        print("orjson not installed, skipping it")
+    try:
+        import msgpack
+        found['msgpack'] = msgpack.packb
+    except ImportError:
+        print("msgpack not installed, skipping it")
+    return found
+
+
+def cpu_ms(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.process_time_ns()
+        fn()
+        samples.append((time.process_time_ns() - start) / 1e6)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000], help="messages per page")
+    parser.add_argument('--repeat', type=int, default=20, help="encodes timed per case (median reported)")
+    parser.add_argument('--out', help="write results JSON here")
+    args = parser.parse_args()
+
+    m = load_app()
+    rng = random.Random(7)
+    available = encoders()
+    results = []
+    print(f"\n{'messages':>9}  {'serializer':<11}{'layout':<9}{'cpu ms':>10}{'KB':>10}  vs stdlib rows")
+    for size in args.sizes:
+        page = make_page(size, rng)
+        baseline = None
+        for name, encode in available.items():
+            for layout in ('rows', 'columns'):
+                payload = m.message_page(page, layout == 'columns')
+                data = encode(['history', payload])
+                ms = cpu_ms(lambda: encode(['history', payload]), args.repeat)
+                baseline = baseline or (ms, len(data))
+                results.append({'messages': size, 'serializer': name, 'layout': layout, 'cpu_ms': ms, 'bytes': len(data)})
+                print(f"{size:>9}  {name:<11}{layout:<9}{ms:>10.3f}{len(data) / 1024:>10.1f}"
+                      f"  {ms / baseline[0]:.2f}x cpu, {len(data) / baseline[1]:.2f}x size")
+        cached = m.encode_payload(m.message_page(page, True))
+        packet = m.socketio.server.packet_class(2, data=['history', cached])  # 2 = EVENT
+        ms = cpu_ms(packet.encode, args.repeat)
+        results.append({'messages': size, 'serializer': m.SERIALIZER, 'layout': 'cached', 'cpu_ms': ms,
+                        'bytes': len(cached.data)})
+        print(f"{size:>9}  {m.SERIALIZER:<11}{'cached':<9}{ms:>10.3f}{len(cached.data) / 1024:>10.1f}")
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'repeat': args.repeat, 'results': results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
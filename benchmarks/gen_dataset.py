@@ -0,0 +1,249 @@
+"""
+Synthetic large-dataset generator for ZYLO LINK.
+
+Fills a ZYLO_chat.db (schema from message.init_db) with realistic, skewed data:
+
+* room sizes: mostly DMs, groups with a Pareto size tail, a few large channels
+* membership: a handful of users sit in far more rooms than the rest
+* traffic: messages land on rooms by a Zipf law, so a few rooms hold most history,
+  interleaved in time across rooms like real traffic; only the most recent
+  slice is still unread
+
+Rows go in through executemany in large transactions with the message indexes
+dropped, and the indexes are rebuilt from their saved definitions afterwards.
+init_db() then runs once more and its time is reported, since it is what the
+next server start will pay.
+
+    python benchmarks/gen_dataset.py --db big/ZYLO_chat.db                       # 100k users, 50k rooms, 20M messages
+    python benchmarks/gen_dataset.py --db small.db --users 2000 --rooms 1000 --messages 200000
+"""
+import argparse
+import bisect
+import datetime
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BATCH = 100_000
+MESSAGE_INDEXES = ("idx_messages_room_time", "idx_messages_sender", "idx_messages_room_seq", "idx_messages_room_timestamp")
+WORDS = ("ok sure lol thanks see you tomorrow meeting call later sounds good what about the "
+         "deploy build failed again fixed it nice lunch coffee weekend plan review merge").split()
+
+
+def load_app():
+    # message.py creates its DB and upload folder relative to the CWD
+    os.chdir(tempfile.mkdtemp(prefix="zylo_gen_"))
+    sys.path.insert(0, ROOT)
+    import message
+    return message
+
+
+def zipf_cum_weights(n, s, rng):
+    # Ranks are shuffled so the heavy entries are spread across ids and kinds
+    ranks = list(range(1, n + 1))
+    rng.shuffle(ranks)
+    return list(itertools.accumulate(1.0 / r ** s for r in ranks))
+
+
+def pareto_size(rng, alpha, low, high):
+    return max(low, min(high, int(low * rng.paretovariate(alpha))))
+
+
+def user_id(i):
+    return f"U{i:09d}"
+
+
+def build_rooms(args, rng):
+    user_weights = zipf_cum_weights(args.users, args.membership_skew, rng)
+    total = user_weights[-1]
+
+    def pick_users(k):
+        if k > args.users // 4:
+            return rng.sample(range(args.users), k)
+        picked = set()
+        while len(picked) < k:
+            picked.add(bisect.bisect_left(user_weights, rng.random() * total))
+        return list(picked)
+
+    n_channels = int(args.rooms * args.channel_share)
+    n_groups = int(args.rooms * args.group_share)
+    n_dms = args.rooms - n_channels - n_groups
+    rooms = []  # (room_id, kind, members, name)
+
+    dm_pairs = set()
+    while len(dm_pairs) < n_dms:
+        a, b = pick_users(2)
+        dm_pairs.add((min(a, b), max(a, b)))
+    for a, b in dm_pairs:
+        ua, ub = user_id(a), user_id(b)
+        rooms.append(("_".join(sorted([ua, ub])), "dm", [a, b], None))
+    for g in range(n_groups):
+        size = pareto_size(rng, 1.5, 3, min(args.max_group, args.users))
+        rooms.append((f"G{g:09d}", "group", pick_users(size), f"Group {g}"))
+    for ch in range(n_channels):
+        size = pareto_size(rng, 1.2, 50, min(args.max_channel, args.users))
+        rooms.append((f"C{ch:09d}", "channel", pick_users(size), f"Channel {ch}"))
+    return rooms
+
+
+def insert_batches(conn, sql, rows):
+    count = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH:
+            conn.executemany(sql, batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        conn.executemany(sql, batch)
+        count += len(batch)
+    return count
+
+
+def generate(db_path, args, log=print):
+    rng = random.Random(args.seed)
+    m = load_app()
+    m.DB_FILE = os.path.abspath(db_path)
+    if os.path.exists(m.DB_FILE):
+        raise SystemExit(f"{m.DB_FILE} already exists; refusing to append to it")
+    m.init_db()
+
+    conn = m.sqlite3.connect(m.DB_FILE)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA cache_size=-262144")
+    index_sql = [row[0] for row in conn.execute(
+        f"SELECT sql FROM sqlite_master WHERE type='index' AND name IN ({','.join('?' * len(MESSAGE_INDEXES))})",
+        MESSAGE_INDEXES)]
+    for name in MESSAGE_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+    timings = {}
+
+    start = time.perf_counter()
+    insert_batches(conn, "INSERT INTO users (user_id, username, password) VALUES (?, ?, ?)",
+                   ((user_id(i), f"user{i}", f"pw{i}") for i in range(args.users)))
+    conn.commit()
+    timings['users'] = time.perf_counter() - start
+    log(f"users       {args.users:>12,} in {timings['users']:.1f}s")
+
+    start = time.perf_counter()
+    rooms = build_rooms(args, rng)
+    room_rows, participant_rows, channel_rows = [], [], []
+    for room_id, kind, members, name in rooms:
+        if kind == "channel":
+            room_rows.append((room_id, name, 1, 1))
+            channel_rows.extend((room_id, user_id(u), 1 if i == 0 else 0) for i, u in enumerate(members))
+            continue
+        room_rows.append((room_id, name, 1 if kind == "group" else 0, 0))
+        for u in members:
+            if kind == "dm":
+                other = members[1] if u == members[0] else members[0]
+                participant_rows.append((room_id, user_id(u), f"user{other}"))
+            else:
+                participant_rows.append((room_id, user_id(u), name))
+    conn.executemany("INSERT INTO rooms (room_id, room_name, is_group, is_channel) VALUES (?, ?, ?, ?)", room_rows)
+    insert_batches(conn, "INSERT INTO chat_participants (room_id, user_id, chat_name) VALUES (?, ?, ?)", participant_rows)
+    insert_batches(conn, "INSERT INTO channel_members (room_id, user_id, can_post) VALUES (?, ?, ?)", channel_rows)
+    conn.commit()
+    timings['rooms'] = time.perf_counter() - start
+    log(f"rooms       {len(rooms):>12,} in {timings['rooms']:.1f}s "
+        f"({len(participant_rows):,} participants, {len(channel_rows):,} channel members)")
+
+    start = time.perf_counter()
+    room_weights = zipf_cum_weights(len(rooms), args.room_skew, rng)
+    room_index = range(len(rooms))
+    senders = [[user_id(u) for u in (members[:1] if kind == "channel" else members)]
+               for _, kind, members, _ in rooms]
+    seqs = [0] * len(rooms)
+    last_ids = [0] * len(rooms)
+    begin = datetime.datetime.now() - datetime.timedelta(days=args.days)
+    step = args.days * 86400 / max(args.messages, 1)
+    unread_from = int(args.messages * (1 - args.unread_share))
+
+    def message_rows():
+        msg_id = 0
+        stamp_second, stamp = None, None
+        while msg_id < args.messages:
+            k = min(BATCH, args.messages - msg_id)
+            for r in rng.choices(room_index, cum_weights=room_weights, k=k):
+                msg_id += 1
+                seqs[r] += 1
+                last_ids[r] = msg_id
+                second = int(msg_id * step)
+                if second != stamp_second:
+                    stamp_second = second
+                    stamp = int((begin + datetime.timedelta(seconds=second)).timestamp() * 1000)
+                roll = rng.random()
+                if roll < 0.03:
+                    msg_type, content, filename = 'image/png', f"/uploads/{msg_id}_photo.png", 'photo.png'
+                elif roll < 0.04:
+                    msg_type, content, filename = 'application/pdf', f"/uploads/{msg_id}_doc.pdf", 'doc.pdf'
+                else:
+                    msg_type, filename = 'text', ''
+                    content = " ".join(rng.choices(WORDS, k=1 + int(rng.expovariate(0.15))))
+                sender = senders[r]
+                yield (msg_id, rooms[r][0], sender[int(rng.random() * len(sender))], msg_type, content,
+                       filename, stamp, 'sent' if msg_id > unread_from else 'read', seqs[r])
+            if msg_id % 1_000_000 == 0:
+                log(f"  messages  {msg_id:>12,} ({msg_id / (time.perf_counter() - start):,.0f}/s)")
+
+    insert_batches(conn, """
+        INSERT INTO messages (id, room_id, sender_id, msg_type, content, filename, timestamp, status, seq)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, message_rows())
+    conn.executemany("UPDATE rooms SET seq=?, last_msg_id=? WHERE room_id=?",
+                     [(seqs[i], last_ids[i], rooms[i][0]) for i in room_index if seqs[i]])
+    conn.commit()
+    timings['messages'] = time.perf_counter() - start
+    log(f"messages    {args.messages:>12,} in {timings['messages']:.1f}s "
+        f"({args.messages / max(timings['messages'], 1e-9):,.0f}/s)")
+
+    start = time.perf_counter()
+    for sql in index_sql:
+        conn.execute(sql)
+    conn.commit()
+    timings['indexes'] = time.perf_counter() - start
+    log(f"indexes     {len(index_sql):>12} rebuilt in {timings['indexes']:.1f}s")
+    conn.execute("PRAGMA journal_mode=DELETE")
+    conn.close()
+
+    start = time.perf_counter()
+    m.init_db()
+    timings['init_db'] = time.perf_counter() - start
+    log(f"init_db     {timings['init_db'] * 1000:.1f} ms on the full database")
+    log(f"db size     {os.path.getsize(m.DB_FILE) / 1e6:,.1f} MB -> {m.DB_FILE}")
+    return timings
+
+
+def add_arguments(parser):
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--rooms', type=int, default=50_000)
+    parser.add_argument('--messages', type=int, default=20_000_000)
+    parser.add_argument('--group-share', type=float, default=0.25, help="fraction of rooms that are groups")
+    parser.add_argument('--channel-share', type=float, default=0.01, help="fraction of rooms that are channels")
+    parser.add_argument('--max-group', type=int, default=500)
+    parser.add_argument('--max-channel', type=int, default=50_000)
+    parser.add_argument('--room-skew', type=float, default=1.1, help="Zipf exponent of messages per room")
+    parser.add_argument('--membership-skew', type=float, default=0.8, help="Zipf exponent of rooms per user")
+    parser.add_argument('--unread-share', type=float, default=0.002, help="newest fraction left unread")
+    parser.add_argument('--days', type=int, default=365, help="history span")
+    parser.add_argument('--seed', type=int, default=42)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='ZYLO_chat.db', help="database file to create")
+    add_arguments(parser)
+    args = parser.parse_args()
+    db_path = os.path.abspath(args.db)
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    generate(db_path, args)
+
+
+if __name__ == "__main__":
+    main()
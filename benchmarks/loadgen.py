@@ -0,0 +1,502 @@
+"""
+Socket.IO load generator for ZYLO LINK.
+
+Simulates N users spread across M DMs and groups, each following the real client
+flow (auth -> connect with the session token -> get_chats -> join_room) and then sending messages, typing
+and marking rooms read at the rates declared in a scenario file. Every message
+carries its send time, so each receiving socket records send->receive latency.
+
+By default a fresh server is started from message.py in a temp directory on a
+free port, so its CPU, RSS and database size can be sampled too.
+
+    python benchmarks/loadgen.py benchmarks/scenarios/smoke.json
+    python benchmarks/loadgen.py benchmarks/scenarios/team.json --out team.json --compare baseline.json
+    python benchmarks/loadgen.py benchmarks/scenarios/soak.json --soak 4 --out soak.json
+    python benchmarks/loadgen.py benchmarks/scenarios/team.json --url http://10.0.0.5:5000
+
+Needs the python-socketio client (pip install "python-socketio[client]"); psutil is
+used for server stats when installed, /proc otherwise.
+"""
+import argparse
+import heapq
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+import socketio
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_SCENARIO = {
+    "name": "default",
+    "users": 20,
+    "dms": 20,
+    "groups": 2,
+    "group_size": 5,
+    "duration": 30,
+    "warmup": 3,
+    "report_interval": 5,
+    # Per-user rates, in events per second
+    "rates": {"send_message": 0.2, "typing": 0.2, "mark_read": 0.1, "get_chats": 0.02},
+    "message_bytes": 60,
+}
+
+
+def load_scenario(path):
+    scenario = dict(DEFAULT_SCENARIO)
+    if path:
+        with open(path) as f:
+            custom = json.load(f)
+        scenario.update({k: v for k, v in custom.items() if k != "rates"})
+        scenario["rates"] = dict(DEFAULT_SCENARIO["rates"], **custom.get("rates", {}))
+    return scenario
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    k = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+def latency_summary(values):
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": values[-1] if values else None,
+    }
+
+
+# ---------------------------
+# Server process & stats
+# ---------------------------
+class ProcessStats:
+    def __init__(self, pid):
+        self.pid = pid
+        self.last = None
+        try:
+            import psutil
+            self.proc = psutil.Process(pid)
+        except ImportError:
+            self.proc = None
+        self.ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+    def _cpu_seconds(self):
+        if self.proc:
+            t = self.proc.cpu_times()
+            return t.user + t.system
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / self.ticks
+
+    def _rss_mb(self):
+        if self.proc:
+            return self.proc.memory_info().rss / 1e6
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1e3
+        return None
+
+    def sample(self):
+        try:
+            now, cpu = time.time(), self._cpu_seconds()
+            rss = self._rss_mb()
+        except (OSError, IndexError, ValueError):
+            return {"cpu_percent": None, "rss_mb": None}
+        cpu_percent = None
+        if self.last:
+            cpu_percent = 100.0 * (cpu - self.last[1]) / max(now - self.last[0], 1e-6)
+        self.last = (now, cpu)
+        return {"cpu_percent": cpu_percent, "rss_mb": rss}
+
+
+class LocalServer:
+    def __init__(self, port=None):
+        self.port = port or free_port()
+        self.workdir = tempfile.mkdtemp(prefix="zylo_load_")
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.proc = None
+
+    def start(self, timeout=30):
+        env = dict(os.environ, PORT=str(self.port), PYTHONWARNINGS="ignore")
+        self.log = open(os.path.join(self.workdir, "server.log"), "w")
+        self.proc = subprocess.Popen([sys.executable, os.path.join(ROOT, "message.py")],
+                                     cwd=self.workdir, env=env, stdout=self.log, stderr=subprocess.STDOUT)
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"server exited early, see {self.log.name}")
+            try:
+                requests.get(self.url + "/", timeout=1)
+                return
+            except requests.RequestException:
+                time.sleep(0.2)
+        raise RuntimeError("server did not start in time")
+
+    def db_size_mb(self):
+        total = 0
+        for suffix in ("", "-wal", "-shm"):
+            path = os.path.join(self.workdir, "ZYLO_chat.db" + suffix)
+            if os.path.exists(path):
+                total += os.path.getsize(path)
+        return total / 1e6
+
+    def stop(self):
+        if self.proc and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+        if self.proc:
+            self.log.close()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# ---------------------------
+# Virtual users
+# ---------------------------
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.measuring = False
+        self.latencies = []
+        self.window = []
+        self.sent = {}
+        self.received = {}
+        self.window_sent = 0
+        self.window_received = 0
+        self.errors = 0
+
+    def on_sent(self, event):
+        with self.lock:
+            if self.measuring:
+                self.sent[event] = self.sent.get(event, 0) + 1
+                self.window_sent += 1
+
+    def on_received(self, event, latency_ms=None):
+        with self.lock:
+            if not self.measuring:
+                return
+            self.received[event] = self.received.get(event, 0) + 1
+            self.window_received += 1
+            if latency_ms is not None:
+                self.latencies.append(latency_ms)
+                self.window.append(latency_ms)
+
+    def drain_window(self):
+        with self.lock:
+            window, sent, received = self.window, self.window_sent, self.window_received
+            self.window, self.window_sent, self.window_received = [], 0, 0
+        return window, sent, received
+
+
+class VirtualUser:
+    def __init__(self, index, url, run_tag, recorder):
+        self.index = index
+        self.url = url
+        self.name = f"lg_{run_tag}_{index}"
+        self.recorder = recorder
+        self.rooms = []
+        self.created = []
+        self.created_event = threading.Event()
+        self.sio = socketio.Client(reconnection=True)
+        self.sio.on('message', self._on_message)
+        self.sio.on('chat_created', self._on_chat_created)
+        self.sio.on('error', self._on_error)
+        for event in ('chat_list', 'room_delta', 'history', 'typing_status', 'refresh_sidebar', 'messages_read'):
+            self.sio.on(event, self._counter(event))
+
+    def _counter(self, event):
+        return lambda *args: self.recorder.on_received(event)
+
+    def _on_message(self, msg):
+        latency = None
+        content = msg.get('content') or ''
+        if content.startswith('lg '):
+            try:
+                latency = (time.time() - float(content.split(' ', 3)[2])) * 1000
+            except (IndexError, ValueError):
+                pass
+        self.recorder.on_received('message', latency)
+        if msg.get('trace'):
+            # Answer traced messages like the browser does (no render step here)
+            self.sio.emit('trace_report', {'trace': msg['trace'], 'message_id': msg.get('id'),
+                                           'user_id': self.user_id, 'received_at': time.time() * 1000})
+
+    def _on_chat_created(self, data):
+        self.created.append(data)
+        self.created_event.set()
+
+    def _on_error(self, data):
+        with self.recorder.lock:
+            self.recorder.errors += 1
+
+    def login(self):
+        res = requests.post(self.url + "/auth", json={"name": self.name, "pass": "load"}, timeout=30).json()
+        self.user_id = res['user']['id']
+        try:
+            self.sio.connect(self.url, transports=['websocket'], auth={'token': res['token']})
+        except (socketio.exceptions.ConnectionError, ValueError):
+            # websocket-client not installed: fall back to long-polling
+            self.sio.connect(self.url, transports=['polling'], auth={'token': res['token']})
+        self.emit('get_chats', {'user_id': self.user_id})
+
+    def emit(self, event, data):
+        self.sio.emit(event, data)
+        self.recorder.on_sent(event)
+
+    def wait_created(self, timeout=30):
+        if not self.created_event.wait(timeout):
+            raise RuntimeError(f"{self.name}: no chat_created within {timeout}s")
+        self.created_event.clear()
+        return self.created.pop(0)
+
+
+def build_rooms(users, scenario, rng):
+    rooms = []
+    pairs = set()
+    for _ in range(scenario['dms']):
+        for _attempt in range(20):
+            a, b = rng.sample(users, 2)
+            key = tuple(sorted((a.index, b.index)))
+            if key not in pairs:
+                break
+        pairs.add(key)
+        a.emit('create_chat', {'my_id': a.user_id, 'target_id': b.user_id})
+        room_id = a.wait_created()['room_id']
+        rooms.append((room_id, [a, b]))
+
+    size = max(3, min(scenario['group_size'], len(users)))
+    for _ in range(scenario['groups']):
+        members = rng.sample(users, size)
+        owner = members[0]
+        owner.emit('create_chat', {'my_id': owner.user_id, 'target_id': members[1].user_id})
+        dm = owner.wait_created()['room_id']
+        owner.emit('add_members', {'room_id': dm, 'user_id': owner.user_id,
+                                   'target_ids': [m.user_id for m in members[2:]]})
+        rooms.append((owner.wait_created()['room_id'], members))
+
+    for room_id, members in rooms:
+        for member in members:
+            member.rooms.append(room_id)
+            member.emit('join_room', {'room_id': room_id, 'user_id': member.user_id, 'since_seq': 0})
+    return rooms
+
+
+# ---------------------------
+# Traffic
+# ---------------------------
+def run_traffic(users, scenario, recorder, duration, on_interval, rng):
+    rates = scenario['rates']
+    active = [u for u in users if u.rooms]
+    actions = [(name, rate * len(active)) for name, rate in rates.items() if rate > 0]
+    total_rate = sum(rate for _, rate in actions)
+    if not active or total_rate <= 0:
+        raise RuntimeError("scenario has no active users or no traffic")
+    padding = 'x' * max(0, scenario['message_bytes'] - 40)
+    delayed = []  # (due, user, event, data) heap for stop_typing
+    counter = 0
+
+    start = time.time()
+    next_event = start
+    next_report = start + scenario['report_interval']
+    while True:
+        now = time.time()
+        if now - start >= duration:
+            break
+        while delayed and delayed[0][0] <= now:
+            _, _, user, event, data = heapq.heappop(delayed)
+            user.emit(event, data)
+        if now >= next_report:
+            on_interval(now - start)
+            next_report += scenario['report_interval']
+        if now < next_event:
+            time.sleep(min(next_event - now, 0.01))
+            continue
+
+        # Poisson arrivals across all users, action picked by its share of the rate
+        next_event += rng.expovariate(total_rate)
+        user = rng.choice(active)
+        room_id = rng.choice(user.rooms)
+        pick = rng.random() * total_rate
+        for action, rate in actions:
+            pick -= rate
+            if pick <= 0:
+                break
+        counter += 1
+        if action == 'send_message':
+            user.emit('send_message', {'room_id': room_id, 'sender_id': user.user_id, 'type': 'text',
+                                       'content': f"lg {counter} {time.time():.6f} {padding}",
+                                       'client_sent_at': time.time() * 1000})
+        elif action == 'typing':
+            user.emit('typing', {'room_id': room_id, 'user_id': user.user_id})
+            heapq.heappush(delayed, (time.time() + 1.0, counter, user, 'stop_typing',
+                                     {'room_id': room_id, 'user_id': user.user_id}))
+        elif action == 'mark_read':
+            user.emit('mark_read', {'room_id': room_id, 'user_id': user.user_id})
+        elif action == 'get_chats':
+            user.emit('get_chats', {'user_id': user.user_id})
+
+
+def compare(results, baseline_path, max_regression):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    checks = [
+        ("latency p50 ms", results['latency_ms']['p50'], baseline['latency_ms']['p50'], True),
+        ("latency p95 ms", results['latency_ms']['p95'], baseline['latency_ms']['p95'], True),
+        ("latency p99 ms", results['latency_ms']['p99'], baseline['latency_ms']['p99'], True),
+        ("received events/s", results['events_per_sec']['received'], baseline['events_per_sec']['received'], False),
+        ("server cpu % mean", results['server']['cpu_percent_mean'], baseline['server']['cpu_percent_mean'], True),
+    ]
+    regressed = False
+    print(f"\n{'metric':<20}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name, current, base, higher_is_worse in checks:
+        if current is None or not base:
+            continue
+        change = (current - base) / base * 100
+        worse = change > max_regression if higher_is_worse else change < -max_regression
+        regressed |= worse
+        print(f"{name:<20}{base:>12.2f}{current:>12.2f}{change:>9.1f}%{'  REGRESSION' if worse else ''}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('scenario', nargs='?', help="scenario JSON (see benchmarks/scenarios/)")
+    parser.add_argument('--url', help="target an already running server instead of starting one")
+    parser.add_argument('--out', help="write results JSON here (rewritten every interval in soak mode)")
+    parser.add_argument('--compare', help="baseline results JSON to compare against")
+    parser.add_argument('--max-regression', type=float, default=10.0, help="allowed change in percent")
+    parser.add_argument('--soak', type=float, help="run for this many hours, reporting every interval")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    scenario = load_scenario(args.scenario)
+    duration = args.soak * 3600 if args.soak else scenario['duration']
+    if args.soak and not (args.scenario and 'report_interval' in json.load(open(args.scenario))):
+        scenario['report_interval'] = 60
+    rng = random.Random(args.seed)
+
+    server = None
+    if args.url:
+        url = args.url.rstrip('/')
+    else:
+        server = LocalServer()
+        server.start()
+        url = server.url
+    stats = ProcessStats(server.proc.pid) if server else None
+
+    recorder = Recorder()
+    run_tag = f"{int(time.time())}{rng.randint(0, 999)}"
+    users = [VirtualUser(i, url, run_tag, recorder) for i in range(scenario['users'])]
+    results = {"scenario": scenario, "url": url, "started": time.strftime('%Y-%m-%dT%H:%M:%S'),
+               "soak_hours": args.soak, "timeline": []}
+    try:
+        print(f"[{scenario['name']}] logging in {len(users)} users...")
+        for user in users:
+            user.login()
+        rooms = build_rooms(users, scenario, rng)
+        print(f"[{scenario['name']}] {len(rooms)} rooms ready, warming up {scenario['warmup']}s")
+        if stats:
+            stats.sample()
+
+        cpu_samples, rss_samples = [], []
+
+        def on_interval(elapsed):
+            window, sent, received = recorder.drain_window()
+            if not recorder.measuring:
+                return
+            point = {"t": round(elapsed, 1), "sent_eps": sent / scenario['report_interval'],
+                     "received_eps": received / scenario['report_interval'], **latency_summary(window)}
+            if stats:
+                point.update(stats.sample())
+                if point['cpu_percent'] is not None:
+                    cpu_samples.append(point['cpu_percent'])
+                if point['rss_mb'] is not None:
+                    rss_samples.append(point['rss_mb'])
+            results['timeline'].append(point)
+            p = lambda v: f"{v:.1f}" if v is not None else "-"
+            print(f"  t={point['t']:>7}s sent/s={point['sent_eps']:.0f} recv/s={point['received_eps']:.0f} "
+                  f"p50={p(point['p50'])} p95={p(point['p95'])} p99={p(point['p99'])} ms "
+                  f"cpu={p(point.get('cpu_percent'))}% rss={p(point.get('rss_mb'))}MB")
+            if args.soak and args.out:
+                write_results(results, recorder, cpu_samples, rss_samples, server, elapsed, args.out)
+
+        run_traffic(users, scenario, recorder, scenario['warmup'], lambda _: None, rng)
+        recorder.drain_window()
+        recorder.measuring = True
+        started = time.time()
+        run_traffic(users, scenario, recorder, duration, on_interval, rng)
+        time.sleep(1)  # let in-flight messages land
+        recorder.measuring = False
+        write_results(results, recorder, cpu_samples, rss_samples, server, time.time() - started, args.out)
+    finally:
+        for user in users:
+            if user.sio.connected:
+                user.sio.disconnect()
+        if server:
+            server.stop()
+
+    lat, eps = results['latency_ms'], results['events_per_sec']
+    print(f"\n[{scenario['name']}] {results['duration_s']:.0f}s, {lat['count']} deliveries")
+    print(f"  latency ms  p50={lat['p50']:.2f} p95={lat['p95']:.2f} p99={lat['p99']:.2f} max={lat['max']:.2f}"
+          if lat['count'] else "  no messages delivered")
+    print(f"  events/s    sent={eps['sent']:.1f} received={eps['received']:.1f}  errors={results['errors']}")
+    srv = results['server']
+    if srv['cpu_percent_mean'] is not None:
+        print(f"  server      cpu mean={srv['cpu_percent_mean']:.1f}% max={srv['cpu_percent_max']:.1f}% "
+              f"rss end={srv['rss_mb_end']:.1f}MB max={srv['rss_mb_max']:.1f}MB db={results['db_size_mb']:.2f}MB")
+
+    if args.compare and compare(results, args.compare, args.max_regression):
+        sys.exit(1)
+
+
+def write_results(results, recorder, cpu_samples, rss_samples, server, elapsed, out):
+    with recorder.lock:
+        latencies = list(recorder.latencies)
+        sent, received = dict(recorder.sent), dict(recorder.received)
+        errors = recorder.errors
+    elapsed = max(elapsed, 1e-6)
+    results.update({
+        "duration_s": elapsed,
+        "latency_ms": latency_summary(latencies),
+        "events_per_sec": {
+            "sent": sum(sent.values()) / elapsed,
+            "received": sum(received.values()) / elapsed,
+            "sent_by_event": {k: v / elapsed for k, v in sent.items()},
+            "received_by_event": {k: v / elapsed for k, v in received.items()},
+        },
+        "server": {
+            "cpu_percent_mean": sum(cpu_samples) / len(cpu_samples) if cpu_samples else None,
+            "cpu_percent_max": max(cpu_samples) if cpu_samples else None,
+            "rss_mb_start": rss_samples[0] if rss_samples else None,
+            "rss_mb_end": rss_samples[-1] if rss_samples else None,
+            "rss_mb_max": max(rss_samples) if rss_samples else None,
+        },
+        "db_size_mb": server.db_size_mb() if server else None,
+        "errors": errors,
+    })
+    if out:
+        with open(out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+Replays socket traffic recorded with ZYLO_RECORD_FILE against a fresh server.
+
+The recording holds every inbound socket event with its time offset, the
+connection it came from and an anonymized payload. Replay first creates a user
+for every recorded user token and rebuilds the recorded DMs, groups and channels
+through the normal socket events, then opens one client per recorded connection,
+authenticated as the user its login was recorded for, and sends each event at
+its recorded offset divided by --speed. Connections are opened before the clock
+starts and closed at their recorded disconnect.
+
+Message text keeps its recorded length but carries its send time, so receivers
+measure send->receive latency the same way loadgen.py does. Edits and deletes
+target the sender's latest replayed message in the room. The "schedule lag"
+line shows how far the replayer itself fell behind; when it is large the run
+measured the client, not the server.
+
+    ZYLO_RECORD_FILE=traffic.jsonl.gz python message.py
+    python benchmarks/replay.py traffic.jsonl.gz --out before.json
+    python benchmarks/replay.py traffic.jsonl.gz --speed 5 --compare before.json --max-regression 10
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from loadgen import LocalServer, ProcessStats, Recorder, VirtualUser, compare, latency_summary, write_results
+
+import requests
+
+ID_KEYS = {'user_id', 'my_id', 'target_id', 'target_ids', 'sender_id', 'room_id'}
+MESSAGE_ID_EVENTS = {'delete_message', 'edit_message'}
+STATS_INTERVAL = 5
+
+
+def load_recording(path):
+    header, definitions, events = None, [], []
+    try:
+        with gzip.open(path, 'rt') as f:
+            for line in f:
+                record = json.loads(line)
+                if isinstance(record, dict):
+                    header = header or record
+                elif record[2].startswith('@'):
+                    definitions.append(record)
+                else:
+                    events.append(record)
+    except (EOFError, zlib.error):
+        pass  # the server was killed mid-flush; everything before it is intact
+    if not header:
+        raise SystemExit(f"{path} is not a ZYLO_RECORD_FILE recording")
+    events.sort(key=lambda e: e[0])
+    return header, definitions, events
+
+
+class ReplayConnection(VirtualUser):
+    def __init__(self, token, url, recorder, latest):
+        super().__init__(token, url, 'replay', recorder)
+        self.latest = latest
+
+    def connect(self, user_id, session_token):
+        self.user_id = user_id
+        self.sio.connect(self.url, transports=['websocket'], auth={'token': session_token})
+
+    def _on_message(self, msg):
+        super()._on_message(msg)
+        if msg.get('id'):
+            self.latest[(msg.get('room_id'), msg.get('sender_id'))] = msg['id']
+
+
+class Replay:
+    def __init__(self, url, recorder, run_tag):
+        self.url, self.recorder, self.run_tag = url, recorder, run_tag
+        self.ids = {}
+        self.session_tokens = {}  # replayed user id -> token from /auth
+        self.latest = {}  # (room_id, sender_id) -> latest message id seen
+        self.connections = {}
+        self.counter = 0
+        self.skipped = 0
+        self.lag_ms = []
+
+    def create_users(self, definitions):
+        tokens = {d[3]['id'] for d in definitions if d[2] == '@user'}
+        for d in definitions:
+            if d[2] == '@room':
+                tokens.update(d[3]['members'])
+        for token in sorted(tokens, key=lambda t: int(t[1:])):
+            res = requests.post(self.url + "/auth", json={"name": f"rp_{self.run_tag}_{token}", "pass": "replay"},
+                                timeout=30).json()
+            self.ids[token] = res['user']['id']
+            self.session_tokens[res['user']['id']] = res['token']
+
+    def create_rooms(self, definitions):
+        # Rooms are created by the user who owns them, so every creator gets a setup socket
+        setups = {}
+
+        def setup_as(user_id):
+            if user_id not in setups:
+                setups[user_id] = ReplayConnection('setup', self.url, self.recorder, self.latest)
+                setups[user_id].connect(user_id, self.session_tokens[user_id])
+            return setups[user_id]
+
+        built = 0
+        for _, _, kind, room in definitions:
+            if kind != '@room' or len(room['members']) < (1 if room['kind'] == 'channel' else 2):
+                continue
+            members = [self.ids[m] for m in room['members']]
+            if room['kind'] == 'channel':
+                owner = self.ids[room['posters'][0]] if room['posters'] else members[0]
+                setup_as(owner).sio.emit('create_channel', {'name': f"replay {room['id']}"})
+                room_id = setup_as(owner).wait_created()['room_id']
+                for member in members:
+                    if member != owner:
+                        setup_as(member).sio.emit('create_chat', {'target_id': room_id})
+                        setup_as(member).wait_created()
+            else:
+                creator = setup_as(members[0])
+                creator.sio.emit('create_chat', {'target_id': members[1]})
+                room_id = creator.wait_created()['room_id']
+                if room['kind'] == 'group':
+                    creator.sio.emit('add_members', {'room_id': room_id, 'target_ids': members[2:]})
+                    room_id = creator.wait_created()['room_id']
+            self.ids[room['id']] = room_id
+            built += 1
+        for setup in setups.values():
+            setup.sio.disconnect()
+        return built
+
+    def translate(self, value, key=None):
+        if isinstance(value, dict):
+            return {k: self.translate(v, k) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.translate(v, key) for v in value]
+        if isinstance(value, str) and key in ID_KEYS:
+            return self.ids.get(value, value)
+        return value
+
+    def open_connections(self, events):
+        # Connecting blocks for a round trip, so every socket is opened before the clock starts.
+        # The server records a connection's user as a login event once its token is verified.
+        for _, conn_token, event, payload in events:
+            if event == 'login' and conn_token not in self.connections:
+                user_id = self.translate(payload)['user_id']
+                if user_id in self.session_tokens:
+                    conn = self.connections[conn_token] = ReplayConnection(conn_token, self.url, self.recorder, self.latest)
+                    conn.connect(user_id, self.session_tokens[user_id])
+
+    def send(self, conn_token, event, payload):
+        conn = self.connections.get(conn_token)
+        if conn is None:
+            self.skipped += 1  # never logged in: the server would have refused it
+            return
+        if event in ('connect', 'login'):
+            return
+        if event == 'disconnect':
+            conn.sio.disconnect()
+            del self.connections[conn_token]
+            return
+        data = self.translate(payload) if payload is not None else {}
+        if event == 'send_message':
+            self.counter += 1
+            stamp = f"lg {self.counter} {time.time():.6f} "
+            data['content'] = stamp + 'x' * (len(data.get('content') or '') - len(stamp))
+            data['client_sent_at'] = time.time() * 1000
+        elif event in MESSAGE_ID_EVENTS:
+            message_id = self.latest.get((data.get('room_id'), conn.user_id))
+            if message_id is None:
+                self.skipped += 1
+                return
+            data['message_id'] = message_id
+        conn.emit(event, data)
+
+    def run(self, events, speed, on_interval):
+        origin = events[0][0]
+        start = time.time()
+        next_stats = start + STATS_INTERVAL
+        for ms, conn_token, event, payload in events:
+            due = start + (ms - origin) / 1000 / speed
+            now = time.time()
+            if now < due:
+                time.sleep(due - now)
+            self.lag_ms.append(max(0.0, time.time() - due) * 1000)
+            self.send(conn_token, event, payload)
+            if time.time() >= next_stats:
+                on_interval()
+                next_stats += STATS_INTERVAL
+
+    def close(self):
+        for conn in self.connections.values():
+            if conn.sio.connected:
+                conn.sio.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('recording', help="file written via ZYLO_RECORD_FILE")
+    parser.add_argument('--speed', type=float, default=1.0, help="replay this many times faster than recorded")
+    parser.add_argument('--url', help="target an already running server instead of starting one")
+    parser.add_argument('--out', help="write results JSON here (same shape as loadgen.py)")
+    parser.add_argument('--compare', help="baseline results JSON to compare against")
+    parser.add_argument('--max-regression', type=float, default=10.0, help="allowed change in percent")
+    args = parser.parse_args()
+
+    header, definitions, events = load_recording(args.recording)
+    if not events:
+        raise SystemExit("recording has no events")
+    recorded_s = (events[-1][0] - events[0][0]) / 1000
+    print(f"{len(events)} events over {recorded_s:.1f}s from {header.get('started')}, "
+          f"{sum(1 for d in definitions if d[2] == '@room')} rooms, replaying at {args.speed:g}x")
+
+    server = None
+    if args.url:
+        url = args.url.rstrip('/')
+    else:
+        server = LocalServer()
+        server.start()
+        url = server.url
+    stats = ProcessStats(server.proc.pid) if server else None
+    cpu_samples, rss_samples = [], []
+
+    def on_interval():
+        if stats:
+            sample = stats.sample()
+            if sample['cpu_percent'] is not None:
+                cpu_samples.append(sample['cpu_percent'])
+            if sample['rss_mb'] is not None:
+                rss_samples.append(sample['rss_mb'])
+
+    recorder = Recorder()
+    replay = Replay(url, recorder, f"{int(time.time())}{random.randint(0, 999)}")
+    results = {"recording": os.path.abspath(args.recording), "speed": args.speed, "url": url,
+               "started": time.strftime('%Y-%m-%dT%H:%M:%S')}
+    try:
+        replay.create_users(definitions)
+        rooms = replay.create_rooms(definitions)
+        replay.open_connections(events)
+        print(f"{len(replay.ids) - rooms} users, {rooms} rooms and {len(replay.connections)} connections ready")
+        if stats:
+            stats.sample()
+        recorder.measuring = True
+        started = time.time()
+        replay.run(events, args.speed, on_interval)
+        time.sleep(1)  # let in-flight messages land
+        on_interval()
+        recorder.measuring = False
+        results['schedule_lag_ms'] = latency_summary(replay.lag_ms)
+        results['skipped'] = replay.skipped
+        write_results(results, recorder, cpu_samples, rss_samples, server, time.time() - started, args.out)
+    finally:
+        replay.close()
+        if server:
+            server.stop()
+
+    lat, eps, lag = results['latency_ms'], results['events_per_sec'], results['schedule_lag_ms']
+    print(f"\n{results['duration_s']:.1f}s, {lat['count']} deliveries, {replay.skipped} events skipped")
+    print(f"  latency ms       p50={lat['p50']:.2f} p95={lat['p95']:.2f} p99={lat['p99']:.2f} max={lat['max']:.2f}"
+          if lat['count'] else "  no messages delivered")
+    print(f"  schedule lag ms  p50={lag['p50']:.2f} p99={lag['p99']:.2f} max={lag['max']:.2f}")
+    print(f"  events/s         sent={eps['sent']:.1f} received={eps['received']:.1f}  errors={results['errors']}")
+    srv = results['server']
+    if srv['cpu_percent_mean'] is not None:
+        print(f"  server           cpu mean={srv['cpu_percent_mean']:.1f}% max={srv['cpu_percent_max']:.1f}% "
+              f"rss max={srv['rss_mb_max']:.1f}MB")
+
+    if args.compare and compare(results, args.compare, args.max_regression):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Latency breakdown from message trace spans.
+
+Reads the OTLP/JSON lines message.py writes to ZYLO_TRACE_FILE and prints, per
+stage, p50/p95/p99/max durations across all traced messages, then a waterfall for
+the slowest messages.
+
+Client spans use the browser's clock. Durations inside one client span (receive ->
+render) are exact; the derived "client.delivery" (server emit -> browser receive)
+and "client.send" (browser send -> server handler) mix two clocks and are only
+meaningful when they are in sync (same machine, or NTP).
+
+    ZYLO_TRACE_FILE=spans.jsonl python message.py
+    python benchmarks/trace_report.py spans.jsonl --slowest 5
+"""
+import argparse
+import collections
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from loadgen import latency_summary
+
+
+def load_spans(paths):
+    traces = collections.defaultdict(list)
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                for resource in json.loads(line).get('resourceSpans', []):
+                    for scope in resource.get('scopeSpans', []):
+                        for span in scope.get('spans', []):
+                            span['start'] = int(span['startTimeUnixNano'])
+                            span['end'] = int(span['endTimeUnixNano'])
+                            span['attrs'] = {a['key']: next(iter(a['value'].values())) for a in span.get('attributes', [])}
+                            traces[span['traceId']].append(span)
+    return traces
+
+
+def stage_durations(traces):
+    stages = collections.defaultdict(list)
+    for spans in traces.values():
+        by_id = {s['spanId']: s for s in spans}
+        for span in spans:
+            stages[span['name']].append((span['end'] - span['start']) / 1e6)
+            parent = by_id.get(span.get('parentSpanId'))
+            if span['name'] == 'client.receive' and parent is not None:
+                stages['client.delivery'].append((span['start'] - parent['end']) / 1e6)
+    return stages
+
+
+def waterfall(spans):
+    root = min(spans, key=lambda s: (s.get('parentSpanId') is not None, s['start']))
+    parents = {s['spanId']: s.get('parentSpanId') for s in spans}
+
+    def depth(span_id):
+        d = 0
+        while parents.get(span_id) in parents and d < 32:
+            span_id, d = parents[span_id], d + 1
+        return d
+
+    rows = []
+    for span in sorted(spans, key=lambda s: s['start']):
+        extra = ", ".join(f"{k.split('.', 1)[-1]}={v}" for k, v in span['attrs'].items() if k != 'zylo.clock')
+        rows.append(f"  {(span['start'] - root['start']) / 1e6:>9.2f} ms  {(span['end'] - span['start']) / 1e6:>9.2f} ms  "
+                    f"{'  ' * depth(span['spanId'])}{span['name']}  {extra}")
+    return root, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='+', help="OTLP/JSON lines written via ZYLO_TRACE_FILE")
+    parser.add_argument('--slowest', type=int, default=3, help="waterfalls for the N slowest messages")
+    args = parser.parse_args()
+
+    traces = load_spans(args.files)
+    if not traces:
+        raise SystemExit("no spans found")
+    print(f"{len(traces)} traces\n")
+    print(f"{'stage':<24}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, values in sorted(stage_durations(traces).items(), key=lambda kv: -sum(kv[1])):
+        s = latency_summary(values)
+        print(f"{name:<24}{s['count']:>7}{s['p50']:>10.2f}{s['p95']:>10.2f}{s['p99']:>10.2f}{s['max']:>10.2f}")
+
+    roots = []
+    for trace_id, spans in traces.items():
+        root = [s for s in spans if not s.get('parentSpanId')]
+        if root:
+            roots.append(((root[0]['end'] - root[0]['start']), trace_id))
+    for _, trace_id in sorted(roots, reverse=True)[:args.slowest]:
+        root, rows = waterfall(traces[trace_id])
+        print(f"\ntrace {trace_id}  {root['name']}  {root['attrs']}")
+        print(f"  {'offset':>12}  {'duration':>12}")
+        print("\n".join(rows))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,23 @@
 import eventlet
 eventlet.monkey_patch()
 import os
+import re
+import sys
+import gc
+import time
+import bisect
+import hmac
+import hashlib
+import gzip
+import zlib
+import logging
+import functools
+import operator
+import itertools
+import contextlib
+import collections
+import weakref
+import tracemalloc
 import random
 import string
 import sqlite3
@@ -9,23 +26,1124 @@ import mimetypes
 import requests
 import json
 from werkzeug.utils import secure_filename
-from flask import Flask, render_template_string, request, jsonify, send_from_directory
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from flask import Flask, Response, g, render_template_string, request, jsonify, send_from_directory, session
 from flask_socketio import SocketIO, emit, join_room, leave_room
+import greenlet
+from eventlet import hubs, tpool
+from eventlet.queue import LightQueue
+from eventlet.semaphore import Semaphore
+from eventlet.websocket import RFC6455WebSocket
+from engineio.async_drivers.eventlet import WebSocketWSGI
 
 # ---------------------------
 # Configuration & Setup
 # ---------------------------
 app = Flask(__name__)
-app.config['SECRET_KEY'] = 'ultra-secret-premium-key-999'
+app.config['SECRET_KEY'] = os.environ.get('ZYLO_SECRET_KEY', 'ultra-secret-premium-key-999')  # also signs session tokens
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max limit
+AVATAR_MAX_AGE = 365 * 24 * 3600  # content-hashed avatars are cached for a year
+ADMIN_TOKEN = os.environ.get('ZYLO_ADMIN_TOKEN')  # admin endpoints are disabled when unset
 
 # Ensure upload directory exists
 if not os.path.exists(app.config['UPLOAD_FOLDER']):
     os.makedirs(app.config['UPLOAD_FOLDER'])
 
+# ---------------------------
+# Metrics (Prometheus text format)
+# ---------------------------
+# Plain dict updates on the hot path; all formatting happens when /metrics is scraped.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+METRICS = []
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name, self.help, self.labels = name, help_text, labels
+        self.values = {}
+        METRICS.append(self)
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        for key, value in list(self.values.items()):
+            yield self.name, format_labels(self.labels, key), value
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, labels=(), read=None):
+        # read() is called at scrape time and returns a value, or {label_values: value}
+        super().__init__(name, help_text, labels)
+        self.read = read
+
+    def set(self, value, *label_values):
+        self.values[label_values] = value
+
+    def samples(self):
+        if self.read:
+            value = self.read()
+            self.values = value if isinstance(value, dict) else {(): value}
+        return super().samples()
+
+class Histogram(Counter):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = buckets
+
+    def observe(self, value, *label_values):
+        state = self.values.get(label_values)
+        if state is None:
+            state = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def samples(self):
+        names = self.labels + ('le',)
+        for key, (counts, total) in list(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", format_labels(names, key + (bound,)), cumulative
+            yield f"{self.name}_sum", format_labels(self.labels, key), total
+            yield f"{self.name}_count", format_labels(self.labels, key), cumulative
+
+def render_metrics():
+    lines = []
+    for metric in METRICS:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{labels} {value}")
+    return '\n'.join(lines) + '\n'
+
+def socketio_rooms():
+    # Every socket sits in the None room and in a room named after its sid
+    rooms = socketio.server.manager.rooms.get('/', {})
+    sockets = len(rooms.get(None, {}))
+    return sockets, max(len(rooms) - sockets - (1 if None in rooms else 0), 0)
+
+def hub_listeners():
+    hub = hubs.get_hub()
+    return {(kind,): len(fds) for kind, fds in hub.listeners.items()}
+
+SOCKET_EVENT_SECONDS = Histogram('zylo_socket_event_duration_seconds', 'Socket.IO handler latency by event.', ('event',))
+SOCKET_EVENT_ERRORS = Counter('zylo_socket_event_errors_total', 'Socket.IO handlers that raised, by event.', ('event',))
+SOCKET_EMITS = Counter('zylo_socket_emits_total', 'Server emits by event name.', ('event',))
+Gauge('zylo_connected_sockets', 'Connected Socket.IO clients.', read=lambda: socketio_rooms()[0])
+Gauge('zylo_socketio_rooms', 'Socket.IO rooms (user, chat and channel feed rooms).', read=lambda: socketio_rooms()[1])
+Gauge('zylo_presence_users', 'Users with a tracked current room.', read=lambda: len(user_current_room))
+DB_QUERY_SECONDS = Histogram('zylo_db_query_duration_seconds', 'SQLite execute latency by statement label.', ('statement',))
+DB_FETCH_SECONDS = Histogram('zylo_db_fetch_duration_seconds', 'SQLite fetchall latency by statement label.', ('statement',))
+AI_REQUEST_SECONDS = Histogram('zylo_ai_request_duration_seconds', 'AI completion request latency.', buckets=(0.25, 0.5, 1, 2, 4, 8, 16, 32, 64))
+AI_ERRORS = Counter('zylo_ai_errors_total', 'Failed AI completions by reason.', ('reason',))
+AI_TOKENS = Counter('zylo_ai_tokens_total', 'AI tokens used, as reported by the API.', ('kind',))
+UPLOAD_BYTES = Counter('zylo_upload_bytes_total', 'Uploaded request bytes by endpoint.', ('kind',))
+UPLOAD_SECONDS = Histogram('zylo_upload_duration_seconds', 'Upload handling time by endpoint.', ('kind',))
+SEND_DUPLICATES = Counter('zylo_send_duplicates_total', 'Retried sends acknowledged from the original insert.')
+Gauge('zylo_eventlet_hub_timers', 'Timers scheduled on the eventlet hub.',
+      read=lambda: len(hubs.get_hub().timers) + len(hubs.get_hub().next_timers))
+Gauge('zylo_eventlet_hub_timers_canceled', 'Canceled timers not yet purged from the hub.',
+      read=lambda: hubs.get_hub().timers_canceled)
+Gauge('zylo_eventlet_hub_listeners', 'File descriptors the hub is waiting on.', ('kind',), read=hub_listeners)
+
+class InstrumentedSocketIO(SocketIO):
+    # Every @socketio.on handler and every emit (flask_socketio.emit included) passes through here
+
+    def on(self, message, namespace=None):
+        register = super().on(message, namespace)
+
+        def decorator(handler):
+            @functools.wraps(handler)
+            def timed(*args):
+                if RECORD_FILE:
+                    record_event(message, args)
+                if not admit_event(message):
+                    return None
+                if message in RATE_LIMIT_EVENTS:
+                    rejected = admit_rate(message, args[0] if args and isinstance(args[0], dict) else {})
+                    if rejected:
+                        return rejected  # also the acknowledgement, for events sent with one
+                start = time.perf_counter()
+                try:
+                    return handler(*args)
+                except Exception:
+                    SOCKET_EVENT_ERRORS.inc(message)
+                    raise
+                finally:
+                    SOCKET_EVENT_SECONDS.observe(time.perf_counter() - start, message)
+            handler_events[handler.__code__] = message
+            register(timed)
+            return handler
+        return decorator
+
+    def emit(self, event, *args, **kwargs):
+        if not admit_emit(event, args, kwargs):
+            return None
+        SOCKET_EMITS.inc(event)
+        global outbound_event
+        outbound_event = (event, args[0] if args and isinstance(args[0], dict) else {})
+        try:
+            return super().emit(event, *args, **kwargs)
+        finally:
+            outbound_event = None
+
+def metered_upload(kind):
+    def decorator(view):
+        @functools.wraps(view)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return view(*args, **kwargs)
+            finally:
+                UPLOAD_BYTES.inc(kind, amount=request.content_length or 0)
+                UPLOAD_SECONDS.observe(time.perf_counter() - start, kind)
+        return timed
+    return decorator
+
+# ---------------------------
+# Serialization
+# ---------------------------
+# ZYLO_SERIALIZER picks the Socket.IO packet encoding: "json" (orjson when it is
+# installed, the stdlib otherwise), "orjson", "stdlib", or "msgpack" for binary
+# frames, which the page then decodes with the msgpack build of the Socket.IO
+# client (needs the msgpack package). In every mode a payload encoded ahead of
+# time (see RoomCache) is spliced into packets as-is instead of re-encoded.
+SERIALIZER = os.environ.get('ZYLO_SERIALIZER', 'json')
+SERIALIZERS = ('json', 'orjson', 'stdlib', 'msgpack')
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if SERIALIZER not in SERIALIZERS:
+    raise RuntimeError(f"ZYLO_SERIALIZER={SERIALIZER!r}, expected one of {', '.join(SERIALIZERS)}")
+if SERIALIZER == 'orjson' and orjson is None:
+    raise RuntimeError("ZYLO_SERIALIZER=orjson needs the orjson package")
+if SERIALIZER == 'stdlib':
+    orjson = None
+if SERIALIZER == 'msgpack':
+    try:
+        import msgpack
+        from socketio.msgpack_packet import MsgPackPacket
+    except ImportError:
+        raise RuntimeError("ZYLO_SERIALIZER=msgpack needs the msgpack package")
+
+def json_dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(obj, separators=(',', ':'))
+
+class PreEncoded:
+    # JSON text or msgpack bytes, matching SERIALIZER
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+def encode_payload(obj):
+    return PreEncoded(msgpack.packb(obj) if SERIALIZER == 'msgpack' else json_dumps(obj))
+
+def ends_pre_encoded(data):
+    return isinstance(data, list) and len(data) > 1 and isinstance(data[-1], PreEncoded)
+
+class PacketJSON:
+    # Used as Socket.IO's (and Engine.IO's) json module
+    loads = staticmethod(orjson.loads if orjson is not None else json.loads)
+
+    @staticmethod
+    def dumps(obj, **kwargs):
+        if ends_pre_encoded(obj):
+            return f"{json_dumps(obj[:-1])[:-1]},{obj[-1].data}]"
+        return json_dumps(obj)
+
+if SERIALIZER == 'msgpack':
+    class PacketMsgPack(MsgPackPacket):
+        def encode(self):
+            packet = self._to_dict()
+            if not ends_pre_encoded(packet.get('data')):
+                return msgpack.dumps(packet)
+            packer = msgpack.Packer()
+            parts = [packer.pack_map_header(len(packet))]
+            for key, value in packet.items():
+                parts.append(packer.pack(key))
+                if key == 'data':
+                    parts.append(packer.pack_array_header(len(value)))
+                    parts.extend(packer.pack(item) for item in value[:-1])
+                    parts.append(value[-1].data)
+                else:
+                    parts.append(packer.pack(value))
+            return b''.join(parts)
+
+# ---------------------------
+# Library Internals
+# ---------------------------
+# Backpressure and transport compression hook private attributes of
+# python-socketio, python-engineio and eventlet. requirements.txt pins the
+# versions they were written against; these checks run at import, so a version
+# that renamed or dropped a hook point is reported at startup instead of
+# silently turning the feature off.
+def missing_internals(obj, *names):
+    missing = []
+    for name in names:
+        try:
+            operator.attrgetter(name)(obj)
+        except AttributeError:
+            missing.append(name)
+    return missing
+
+def describe_internals(obj, missing):
+    owner = obj if isinstance(obj, type) else type(obj)
+    return (f"{owner.__module__}.{owner.__qualname__} has no {', '.join(missing)}; "
+            f"install the versions pinned in requirements.txt")
+
+def require_internals(feature, obj, *names):
+    missing = missing_internals(obj, *names)
+    if missing:
+        raise RuntimeError(f"{feature} cannot be installed: {describe_internals(obj, missing)}")
+
+# ---------------------------
+# Transport Compression
+# ---------------------------
+# WebSocket clients that offer permessage-deflate (every browser does) get it, but
+# only frames of at least ZYLO_COMPRESSION_THRESHOLD bytes are compressed: history
+# pages and chat lists shrink several times over, while typing, presence and acks
+# are sent as they are, since deflating a few dozen bytes costs CPU and saves
+# nothing. The extension allows that per frame. Polling responses use Engine.IO's
+# gzip/deflate with the same threshold and level. ZYLO_COMPRESSION=0 turns both off.
+COMPRESSION = os.environ.get('ZYLO_COMPRESSION', '1') != '0'
+COMPRESSION_THRESHOLD = int(os.environ.get('ZYLO_COMPRESSION_THRESHOLD', '1024'))  # bytes
+COMPRESSION_LEVEL = int(os.environ.get('ZYLO_COMPRESSION_LEVEL', '6'))  # zlib 1 (fast) .. 9 (small)
+COMPRESSION_BYTES = Counter('zylo_compression_bytes_total', 'Compressed payload bytes before and after, by transport.',
+                            ('transport', 'stage'))
+COMPRESSION_SECONDS = Histogram('zylo_compression_cpu_seconds', 'CPU time per compressed payload, by transport.',
+                                ('transport',), buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05))
+COMPRESSION_SKIPPED = Counter('zylo_compression_skipped_total', 'WebSocket frames sent uncompressed under the threshold.')
+
+def compression_ratio():
+    ratios = {}
+    for (transport, stage), raw in list(COMPRESSION_BYTES.values.items()):
+        if stage == 'raw' and raw:
+            ratios[(transport,)] = COMPRESSION_BYTES.values.get((transport, 'compressed'), 0) / raw
+    return ratios
+
+Gauge('zylo_compression_ratio', 'Compressed / raw bytes of compressed payloads since start, by transport.',
+      ('transport',), read=compression_ratio)
+
+def record_compression(transport, raw, compressed, cpu_seconds):
+    COMPRESSION_BYTES.inc(transport, 'raw', amount=raw)
+    COMPRESSION_BYTES.inc(transport, 'compressed', amount=compressed)
+    COMPRESSION_SECONDS.observe(cpu_seconds, transport)
+
+class ThresholdDeflateWebSocket(RFC6455WebSocket):
+    # Swapped in on connections that negotiated permessage-deflate. The compressor is
+    # only handed out (and only allocated) for frames over the threshold.
+    compress_frame = False
+
+    def _get_permessage_deflate_enc(self):
+        if not self.compress_frame:
+            return None
+        options = self.extensions['permessage-deflate']
+        if getattr(self, '_deflate_enc', None) is not None:
+            return self._deflate_enc
+        enc = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -options.get('server_max_window_bits', zlib.MAX_WBITS))
+        if not options.get('server_no_context_takeover'):
+            self._deflate_enc = enc
+        return enc
+
+    def _pack_message(self, message, masked=False, continuation=False, final=True, control_code=None):
+        if control_code or continuation or len(message) < COMPRESSION_THRESHOLD:
+            if not control_code:
+                COMPRESSION_SKIPPED.inc()
+            return super()._pack_message(message, masked, continuation, final, control_code)
+        start = time.thread_time()
+        self.compress_frame = True
+        try:
+            frame = super()._pack_message(message, masked, continuation, final, control_code)
+        finally:
+            self.compress_frame = False
+        raw = len(message.encode()) if isinstance(message, str) else len(message)
+        record_compression('websocket', raw, len(frame), time.thread_time() - start)
+        return frame
+
+class CompressingWebSocketWSGI(WebSocketWSGI):
+    def _negotiate_permessage_deflate(self, extensions):
+        return super()._negotiate_permessage_deflate(extensions) if COMPRESSION else None
+
+    def _handle_hybi_request(self, environ):
+        ws = super()._handle_hybi_request(environ)
+        if 'permessage-deflate' in ws.extensions:
+            ws.__class__ = ThresholdDeflateWebSocket
+        return ws
+
+def metered_http_compression(compress):
+    # Replaces Engine.IO's _gzip/_deflate, which run once a polling response passes the threshold
+    def compressed(response):
+        start = time.thread_time()
+        data = compress(response, COMPRESSION_LEVEL)
+        record_compression('polling', len(response), len(data), time.thread_time() - start)
+        return data
+    return compressed
+
+def install_compression_hooks(eio):
+    # Compression is an optimization: without its hook points the server still
+    # runs, with Engine.IO's and eventlet's own compression (no frame threshold, no metrics)
+    problems = [describe_internals(obj, missing) for obj, names in (
+        (eio, ('_async', '_gzip', '_deflate')),
+        (RFC6455WebSocket, ('_pack_message', '_get_permessage_deflate_enc')),
+        (WebSocketWSGI, ('_negotiate_permessage_deflate', '_handle_hybi_request')),
+    ) if (missing := missing_internals(obj, *names))]
+    if problems or 'websocket' not in getattr(eio, '_async', {}):
+        app.logger.error("transport compression hooks not installed, using library defaults: %s",
+                         '; '.join(problems) or "Engine.IO has no websocket driver entry")
+        return False
+    eio._async = dict(eio._async, websocket=CompressingWebSocketWSGI)
+    eio._gzip = metered_http_compression(gzip.compress)
+    eio._deflate = metered_http_compression(zlib.compress)
+    return True
+
 # SocketIO with cors allowed for all
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet')
+socketio = InstrumentedSocketIO(app, cors_allowed_origins="*", async_mode='eventlet', json=PacketJSON,
+                                serializer=PacketMsgPack if SERIALIZER == 'msgpack' else 'default',
+                                http_compression=COMPRESSION, compression_threshold=COMPRESSION_THRESHOLD)
+install_compression_hooks(socketio.server.eio)
+
+# ---------------------------
+# Hub Lag & Admission Control
+# ---------------------------
+# Handlers run on the eventlet hub, so a stalled disk stalls every socket. A
+# monitor greenlet measures how late the hub wakes it up; while that lag is over
+# the threshold, low-priority work is shed or deferred so message delivery goes first.
+HUB_LAG_INTERVAL = 0.05
+SHED_LAG_MS = float(os.environ.get('ZYLO_SHED_LAG_MS', 200))
+AI_MAX_DEFER_SECONDS = 30
+MAX_DEFERRED_EMITS = 10000
+
+SHEDDABLE_EVENTS = {'typing', 'get_chats', 'trace_report'}  # inbound: rejected with a backoff hint
+LOW_PRIORITY_EMITS = {                       # outbound: dropped, or coalesced until the hub recovers
+    'typing_status': 'drop',
+    'presence_update': 'drop',
+    'refresh_sidebar': 'defer',
+    'channel_activity': 'defer',
+}
+
+hub_lag = 0.0  # seconds; jumps up immediately, decays over a few ticks
+deferred_emits = {}  # (event, target, room_id) -> (args, kwargs), latest wins
+backoff_sent = {}  # (sid, event) -> monotonic time of the last backoff hint
+
+HUB_LAG_SECONDS = Histogram('zylo_eventlet_hub_lag_seconds', 'Extra delay of the hub lag monitor wakeups.')
+Gauge('zylo_eventlet_hub_lag_current_seconds', 'Smoothed hub lag used for admission control.', read=lambda: hub_lag)
+Gauge('zylo_overloaded', '1 while low-priority work is being shed.', read=lambda: int(overloaded()))
+Gauge('zylo_deferred_emits', 'Low-priority emits waiting for the hub to recover.', read=lambda: len(deferred_emits))
+SHED_TOTAL = Counter('zylo_shed_total', 'Low-priority work shed under hub lag, by event and action.', ('event', 'action'))
+
+def overloaded():
+    return hub_lag * 1000 >= SHED_LAG_MS
+
+def retry_after_ms():
+    return int(min(max(hub_lag * 4000, 1000), 10000))
+
+def admit_event(event):
+    if event not in SHEDDABLE_EVENTS or not overloaded():
+        return True
+    SHED_TOTAL.inc(event, 'rejected')
+    key, now = (request.sid, event), time.monotonic()
+    if now - backoff_sent.get(key, 0) >= 1.0:
+        if len(backoff_sent) > 10000:
+            backoff_sent.clear()
+        backoff_sent[key] = now
+        emit('backoff', {'event': event, 'retry_after_ms': retry_after_ms(), 'reason': 'server busy'})
+    return False
+
+def admit_emit(event, args, kwargs):
+    policy = LOW_PRIORITY_EMITS.get(event)
+    if policy is None or not overloaded():
+        return True
+    data = args[0] if args and isinstance(args[0], dict) else {}
+    if policy == 'drop':
+        if event == 'typing_status' and not data.get('is_typing'):
+            return True  # never strand a typing indicator
+        SHED_TOTAL.inc(event, 'dropped')
+        return False
+    if len(deferred_emits) >= MAX_DEFERRED_EMITS:
+        SHED_TOTAL.inc(event, 'dropped')
+        return False
+    if not kwargs.get('include_self', True) and not kwargs.get('skip_sid'):
+        # Resolve the sender now: the flush runs outside this request
+        kwargs = dict(kwargs, skip_sid=request.sid)
+    target = kwargs.get('to') or kwargs.get('room')
+    deferred_emits[(event, target, data.get('room_id'))] = (args, kwargs)
+    SHED_TOTAL.inc(event, 'deferred')
+    return False
+
+def flush_deferred_emits():
+    pending = list(deferred_emits.items())
+    deferred_emits.clear()
+    for (event, _, _), (args, kwargs) in pending:
+        socketio.emit(event, *args, **kwargs)
+
+def hub_lag_monitor():
+    global hub_lag
+    while True:
+        start = time.perf_counter()
+        eventlet.sleep(HUB_LAG_INTERVAL)
+        lag = max(time.perf_counter() - start - HUB_LAG_INTERVAL, 0.0)
+        HUB_LAG_SECONDS.observe(lag)
+        hub_lag = max(lag, hub_lag * 0.8)
+        if deferred_emits and not overloaded():
+            flush_deferred_emits()
+        if coalesced_emits or backlogged_since or evicted_sids:
+            flush_coalesced_emits()
+
+def wait_for_capacity(event, max_wait):
+    # Defer background work (AI replies) until the hub has caught up, within reason
+    if not overloaded():
+        return
+    SHED_TOTAL.inc(event, 'deferred')
+    deadline = time.monotonic() + max_wait
+    while overloaded() and time.monotonic() < deadline:
+        eventlet.sleep(0.25)
+
+# ---------------------------
+# Outbound Backpressure
+# ---------------------------
+# Every emit is queued per connection and written by that connection's writer
+# greenlet as fast as its socket drains, so one phone on a bad network can pile up
+# an unbounded backlog in server memory. Once a connection has
+# ZYLO_OUTBOUND_HIGH_WATER packets queued, low-priority events to it are dropped or
+# coalesced (latest per room wins, sent once it drains below half the mark).
+# Messages still queue; a connection that stays over the mark for
+# ZYLO_SLOW_CONSUMER_SECONDS, or reaches ZYLO_OUTBOUND_MAX, has its backlog
+# discarded and is disconnected with a resync hint. The client reconnects and
+# catches up through join_room's since_seq.
+OUTBOUND_HIGH_WATER = int(os.environ.get('ZYLO_OUTBOUND_HIGH_WATER', 200))  # packets
+OUTBOUND_MAX = int(os.environ.get('ZYLO_OUTBOUND_MAX', 2000))
+SLOW_CONSUMER_SECONDS = float(os.environ.get('ZYLO_SLOW_CONSUMER_SECONDS', 15))
+RESYNC_RETRY_MS = 5000
+
+outbound_event = None  # (event, data) of the emit being fanned out; set by InstrumentedSocketIO.emit
+backlogged_since = {}  # eio sid -> monotonic time its queue first reached the high-water mark
+coalesced_emits = {}  # eio sid -> {(event, room_id): (send, packet)}, latest wins
+evicted_sids = set()
+
+OUTBOUND_QUEUE_DEPTH = Histogram('zylo_outbound_queue_depth', 'Packets already queued for a connection when one more is added.',
+                                 buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500))
+Gauge('zylo_outbound_queue_max_depth', 'Deepest outbound queue across connections.',
+      read=lambda: max((s.queue.qsize() for s in list(socketio.server.eio.sockets.values())), default=0))
+Gauge('zylo_outbound_backlogged_connections', 'Connections at or over the outbound high-water mark.',
+      read=lambda: len(backlogged_since))
+BACKPRESSURE_TOTAL = Counter('zylo_backpressure_total', 'Outbound work shed for backlogged connections, by event and action.',
+                             ('event', 'action'))
+
+def admit_outbound(eio_sid, send, pkt):
+    if eio_sid in evicted_sids:
+        return False
+    s = socketio.server.eio.sockets.get(eio_sid)
+    if s is None:
+        return True
+    depth = s.queue.qsize()
+    OUTBOUND_QUEUE_DEPTH.observe(depth)
+    if depth < OUTBOUND_HIGH_WATER:
+        backlogged_since.pop(eio_sid, None)
+        return True
+    since = backlogged_since.setdefault(eio_sid, time.monotonic())
+    if depth >= OUTBOUND_MAX or time.monotonic() - since >= SLOW_CONSUMER_SECONDS:
+        evict_slow_consumer(eio_sid, s)
+        return False
+    event, data = outbound_event or (None, {})
+    policy = LOW_PRIORITY_EMITS.get(event)
+    if policy is None:
+        return True
+    if policy == 'drop' and not (event == 'typing_status' and not data.get('is_typing')):
+        BACKPRESSURE_TOTAL.inc(event, 'dropped')
+        return False
+    # A typing stop is kept like a sidebar refresh, so no indicator is stranded
+    coalesced_emits.setdefault(eio_sid, {})[(event, data.get('room_id'))] = (send, pkt)
+    BACKPRESSURE_TOTAL.inc(event, 'coalesced')
+    return False
+
+def evict_slow_consumer(eio_sid, s):
+    evicted_sids.add(eio_sid)
+    coalesced_emits.pop(eio_sid, None)
+    BACKPRESSURE_TOTAL.inc(outbound_event[0] if outbound_event else '', 'disconnected')
+    app.logger.warning("disconnecting slow consumer %s: %d packets queued", eio_sid, s.queue.qsize())
+    while True:
+        try:
+            s.queue.get(block=False)
+            s.queue.task_done()
+        except socketio.server.eio.get_queue_empty_exception():
+            break
+    hint = socketio.server.packet_class(2, data=['resync', {'reason': 'slow_consumer', 'retry_after_ms': RESYNC_RETRY_MS}])  # 2 = EVENT
+    unmetered_send_packet(eio_sid, hint)
+
+    def close():
+        # Runs the disconnect handlers, so not inside the emit that found the backlog
+        s.close(wait=False, reason=socketio.server.eio.reason.SERVER_DISCONNECT)
+        socketio.server.eio.sockets.pop(eio_sid, None)
+    socketio.start_background_task(close)
+
+def flush_coalesced_emits():
+    sockets = socketio.server.eio.sockets
+    for eio_sid in list(coalesced_emits):
+        s = sockets.get(eio_sid)
+        if s is None or eio_sid in evicted_sids:
+            del coalesced_emits[eio_sid]
+        elif s.queue.qsize() < OUTBOUND_HIGH_WATER // 2:
+            for send, pkt in coalesced_emits.pop(eio_sid).values():
+                send(eio_sid, pkt)
+    for eio_sid in [sid for sid in backlogged_since if sid not in sockets]:
+        del backlogged_since[eio_sid]
+    evicted_sids.intersection_update(sockets)
+
+def metered_send(send):
+    # Wraps the Socket.IO server's per-recipient send functions
+    def admitted(eio_sid, pkt):
+        if admit_outbound(eio_sid, send, pkt):
+            send(eio_sid, pkt)
+    return admitted
+
+require_internals('outbound backpressure', socketio.server, '_send_packet', '_send_eio_packet', 'packet_class',
+                  'eio.sockets', 'eio.get_queue_empty_exception', 'eio.reason.SERVER_DISCONNECT')
+require_internals('outbound backpressure', socketio.server.eio.create_queue(), 'qsize', 'get', 'task_done')
+
+unmetered_send_packet = socketio.server._send_packet
+socketio.server._send_packet = metered_send(unmetered_send_packet)
+socketio.server._send_eio_packet = metered_send(socketio.server._send_eio_packet)
+
+# ---------------------------
+# Rate Limiting
+# ---------------------------
+# Token buckets per (user, event class), plus one per room for sends, so a single
+# client cannot flood the writer or a room's fan-out. ZYLO_RATE_LIMITS overrides
+# the defaults as "class=rate/burst" pairs (tokens per second / bucket size);
+# "room" is the per-room send bucket and a rate of 0 disables a class. Rejected
+# events get a rate_limited error (and the same dict as their acknowledgement).
+RATE_LIMIT_EVENTS = {
+    'send_message': 'send',
+    'get_chats': 'chats',
+    'join_room': 'join',
+    'sync_room': 'join',
+    'typing': 'typing',
+    'stop_typing': 'typing',
+}
+DEFAULT_RATE_LIMITS = 'send=5/20,chats=2/10,join=5/20,typing=2/5,room=20/50'
+RATE_BUCKET_SWEEP_SECONDS = 60
+
+def parse_rate_limits(spec):
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, value = item.partition('=')
+        rate, _, burst = value.partition('/')
+        limits[name.strip()] = (float(rate), float(burst or rate))
+    return limits
+
+RATE_LIMITS = {**parse_rate_limits(DEFAULT_RATE_LIMITS), **parse_rate_limits(os.environ.get('ZYLO_RATE_LIMITS', ''))}
+
+rate_buckets = {}  # (scope, key, class) -> [tokens, monotonic time of the last update]
+rate_limit_sent = {}  # (sid, event) -> monotonic time of the last rate_limited error
+next_bucket_sweep = 0.0
+
+RATE_LIMITED = Counter('zylo_rate_limited_total', 'Socket events rejected by the rate limiter, by event and scope.',
+                       ('event', 'scope'))
+
+def take_token(key, rate, burst, now):
+    # Returns 0 when a token was taken, else the seconds until the next one
+    bucket = rate_buckets.get(key)
+    if bucket is None:
+        rate_buckets[key] = [burst - 1, now]
+        return 0
+    tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+    bucket[1] = now
+    if tokens >= 1:
+        bucket[0] = tokens - 1
+        return 0
+    bucket[0] = tokens
+    return (1 - tokens) / rate
+
+def rate_limit_check(user_id, event, data, now):
+    # Returns (scope, seconds to wait) for a rejected event, None when admitted
+    cls = RATE_LIMIT_EVENTS[event]
+    rate, burst = RATE_LIMITS.get(cls, (0, 0))
+    if rate > 0:
+        wait = take_token(('user', user_id, cls), rate, burst, now)
+        if wait:
+            return 'user', wait
+    room_id = data.get('room_id')
+    if cls == 'send' and room_id:
+        rate, burst = RATE_LIMITS.get('room', (0, 0))
+        if rate > 0:
+            wait = take_token(('room', room_id, cls), rate, burst, now)
+            if wait:
+                return 'room', wait
+    return None
+
+def sweep_rate_buckets(now):
+    # A bucket that has refilled completely is the same as no bucket
+    for key, (tokens, last) in list(rate_buckets.items()):
+        rate, burst = RATE_LIMITS.get('room' if key[0] == 'room' else key[2], (0, 0))
+        if rate <= 0 or tokens + (now - last) * rate >= burst:
+            del rate_buckets[key]
+    rate_limit_sent.clear()
+
+def admit_rate(event, data):
+    global next_bucket_sweep
+    now = time.monotonic()
+    if now >= next_bucket_sweep:
+        next_bucket_sweep = now + RATE_BUCKET_SWEEP_SECONDS
+        sweep_rate_buckets(now)
+    rejected = rate_limit_check(current_user_id(), event, data, now)
+    if rejected is None:
+        return None
+    scope, wait = rejected
+    RATE_LIMITED.inc(event, scope)
+    error = {'success': False, 'error': 'rate_limited', 'event': event, 'scope': scope,
+             'room_id': data.get('room_id'), 'retry_after_ms': int(wait * 1000) + 1,
+             'message': 'Too many requests, slow down'}
+    # Typing is retried by the next keystroke anyway, so its errors are sent at most once a second
+    key = (request.sid, event)
+    if RATE_LIMIT_EVENTS[event] != 'typing' or now - rate_limit_sent.get(key, 0) >= 1.0:
+        rate_limit_sent[key] = now
+        emit('rate_limited', error)
+    return error
+
+# ---------------------------
+# Sampling Profiler
+# ---------------------------
+# Started on demand from /admin/profile. The sampler is a real OS thread (a green
+# one would only get to run when the hub is already idle) reading sys._current_frames():
+# the main thread's frame is whichever greenlet holds the hub at that instant, the
+# other threads are tpool workers. Nothing is installed while no profile is running.
+PROFILE_MAX_SECONDS = 60
+PROFILE_MAX_HZ = 1000
+
+real_threading = eventlet.patcher.original('threading')
+real_time = eventlet.patcher.original('time')
+IDLE_THREAD_FILES = {real_threading.__file__, eventlet.patcher.original('queue').__file__}
+
+handler_events = {}  # socket handler code object -> event name, filled by InstrumentedSocketIO.on
+profile_lock = Semaphore()
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{os.path.splitext(os.path.basename(code.co_filename))[0]}:{code.co_qualname}"
+
+def walk_stack(frame):
+    # Outermost frame first, as collapsed stacks expect, plus the socket event being handled
+    stack, codes, event = [], set(), None
+    while frame is not None:
+        stack.append(frame_label(frame))
+        codes.add(frame.f_code)
+        if event is None:
+            event = handler_events.get(frame.f_code)
+        frame = frame.f_back
+    stack.reverse()
+    return stack, codes, event
+
+class StackSampler:
+    def __init__(self, hz, include_waiting):
+        self.interval = 1.0 / hz
+        self.include_waiting = include_waiting
+        self.main_ident = real_threading.main_thread().ident
+        self.hub_wait = type(hubs.get_hub()).wait.__code__
+        self.stacks = collections.Counter()
+        self.events = collections.Counter()  # (event, 'running' | 'waiting') -> samples
+        self.samples = 0
+        self.greenlets = {}  # id -> weakref of every greenlet switched to while profiling
+        self.stopping = False
+        self.thread = real_threading.Thread(target=self.run, name='zylo-profiler', daemon=True)
+
+    def trace(self, event, args):
+        if event in ('switch', 'throw'):
+            target = args[1]
+            self.greenlets[id(target)] = weakref.ref(target)
+
+    def start(self):
+        self.previous_trace = greenlet.settrace(self.trace) if self.include_waiting else None
+        self.started = time.perf_counter()
+        self.thread.start()
+
+    def stop(self):
+        self.stopping = True
+        self.thread.join()
+        if self.include_waiting:
+            greenlet.settrace(self.previous_trace)
+        self.elapsed = time.perf_counter() - self.started
+
+    def run(self):
+        next_at = real_time.perf_counter()
+        while not self.stopping:
+            self.sample()
+            next_at += self.interval
+            delay = next_at - real_time.perf_counter()
+            if delay > 0:
+                real_time.sleep(delay)
+            else:
+                next_at = real_time.perf_counter()  # fell behind; don't burst to catch up
+
+    def record(self, stack, event, state):
+        self.stacks[';'.join(stack)] += 1
+        self.events[(event, state)] += 1
+
+    def sample(self):
+        self.samples += 1
+        me = real_threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack, codes, event = walk_stack(frame)
+            if ident == self.main_ident:
+                if self.hub_wait in codes:
+                    self.record(['main', '(hub idle)'], '(idle)', 'running')
+                else:
+                    self.record(['main'] + stack, event or '(other)', 'running')
+            elif frame.f_code.co_filename not in IDLE_THREAD_FILES:
+                self.record(['thread'] + stack, event or '(db executor)', 'running')
+        if self.include_waiting:
+            for ref in list(self.greenlets.values()):
+                g = ref()
+                frame = g.gr_frame if g is not None and not g.dead else None
+                if frame is not None:
+                    stack, _, event = walk_stack(frame)
+                    self.record(['waiting'] + stack, event or '(other)', 'waiting')
+
+    def report(self):
+        events = {}
+        for (event, state), n in self.events.items():
+            events.setdefault(event, {'event': event, 'running': 0, 'waiting': 0})[state] = n
+        for row in events.values():
+            row['running_share'] = round(row['running'] / max(self.samples, 1), 4)
+        return {
+            'seconds': round(self.elapsed, 3),
+            'hz': round(1.0 / self.interval, 1),
+            'samples': self.samples,
+            'events': sorted(events.values(), key=lambda r: (r['running'], r['waiting']), reverse=True),
+            'collapsed': "\n".join(f"{stack} {n}" for stack, n in self.stacks.most_common()),
+        }
+
+def run_profile(seconds, hz, include_waiting=False):
+    sampler = StackSampler(hz, include_waiting)
+    sampler.start()
+    try:
+        eventlet.sleep(seconds)
+    finally:
+        sampler.stop()
+    return sampler.report()
+
+# ---------------------------
+# Message Tracing
+# ---------------------------
+# Each sampled send_message gets a trace id; persistence, emits, sidebar fan-out and
+# the AI reply record spans under it, and receiving browsers report back when the
+# message arrived and was rendered. Spans are batched in OTLP/JSON: one export
+# request per line in ZYLO_TRACE_FILE and/or POSTed to an OTLP/HTTP collector.
+TRACE_FILE = os.environ.get('ZYLO_TRACE_FILE')
+TRACE_URL = os.environ.get('ZYLO_TRACE_URL')  # e.g. http://127.0.0.1:4318/v1/traces
+TRACE_SAMPLE_RATE = float(os.environ.get('ZYLO_TRACE_SAMPLE', 1.0))
+TRACE_FLUSH_SECONDS = 1.0
+TRACING = bool(TRACE_FILE or TRACE_URL)
+
+TRACE_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+SPAN_ID_RE = re.compile(r'^[0-9a-f]{16}$')
+TRACE_RESOURCE = {'attributes': [{'key': 'service.name', 'value': {'stringValue': 'zylo-link'}}]}
+NO_SPAN = contextlib.nullcontext()
+
+pending_spans = collections.deque(maxlen=100000)
+
+TRACE_SPANS = Counter('zylo_trace_spans_total', 'Trace spans by export result.', ('result',))
+
+def otlp_span(trace_id, span_id, parent_id, name, start_ns, end_ns, attributes, error=False):
+    span = {
+        'traceId': trace_id, 'spanId': span_id, 'name': name, 'kind': 1,
+        'startTimeUnixNano': str(start_ns), 'endTimeUnixNano': str(end_ns),
+        'attributes': [{'key': k, 'value': {'intValue': str(v)} if isinstance(v, int) else {'stringValue': str(v)}}
+                       for k, v in attributes.items() if v is not None],
+    }
+    if parent_id:
+        span['parentSpanId'] = parent_id
+    if error:
+        span['status'] = {'code': 2}
+    return span
+
+def export_span(span):
+    if len(pending_spans) == pending_spans.maxlen:
+        TRACE_SPANS.inc('dropped')
+    pending_spans.append(span)
+
+class TraceSpan:
+    def __init__(self, trace_id, name, parent_id, attributes):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.start = time.time_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        export_span(otlp_span(self.trace_id, self.span_id, self.parent_id, self.name, self.start, time.time_ns(),
+                              self.attributes, error=exc_type is not None))
+        return False
+
+    def child(self, name, **attributes):
+        return TraceSpan(self.trace_id, name, self.span_id, attributes)
+
+    def context(self):
+        # Sent along with the message so receivers can attach their spans to this one
+        return {'id': self.trace_id, 'span': self.span_id}
+
+def message_trace(name, **attributes):
+    if not TRACING or random.random() >= TRACE_SAMPLE_RATE:
+        return NO_SPAN
+    return TraceSpan(os.urandom(16).hex(), name, None, attributes)
+
+def trace_span(parent, name, **attributes):
+    return parent.child(name, **attributes) if parent else NO_SPAN
+
+def client_time_ns(value):
+    # Browser clock in epoch ms; anything more than a day off is not a timestamp
+    if isinstance(value, (int, float)) and abs(value / 1000 - time.time()) < 86400:
+        return int(value * 1_000_000)
+    return None
+
+def record_client_span(trace_id, parent_id, name, start_ms, end_ms, **attributes):
+    start, end = client_time_ns(start_ms), client_time_ns(end_ms)
+    if start is None or end is None or end < start:
+        return
+    export_span(otlp_span(trace_id, os.urandom(8).hex(), parent_id, name, start, end,
+                          dict(attributes, **{'zylo.clock': 'client'})))
+
+def flush_spans():
+    spans = [pending_spans.popleft() for _ in range(len(pending_spans))]
+    if not spans:
+        return
+    body = json.dumps({'resourceSpans': [{'resource': TRACE_RESOURCE,
+                                          'scopeSpans': [{'scope': {'name': 'zylo.message'}, 'spans': spans}]}]})
+    if TRACE_FILE:
+        with open(TRACE_FILE, 'a') as f:
+            f.write(body + '\n')
+    if TRACE_URL:
+        try:
+            requests.post(TRACE_URL, data=body, headers={'Content-Type': 'application/json'}, timeout=5).raise_for_status()
+        except requests.RequestException as e:
+            TRACE_SPANS.inc('failed', amount=len(spans))
+            app.logger.warning("trace export to %s failed: %s", TRACE_URL, e)
+            return
+    TRACE_SPANS.inc('exported', amount=len(spans))
+
+def trace_export_loop():
+    while True:
+        eventlet.sleep(TRACE_FLUSH_SECONDS)
+        flush_spans()
+
+# ---------------------------
+# Memory Accounting
+# ---------------------------
+# Sizes of the long-lived in-process structures are always exported; new caches
+# add an entry to MEMORY_STRUCTURES. tracemalloc slows every allocation, so it only
+# runs once started from /admin/tracemalloc or with ZYLO_TRACEMALLOC_FRAMES at boot.
+MEMORY_REPORT_SECONDS = float(os.environ.get('ZYLO_MEMORY_REPORT_SECONDS', 600))  # 0 disables the log report
+TRACEMALLOC_FRAMES = int(os.environ.get('ZYLO_TRACEMALLOC_FRAMES', 0))
+GREENLET_COUNT_TTL = 30
+TRACEMALLOC_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+MEMORY_STRUCTURES = {
+    'presence': lambda: len(user_current_room),
+    'socket_users': lambda: len(socket_users),
+    'socketio_sessions': lambda: len(socketio.server.eio.sockets),
+    'socketio_rooms': lambda: socketio_rooms()[1],
+    'socketio_room_members': lambda: sum(len(sids) for sids in socketio.server.manager.rooms.get('/', {}).values()),
+    'deferred_emits': lambda: len(deferred_emits),
+    'coalesced_emits': lambda: sum(len(pending) for pending in coalesced_emits.values()),
+    'backlogged_connections': lambda: len(backlogged_since),
+    'backoff_hints': lambda: len(backoff_sent),
+    'rate_buckets': lambda: len(rate_buckets),
+    'rate_limit_hints': lambda: len(rate_limit_sent),
+    'statement_info': lambda: len(statement_info),
+    'query_stats': lambda: len(query_stats),
+    'pending_spans': lambda: len(pending_spans),
+    'db_sessions': lambda: len(db_sessions),
+    'recorded_events': lambda: len(recorded_events),
+    'record_tokens': lambda: len(record_tokens),
+    'room_cache_rooms': lambda: len(room_cache.rooms),
+    'room_cache_messages': lambda: sum(len(room.messages) for room in room_cache.rooms.values()),
+}
+
+greenlet_count_cache = (float('-inf'), 0)
+tracemalloc_baseline = None  # the last admin snapshot; the next one is diffed against it
+
+def structure_sizes():
+    return {(name,): size() for name, size in MEMORY_STRUCTURES.items()}
+
+def greenlet_count(max_age=GREENLET_COUNT_TTL):
+    # Walking the gc heap is O(objects), so scrapes reuse a recent count
+    global greenlet_count_cache
+    checked, count = greenlet_count_cache
+    if time.monotonic() - checked >= max_age:
+        count = sum(1 for obj in gc.get_objects() if isinstance(obj, greenlet.greenlet))
+        greenlet_count_cache = (time.monotonic(), count)
+    return count
+
+def resident_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0  # no /proc (macOS, Windows)
+
+Gauge('zylo_memory_structure_entries', 'Entries in long-lived in-process structures.', ('structure',),
+      read=structure_sizes)
+Gauge('zylo_greenlets', f'Live greenlets, counted at most every {GREENLET_COUNT_TTL} s.', read=greenlet_count)
+Gauge('process_resident_memory_bytes', 'Resident set size of the server process.', read=resident_bytes)
+Gauge('zylo_tracemalloc_traced_bytes', 'Memory traced by tracemalloc, 0 while it is off.',
+      read=lambda: tracemalloc.get_traced_memory()[0])
+
+def take_snapshot():
+    return tracemalloc.take_snapshot().filter_traces(TRACEMALLOC_FILTERS)
+
+def allocation_stats(snapshot, baseline=None, group_by='lineno', limit=20):
+    stats = snapshot.compare_to(baseline, group_by) if baseline else snapshot.statistics(group_by)
+    rows = []
+    for stat in stats[:limit]:
+        frame = stat.traceback[0]
+        row = {'where': f"{frame.filename}:{frame.lineno}", 'size_kb': round(stat.size / 1024, 1), 'count': stat.count}
+        if baseline:
+            row['size_diff_kb'] = round(stat.size_diff / 1024, 1)
+            row['count_diff'] = stat.count_diff
+        if group_by == 'traceback':
+            row['traceback'] = [f"{f.filename}:{f.lineno}" for f in stat.traceback]
+        rows.append(row)
+    return rows
+
+def memory_report_loop():
+    previous = None
+    while True:
+        eventlet.sleep(MEMORY_REPORT_SECONDS)
+        sizes = ", ".join(f"{name}={n}" for (name,), n in structure_sizes().items())
+        app.logger.info("memory: rss %.1f MB, %d greenlets, %s",
+                        resident_bytes() / 1e6, greenlet_count(max_age=0), sizes)
+        if not tracemalloc.is_tracing():
+            previous = None
+            continue
+        snapshot = take_snapshot()
+        title = "growth since last report" if previous else "top allocations"
+        app.logger.info("memory: %s (traced %.1f MB)", title, tracemalloc.get_traced_memory()[0] / 1e6)
+        for row in allocation_stats(snapshot, previous, limit=10):
+            app.logger.info("  %+9.1f KB %9.1f KB %7d blocks  %s",
+                            row.get('size_diff_kb', row['size_kb']), row['size_kb'], row['count'], row['where'])
+        previous = snapshot
+
+# ---------------------------
+# Traffic Recording
+# ---------------------------
+# With ZYLO_RECORD_FILE set, every inbound socket event is appended to a gzip'd
+# JSON lines file as [ms since start, connection, event, payload] for
+# benchmarks/replay.py. User and room ids become stable tokens ("i1", "i2", ...)
+# described once by "@user"/"@room" lines, text is replaced by filler of the same
+# length, and API keys and trace reports are not recorded at all.
+RECORD_FILE = os.environ.get('ZYLO_RECORD_FILE')
+RECORD_FLUSH_SECONDS = 1
+RECORD_SKIP_EVENTS = {'save_api_key', 'trace_report', 'connect'}  # on_connect records a login once the token checks out
+RECORD_ID_KEYS = {'user_id', 'my_id', 'target_id', 'target_ids', 'sender_id', 'room_id'}
+RECORD_KEEP_KEYS = {'type'}
+RECORD_DROP_KEYS = {'client_sent_at', 'client_id', 'key'}
+
+recorded_events = collections.deque(maxlen=100000)
+record_tokens = {}        # real id or sid -> token
+record_counter = itertools.count(1)
+record_unresolved = []    # (token, real id, ms) still to be described by an @user/@room line
+record_started = time.monotonic()
+
+def record_token(value, prefix='i'):
+    token = record_tokens.get(value)
+    if token is None:
+        token = record_tokens[value] = f"{prefix}{next(record_counter)}"
+        if prefix == 'i':
+            record_unresolved.append((token, value, record_ms()))
+    return token
+
+def record_ms():
+    return int((time.monotonic() - record_started) * 1000)
+
+def anonymize(value, key=None):
+    if isinstance(value, dict):
+        return {k: anonymize(v, k) for k, v in value.items() if k not in RECORD_DROP_KEYS}
+    if isinstance(value, list):
+        return [anonymize(v, key) for v in value]
+    if isinstance(value, str):
+        if key in RECORD_ID_KEYS:
+            return record_token(value)
+        return value if key in RECORD_KEEP_KEYS else 'x' * len(value)
+    return value
+
+def record_event(event, args):
+    if event in RECORD_SKIP_EVENTS:
+        return
+    payload = anonymize(args[0]) if args and isinstance(args[0], dict) else None
+    recorded_events.append([record_ms(), record_token(request.sid, 'c'), event, payload])
+    if event == 'disconnect':
+        del record_tokens[request.sid]
+
+def describe_record_tokens(conn):
+    lines = []
+    while record_unresolved:
+        token, real_id, ms = record_unresolved.pop(0)
+        room = conn.execute("SELECT is_group, is_channel FROM rooms WHERE room_id=?", (real_id,)).fetchone()
+        if room is None:
+            known = conn.execute("SELECT 1 FROM users WHERE user_id=?", (real_id,)).fetchone()
+            lines.append([ms, None, '@user' if known else '@unknown', {'id': token}])
+            continue
+        is_group, is_channel = room
+        if is_channel:
+            rows = conn.execute("SELECT user_id, can_post FROM channel_members WHERE room_id=? ORDER BY can_post DESC",
+                                (real_id,)).fetchall()
+            kind = 'channel'
+        else:
+            rows = conn.execute("SELECT user_id, 0 FROM chat_participants WHERE room_id=? ORDER BY rowid",
+                                (real_id,)).fetchall()
+            kind = 'group' if is_group else 'dm'
+        lines.append([ms, None, '@room', {'id': token, 'kind': kind,
+                                          'members': [record_token(user_id) for user_id, _ in rows],
+                                          'posters': [record_token(user_id) for user_id, can_post in rows if can_post]}])
+    return lines
+
+def flush_recording():
+    events = [recorded_events.popleft() for _ in range(len(recorded_events))]
+    if not events and not record_unresolved:
+        return
+    with db_read() as conn:
+        # Definitions go first so a replayer can set rooms up before their first event
+        lines = describe_record_tokens(conn) + events
+    with gzip.open(RECORD_FILE, 'at') as f:  # one gzip member per flush, readable even after a crash
+        f.writelines(json.dumps(line, separators=(',', ':')) + '\n' for line in lines)
+
+def record_flush_loop():
+    with gzip.open(RECORD_FILE, 'at') as f:
+        f.write(json.dumps({'zylo_recording': 1, 'started': datetime.datetime.now().isoformat(timespec='seconds')}) + '\n')
+    while True:
+        eventlet.sleep(RECORD_FLUSH_SECONDS)
+        flush_recording()
 
 # ---------------------------
 # AI Configuration
@@ -35,109 +1153,581 @@ GROQ_BASE_URL = "https://api.groq.com/openai/v1/chat/completions"
 AI_MODEL = "llama-3.1-8b-instant"
 AI_BOT_ID = "AI_ASSISTANT"
 AI_BOT_NAME = "Assistant"
+AI_CONTEXT_MESSAGES = 15  # recent room messages included in the prompt
 AI_AVATAR_URL = "https://img.icons8.com/fluency/96/bot.png"
+CHANNEL_AVATAR_URL = "https://img.icons8.com/fluency/96/megaphone.png"
+CHANNEL_NAME_MAX = 64  # characters
 
 # Presence tracking
 user_current_room = {}  # user_id -> room_id
+socket_users = {}  # sid -> user_id, so presence can be dropped when the last socket goes
 
 # ---------------------------
 # Database Management (SQLite)
 # ---------------------------
 DB_FILE = 'ZYLO_chat.db'
+STATEMENT_TABLE_RE = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE(?: IF NOT EXISTS)?|INDEX(?: IF NOT EXISTS)? \w+ ON)\s+(\w+)', re.I)
+FINGERPRINT_RES = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(?+)'),
+    (re.compile(r'\s+'), ' '),
+)
+statement_info = {}  # sql text -> (label, fingerprint)
+
+def describe_statement(sql):
+    info = statement_info.get(sql)
+    if info is None:
+        verb = sql.split(None, 1)[0].lower() if sql.strip() else ''
+        match = STATEMENT_TABLE_RE.search(sql)
+        fingerprint = sql
+        for pattern, replacement in FINGERPRINT_RES:
+            fingerprint = pattern.sub(replacement, fingerprint)
+        info = (f"{verb} {match.group(1)}" if match else verb, fingerprint.strip())
+        if len(statement_info) < 1024:  # dynamic SQL must not grow this forever
+            statement_info[sql] = info
+    return info
+
+# Query profiler: every statement is aggregated by fingerprint; slow ones are
+# logged with redacted parameters and their query plan.
+SLOW_QUERY_MS = float(os.environ.get('ZYLO_SLOW_QUERY_MS', 100))
+QUERY_REPORT_SECONDS = int(os.environ.get('ZYLO_QUERY_REPORT_SECONDS', 300))  # 0 disables the log summary
+MAX_QUERY_FINGERPRINTS = 2000
+query_stats = {}  # fingerprint -> aggregate
+# Statements run on the DB executor's OS threads, several at once, so the
+# aggregates take a real lock (an eventlet one would not exclude them). It is
+# held only for a few dict updates; plans are computed outside it.
+query_stats_lock = real_threading.Lock()
+query_stats_since = time.time()
+slow_queries = collections.deque(maxlen=1000)  # filled on DB threads, logged from the hub
+
+def redact_params(params):
+    # Keep shape and types for debugging, never the values
+    def describe(value):
+        if isinstance(value, (str, bytes)):
+            return f"<{type(value).__name__}:{len(value)}>"
+        return f"<{type(value).__name__}>"
+    if isinstance(params, dict):
+        return {k: describe(v) for k, v in params.items()}
+    return [describe(v) for v in params]
+
+def explain_plan(conn, sql, params):
+    try:
+        rows = sqlite3.Cursor(conn).execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    except sqlite3.Error as e:
+        return [f"unavailable: {e}"]
+    return [row[3] for row in rows]
+
+def record_query(cursor, sql, params, elapsed, fetch=False):
+    label, fingerprint = describe_statement(sql)
+    cursor.elapsed += elapsed
+    slow = cursor.elapsed * 1000 >= SLOW_QUERY_MS and not cursor.reported_slow
+    with query_stats_lock:
+        stats = query_stats.get(fingerprint)
+        if stats is None:
+            if len(query_stats) >= MAX_QUERY_FINGERPRINTS:
+                # Forget the cheapest statement so a flood of dynamic SQL can't grow this
+                del query_stats[min(query_stats, key=lambda k: query_stats[k]['total'])]
+            stats = query_stats[fingerprint] = {'label': label, 'count': 0, 'total': 0.0, 'max': 0.0,
+                                                'slow': 0, 'plan': None}
+        if not fetch:
+            stats['count'] += 1
+        stats['total'] += elapsed
+        if cursor.elapsed > stats['max']:
+            stats['max'] = cursor.elapsed
+        if slow:
+            stats['slow'] += 1
+        plan = stats['plan']
+
+    if slow:
+        cursor.reported_slow = True
+        if params is not None and label.split(' ')[0] in ('select', 'update', 'delete', 'insert', 'with'):
+            if plan is None:
+                plan = explain_plan(cursor.connection, sql, params)
+                with query_stats_lock:
+                    stats['plan'] = plan
+        else:
+            plan = None
+        slow_queries.append((cursor.elapsed * 1000, label, fingerprint, redact_params(params or ()), plan))
+
+def log_slow_queries():
+    while slow_queries:
+        app.logger.warning("slow query %.1f ms [%s] %s params=%s plan=%s", *slow_queries.popleft())
+
+def query_stats_snapshot():
+    with query_stats_lock:
+        return [(fingerprint, dict(stats)) for fingerprint, stats in query_stats.items()]
+
+def top_queries(sort='total', limit=20):
+    rows = []
+    for fingerprint, stats in query_stats_snapshot():
+        rows.append({
+            'fingerprint': fingerprint,
+            'label': stats['label'],
+            'count': stats['count'],
+            'total_ms': round(stats['total'] * 1000, 3),
+            'mean_ms': round(stats['total'] * 1000 / max(stats['count'], 1), 3),
+            'max_ms': round(stats['max'] * 1000, 3),
+            'slow': stats['slow'],
+            'plan': stats['plan'],
+        })
+    key = {'total': 'total_ms', 'mean': 'mean_ms', 'max': 'max_ms', 'count': 'count', 'slow': 'slow'}.get(sort, 'total_ms')
+    rows.sort(key=lambda r: r[key], reverse=True)
+    return rows[:limit]
+
+def query_report_loop():
+    previous = {}
+    while True:
+        socketio.sleep(QUERY_REPORT_SECONDS)
+        # Report what happened in this interval, not since startup
+        interval = []
+        for fingerprint, stats in query_stats_snapshot():
+            count, total = previous.get(fingerprint, (0, 0.0))
+            if stats['count'] > count:
+                interval.append((stats['total'] - total, stats['count'] - count, stats['label'], fingerprint))
+            previous[fingerprint] = (stats['count'], stats['total'])
+        interval.sort(reverse=True)
+        if interval:
+            lines = [f"  {total * 1000:9.1f} ms {count:7d}x [{label}] {fingerprint[:120]}"
+                     for total, count, label, fingerprint in interval[:5]]
+            app.logger.info("top queries, last %ds:\n%s", QUERY_REPORT_SECONDS, '\n'.join(lines))
+
+class MeteredCursor(sqlite3.Cursor):
+    elapsed = 0.0
+    reported_slow = False
+
+    def _timed(self, run, sql, params, many):
+        self.label = describe_statement(sql)[0]
+        self.sql, self.params = sql, None if many else params
+        self.elapsed, self.reported_slow = 0.0, False
+        start = time.perf_counter()
+        try:
+            return run(sql, params)
+        finally:
+            elapsed = time.perf_counter() - start
+            DB_QUERY_SECONDS.observe(elapsed, self.label)
+            record_query(self, sql, self.params, elapsed)
 
-def init_db():
-    with sqlite3.connect(DB_FILE) as conn:
-        c = conn.cursor()
+    def execute(self, sql, parameters=()):
+        return self._timed(super().execute, sql, parameters, False)
 
-        # Users
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id TEXT PRIMARY KEY,
-                username TEXT,
-                password TEXT,
-                avatar_url TEXT,
-                ai_usage INTEGER DEFAULT 0,
-                groq_key TEXT
-            )
-        ''')
-
-        # Participants
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS chat_participants (
-                room_id TEXT,
-                user_id TEXT,
-                chat_name TEXT,
-                PRIMARY KEY (room_id, user_id)
-            )
-        ''')
-
-        # Messages
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                room_id TEXT,
-                sender_id TEXT,
-                msg_type TEXT,
-                content TEXT,
-                filename TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                status TEXT DEFAULT 'sent'
-            )
-        ''')
-
-        # AI Memory
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS ai_chat_memory (
-                room_id TEXT PRIMARY KEY,
-                summary TEXT,
-                last_updated DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        # AI Global Context
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS ai_global_context (
-                id INTEGER PRIMARY KEY CHECK (id = 1),
-                summary TEXT,
-                last_updated DATETIME
-            )
-        ''')
-        c.execute("INSERT OR IGNORE INTO ai_global_context (id, summary, last_updated) VALUES (1, '', CURRENT_TIMESTAMP)")
-
-        # Rooms table for shared metadata
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS rooms (
-                room_id TEXT PRIMARY KEY,
-                room_name TEXT,
-                room_avatar TEXT,
-                is_group INTEGER DEFAULT 0
-            )
-        ''')
-
-        # Indexes
-        c.execute("CREATE INDEX IF NOT EXISTS idx_messages_room_time ON messages(room_id, id)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_messages_sender ON messages(sender_id)")
-
-        # Migrations
-        try:
-            c.execute("SELECT status FROM messages LIMIT 1")
-        except sqlite3.OperationalError:
-            c.execute("ALTER TABLE messages ADD COLUMN status TEXT DEFAULT 'sent'")
+    def executemany(self, sql, seq_of_parameters):
+        return self._timed(super().executemany, sql, seq_of_parameters, True)
 
+    def fetchall(self):
+        start = time.perf_counter()
         try:
-            c.execute("SELECT ai_usage FROM users LIMIT 1")
-        except sqlite3.OperationalError:
-            c.execute("ALTER TABLE users ADD COLUMN ai_usage INTEGER DEFAULT 0")
-            c.execute("ALTER TABLE users ADD COLUMN groq_key TEXT")
-
-        # Migration for existing rooms
-        c.execute("SELECT room_id FROM chat_participants")
-        rooms = set(r[0] for r in c.fetchall())
-        for rid in rooms:
-            c.execute("INSERT OR IGNORE INTO rooms (room_id, is_group) VALUES (?, ?)",
-                      (rid, 1 if "_" not in rid else 0))
+            return super().fetchall()
+        finally:
+            if hasattr(self, 'sql'):
+                elapsed = time.perf_counter() - start
+                DB_FETCH_SECONDS.observe(elapsed, self.label)
+                record_query(self, self.sql, self.params, elapsed, fetch=True)
+
+class MeteredConnection(sqlite3.Connection):
+    # Connection.execute() would bypass the cursor subclass, so route it explicitly
+    def cursor(self, factory=MeteredCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+# DB executor: sqlite3 calls block in C, so they run on eventlet's thread pool
+# while the calling greenlet yields. Connections are pooled and owned by one
+# greenlet for a whole `with` block: a single writer (serialized by a green
+# lock, as SQLite allows one writer anyway) and up to DB_READERS readers, which
+# WAL mode lets run alongside it.
+DB_EXECUTOR = os.environ.get('ZYLO_DB_EXECUTOR', '1') != '0'  # 0 runs queries inline on the hub
+DB_READERS = int(os.environ.get('ZYLO_DB_READERS', 4))
+
+DB_WAIT_SECONDS = Histogram('zylo_db_connection_wait_seconds', 'Time spent waiting for a pooled connection.', ('kind',))
+Gauge('zylo_db_connections_busy', 'Greenlets holding or waiting for a pooled connection.', ('kind',),
+      read=lambda: {(kind,): n for kind, n in db_pool.busy.items()} if db_pool else {})
+
+def run_db(fn, *args):
+    try:
+        return tpool.execute(fn, *args) if DB_EXECUTOR else fn(*args)
+    finally:
+        if slow_queries:
+            log_slow_queries()
+
+def execute_buffered(conn, sql, params, many):
+    # One thread hop per statement: run it and fetch every row before returning
+    cur = conn.cursor()
+    if many:
+        cur.executemany(sql, params)
+    else:
+        cur.execute(sql, params)
+    rows = cur.fetchall() if cur.description else []
+    return rows, cur.rowcount, cur.lastrowid
+
+class DBCursor:
+    def __init__(self, db):
+        self.db = db
+        self.rows, self.pos = [], 0
+        self.rowcount, self.lastrowid = -1, None
+
+    def execute(self, sql, parameters=()):
+        self.rows, self.rowcount, self.lastrowid = run_db(execute_buffered, self.db.conn, sql, parameters, False)
+        self.pos = 0
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self.rows, self.rowcount, self.lastrowid = run_db(execute_buffered, self.db.conn, sql, list(seq_of_parameters), True)
+        self.pos = 0
+        return self
+
+    def fetchone(self):
+        if self.pos >= len(self.rows):
+            return None
+        self.pos += 1
+        return self.rows[self.pos - 1]
+
+    def fetchall(self):
+        rows = self.rows[self.pos:]
+        self.pos = len(self.rows)
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+class DBConnection:
+    def __init__(self, path, writer):
+        self.writer = writer
+        self.conn = run_db(functools.partial(sqlite3.connect, path, factory=MeteredConnection, check_same_thread=False))
+        self.on_commit = []
+
+    @property
+    def row_factory(self):
+        return self.conn.row_factory
+
+    @row_factory.setter
+    def row_factory(self, factory):
+        self.conn.row_factory = factory
+
+    def cursor(self):
+        return DBCursor(self)
+
+    def execute(self, sql, parameters=()):
+        return DBCursor(self).execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return DBCursor(self).executemany(sql, seq_of_parameters)
+
+    def after_commit(self, fn, *args):
+        # In-memory state mirroring a write (the room cache) changes only once the write is durable
+        self.on_commit.append(functools.partial(fn, *args))
+
+    def commit(self):
+        if self.conn.in_transaction:
+            run_db(self.conn.commit)
+        callbacks, self.on_commit = self.on_commit, []
+        for callback in callbacks:
+            callback()
+
+    def rollback(self):
+        self.on_commit = []
+        if self.conn.in_transaction:
+            run_db(self.conn.rollback)
+
+class DBPool:
+    def __init__(self, path, readers):
+        self.path = path
+        self.writer = None
+        self.writer_lock = Semaphore(1)
+        self.readers = LightQueue()
+        self.readers_open = 0
+        self.max_readers = max(readers, 1)
+        self.busy = {'write': 0, 'read': 0}
+
+    def acquire(self, write):
+        self.busy['write' if write else 'read'] += 1
+        if write:
+            self.writer_lock.acquire()
+            if self.writer is None:
+                self.writer = DBConnection(self.path, True)
+            return self.writer
+        if self.readers.qsize() == 0 and self.readers_open < self.max_readers:
+            self.readers_open += 1
+            return DBConnection(self.path, False)
+        return self.readers.get()
+
+    def release(self, db):
+        db.row_factory = None
+        self.busy['write' if db.writer else 'read'] -= 1
+        if db.writer:
+            self.writer_lock.release()
+        else:
+            self.readers.put(db)
+
+db_pool = None
+db_sessions = {}  # greenlet -> connection it currently holds
+
+@contextlib.contextmanager
+def db_session(write):
+    global db_pool
+    me = greenlet.getcurrent()
+    held = db_sessions.get(me)
+    if held is not None and (held.writer or not write):
+        # Nested block (a helper called inside a handler's block): share the
+        # outer connection and leave the transaction to the outer block
+        yield held
+        return
+    if db_pool is None or db_pool.path != DB_FILE:
+        db_pool = DBPool(DB_FILE, DB_READERS)
+    pool = db_pool
+    start = time.perf_counter()
+    db = pool.acquire(write)
+    DB_WAIT_SECONDS.observe(time.perf_counter() - start, 'write' if write else 'read')
+    db_sessions[me] = db
+    try:
+        yield db
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    finally:
+        if held is not None:
+            db_sessions[me] = held
+        else:
+            db_sessions.pop(me, None)
+        pool.release(db)
 
+def db_connect():
+    # Read-write block; same commit-on-exit semantics as `with sqlite3.connect(...)`
+    return db_session(True)
+
+def db_read():
+    return db_session(False)
+
+# ---------------------------
+# Schema Migrations
+# ---------------------------
+# PRAGMA user_version holds the number of the last step applied, so a boot on an
+# up-to-date database reads one pragma and nothing else. Steps run in order and
+# only once, but must stay idempotent: a crash between a step and its version
+# bump runs it again. Backfills go through backfill_in_chunks, which commits per
+# rowid range so the WAL stays small and an interrupted run keeps its progress.
+MIGRATION_CHUNK_ROWS = 50000
+
+def table_columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+def add_column(conn, table, column, decl):
+    if column in table_columns(conn, table):
+        return False
+    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+    return True
+
+def backfill_in_chunks(conn, table, sql):
+    # sql takes (low, high] rowid bounds and must only touch rows still needing the change
+    (top,) = conn.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {table}").fetchone()
+    changed = 0
+    for low in range(0, top, MIGRATION_CHUNK_ROWS):
+        changed += conn.execute(sql, (low, low + MIGRATION_CHUNK_ROWS)).rowcount
+        conn.commit()
+    return changed
+
+def migrate_base_schema(conn):
+    c = conn.cursor()
+    # Users
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            username TEXT,
+            password TEXT,
+            avatar_url TEXT,
+            ai_usage INTEGER DEFAULT 0,
+            groq_key TEXT
+        )
+    ''')
+
+    # Participants
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS chat_participants (
+            room_id TEXT,
+            user_id TEXT,
+            chat_name TEXT,
+            PRIMARY KEY (room_id, user_id)
+        )
+    ''')
+
+    # Messages
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            room_id TEXT,
+            sender_id TEXT,
+            msg_type TEXT,
+            content TEXT,
+            filename TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            status TEXT DEFAULT 'sent',
+            seq INTEGER DEFAULT 0
+        )
+    ''')
+
+    # AI Memory
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS ai_chat_memory (
+            room_id TEXT PRIMARY KEY,
+            summary TEXT,
+            last_updated DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # AI Global Context
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS ai_global_context (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            summary TEXT,
+            last_updated DATETIME
+        )
+    ''')
+    c.execute("INSERT OR IGNORE INTO ai_global_context (id, summary, last_updated) VALUES (1, '', CURRENT_TIMESTAMP)")
+
+    # Rooms table for shared metadata
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS rooms (
+            room_id TEXT PRIMARY KEY,
+            room_name TEXT,
+            room_avatar TEXT,
+            is_group INTEGER DEFAULT 0,
+            is_channel INTEGER DEFAULT 0,
+            last_msg_id INTEGER DEFAULT 0,
+            seq INTEGER DEFAULT 0
+        )
+    ''')
+
+    # Channel membership: one compact row per subscriber with a read watermark
+    # instead of a chat_participants row (and a per-user chat_name copy).
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS channel_members (
+            room_id TEXT,
+            user_id TEXT,
+            can_post INTEGER DEFAULT 0,
+            last_read_id INTEGER DEFAULT 0,
+            PRIMARY KEY (room_id, user_id)
+        ) WITHOUT ROWID
+    ''')
+
+    # Deleted messages leave a tombstone so sync_room can replay the deletion
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS message_tombstones (
+            room_id TEXT,
+            seq INTEGER,
+            message_id INTEGER,
+            PRIMARY KEY (room_id, seq)
+        ) WITHOUT ROWID
+    ''')
+
+def migrate_legacy_columns(conn):
+    # Databases created before these columns existed; fresh ones already have them
+    add_column(conn, 'messages', 'status', "TEXT DEFAULT 'sent'")
+    add_column(conn, 'messages', 'seq', "INTEGER DEFAULT 0")
+    add_column(conn, 'users', 'ai_usage', "INTEGER DEFAULT 0")
+    add_column(conn, 'users', 'groq_key', "TEXT")
+    add_column(conn, 'rooms', 'is_channel', "INTEGER DEFAULT 0")
+    add_column(conn, 'rooms', 'last_msg_id', "INTEGER DEFAULT 0")
+    add_column(conn, 'rooms', 'seq', "INTEGER DEFAULT 0")
+
+def migrate_indexes(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_room_time ON messages(room_id, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_sender ON messages(sender_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_channel_members_user ON channel_members(user_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_room_seq ON messages(room_id, seq)")
+
+def migrate_message_seq(conn):
+    # Per-room sequence numbers for rows written before seq existed; id is
+    # already monotonic within every room.
+    return backfill_in_chunks(conn, 'messages', "UPDATE messages SET seq = id WHERE rowid > ? AND rowid <= ? AND seq = 0")
+
+def migrate_rooms_from_participants(conn):
+    # Rooms created before the rooms table only exist as participant rows
+    return backfill_in_chunks(conn, 'chat_participants', """
+        INSERT OR IGNORE INTO rooms (room_id, is_group, seq)
+        SELECT room_id, instr(room_id, '_') = 0, (SELECT COALESCE(MAX(seq), 0) FROM messages m WHERE m.room_id = p.room_id)
+        FROM chat_participants p WHERE rowid > ? AND rowid <= ?
+    """)
+
+def migrate_room_seq(conn):
+    return backfill_in_chunks(conn, 'rooms', """
+        UPDATE rooms SET seq = (SELECT COALESCE(MAX(seq), 0) FROM messages m WHERE m.room_id = rooms.room_id)
+        WHERE rowid > ? AND rowid <= ? AND seq = 0
+    """)
+
+def migrate_epoch_timestamps(conn):
+    # '%Y-%m-%d %H:%M:%S' strings in server local time -> integer epoch ms. The
+    # column keeps its DATETIME declaration: numeric affinity stores integers as is.
+    # AI replies and the "Conversation started" message took the column's
+    # DEFAULT CURRENT_TIMESTAMP, which is already UTC, so they skip the 'utc' shift.
+    return backfill_in_chunks(conn, 'messages', f"""
+        UPDATE messages SET timestamp = CAST(strftime('%s', timestamp, CASE
+            WHEN sender_id = '{AI_BOT_ID}' OR (sender_id = 'SYSTEM' AND content = 'Conversation started') THEN '+0 seconds'
+            ELSE 'utc' END) AS INTEGER) * 1000
+        WHERE rowid > ? AND rowid <= ? AND typeof(timestamp) = 'text' AND strftime('%s', timestamp) IS NOT NULL
+    """)
+
+def migrate_timestamp_index(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_room_timestamp ON messages(room_id, timestamp)")
+
+def migrate_client_ids(conn):
+    # Sends carry a client-generated id; a retry of the same send finds the original row
+    add_column(conn, 'messages', 'client_id', "TEXT")
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_client_id ON messages(sender_id, client_id)
+        WHERE client_id IS NOT NULL
+    """)
+
+def migrate_username_index(conn):
+    # /auth looks users up by name; existing plaintext passwords are hashed on their next login
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)")
+
+# Append only: a step's position is its version number
+MIGRATIONS = [
+    migrate_base_schema,
+    migrate_legacy_columns,
+    migrate_indexes,
+    migrate_message_seq,
+    migrate_rooms_from_participants,
+    migrate_room_seq,
+    migrate_epoch_timestamps,
+    migrate_timestamp_index,
+    migrate_client_ids,
+    migrate_username_index,
+]
+
+def migrate(conn):
+    (version,) = conn.execute("PRAGMA user_version").fetchone()
+    if version > len(MIGRATIONS):
+        raise RuntimeError(f"{DB_FILE} is at schema version {version}, newer than this build ({len(MIGRATIONS)})")
+    steps = []
+    for number, step in enumerate(MIGRATIONS[version:], version + 1):
+        start = time.perf_counter()
+        rows = step(conn)
+        conn.execute(f"PRAGMA user_version = {number}")
         conn.commit()
+        steps.append((number, step.__name__, time.perf_counter() - start, rows))
+    return version, steps
+
+def init_db():
+    # Runs before the server starts, so straight on this thread
+    start = time.perf_counter()
+    # Closed explicitly, so tools can reopen the file in another journal mode right after
+    with contextlib.closing(sqlite3.connect(DB_FILE, factory=MeteredConnection)) as conn:
+        # Readers see committed data while the single writer works
+        conn.execute("PRAGMA journal_mode=WAL")
+        version, steps = migrate(conn)
+    elapsed = (time.perf_counter() - start) * 1000
+    if not steps:
+        print(f"schema: version {version}, up to date ({elapsed:.1f} ms)")
+        return
+    print(f"schema: version {version} -> {steps[-1][0]} in {elapsed:.1f} ms")
+    for number, name, seconds, rows in steps:
+        print(f"  {number:>3} {name:<32} {seconds * 1000:>10.1f} ms" + (f"  {rows:,} rows" if rows is not None else ""))
 
 init_db()
 
@@ -149,7 +1739,7 @@ def generate_id():
     while True:
         new_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=10))
         # Ensure ID is unique across users and rooms
-        with sqlite3.connect(DB_FILE) as conn:
+        with db_read() as conn:
             c = conn.cursor()
             c.execute("SELECT 1 FROM users WHERE user_id=?", (new_id,))
             if not c.fetchone():
@@ -160,6 +1750,45 @@ def generate_id():
 def get_unique_room_id(user1, user2):
     return "_".join(sorted([user1, user2]))
 
+def next_room_seq(c, room_id):
+    # Must run inside the transaction that writes the change it numbers
+    c.execute("UPDATE rooms SET seq = seq + 1 WHERE room_id=?", (room_id,))
+    c.execute("SELECT seq FROM rooms WHERE room_id=?", (room_id,))
+    row = c.fetchone()
+    return row[0] if row else 0
+
+def now_ms():
+    # Message timestamps are epoch milliseconds; clients format them in their own timezone
+    return int(time.time() * 1000)
+
+def insert_message(c, room_id, sender_id, msg_type, content, filename='', timestamp=None, status='sent', client_id=None):
+    if timestamp is None:
+        timestamp = now_ms()
+    seq = next_room_seq(c, room_id)
+    c.execute("""
+        INSERT INTO messages (room_id, sender_id, msg_type, content, filename, timestamp, status, seq, client_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (room_id, sender_id, msg_type, content, filename, timestamp, status, seq, client_id))
+    c.db.after_commit(room_cache.on_insert, room_id, {'id': c.lastrowid, 'sender_id': sender_id, 'type': msg_type,
+                                                      'content': content, 'filename': filename, 'time': timestamp,
+                                                      'status': status, 'seq': seq})
+    return c.lastrowid, seq
+
+def channel_feed(room_id):
+    # Socket.IO room every subscriber's socket joins at login, so channel
+    # activity is one broadcast instead of one emit per member.
+    return f"feed_{room_id}"
+
+def join_user_sockets(user_id, room):
+    # Every socket joins its user_id room at login, so that room doubles as
+    # the registry of the user's open connections.
+    for sid, _ in list(socketio.server.manager.get_participants('/', user_id)):
+        socketio.server.enter_room(sid, room, namespace='/')
+
+def leave_user_sockets(user_id, room):
+    for sid, _ in list(socketio.server.manager.get_participants('/', user_id)):
+        socketio.server.leave_room(sid, room, namespace='/')
+
 def get_ai_response(prompt, api_key):
     headers = {
         "Authorization": f"Bearer {api_key}",
@@ -175,29 +1804,514 @@ def get_ai_response(prompt, api_key):
         "max_tokens": 1024
     }
 
+    start = time.perf_counter()
     try:
         response = requests.post(GROQ_BASE_URL, headers=headers, json=payload)
         
         # Check for 401 specifically
         if response.status_code == 401:
+            AI_ERRORS.inc('unauthorized')
             return "AI Error: Error code: 401 - Invalid API Key"
             
         response_data = response.json()
         
         if "error" in response_data:
+             AI_ERRORS.inc('api_error')
              return f"AI Error: {response_data['error'].get('message', 'Unknown error')}"
 
+        usage = response_data.get("usage") or {}
+        AI_TOKENS.inc('prompt', amount=usage.get("prompt_tokens", 0))
+        AI_TOKENS.inc('completion', amount=usage.get("completion_tokens", 0))
+
         if "choices" in response_data and len(response_data["choices"]) > 0:
             return response_data["choices"][0]["message"]["content"]
         
+        AI_ERRORS.inc('empty')
         return "AI Error: No response from model."
 
     except Exception as e:
+        AI_ERRORS.inc('exception')
         return f"AI Error: {str(e)}"
+    finally:
+        AI_REQUEST_SECONDS.observe(time.perf_counter() - start)
+
+# ---------------------------
+# Room Message Cache
+# ---------------------------
+# Joins, reconnect syncs and the AI context all want the newest messages of a
+# room. The cache keeps up to ZYLO_ROOM_CACHE_MESSAGES of them per room, filled
+# on first use and then kept current by commit hooks on every insert, edit,
+# delete and read, so it never serves a write that was rolled back. Rooms are
+# evicted least recently used first once the estimated size passes
+# ZYLO_ROOM_CACHE_MB. A room small enough to fit whole also keeps its full
+# history/delta payload, encoded once per version for every joiner.
+ROOM_CACHE_MESSAGES = int(os.environ.get('ZYLO_ROOM_CACHE_MESSAGES', 500))  # per room; 0 disables the cache
+ROOM_CACHE_MAX_BYTES = int(os.environ.get('ZYLO_ROOM_CACHE_MB', 64)) * 1024 * 1024
+ROOM_CACHE_MESSAGE_OVERHEAD = 400  # a formatted message dict beyond its text, roughly
+
+ROOM_CACHE_LOOKUPS = Counter('zylo_room_cache_lookups_total', 'Room cache lookups by reader and result.',
+                             ('use', 'result'))
+ROOM_CACHE_EVICTIONS = Counter('zylo_room_cache_evictions_total', 'Rooms evicted from the room cache.')
+Gauge('zylo_room_cache_bytes', 'Estimated size of the room message cache.', read=lambda: room_cache.bytes)
+
+def message_bytes(message):
+    return ROOM_CACHE_MESSAGE_OVERHEAD + len(message['content'] or '') + len(message['filename'] or '')
+
+class CachedRoom:
+    __slots__ = ('messages', 'seq', 'floor', 'complete', 'tombstones', 'encoded', 'bytes')
+
+    def __init__(self, messages, seq, complete):
+        self.messages = {m['id']: m for m in messages}  # oldest first
+        self.seq = seq
+        self.floor = seq  # deltas from before the fill need tombstones the cache never saw
+        self.complete = complete  # holds every message in the room
+        self.tombstones = collections.deque()  # (message_id, seq) deleted since the fill
+        self.encoded = {}  # payload kind -> JSON text for the current version
+        self.bytes = sum(message_bytes(m) for m in messages)
+
+class RoomCache:
+    def __init__(self, per_room, max_bytes):
+        self.per_room, self.max_bytes = per_room, max_bytes
+        self.rooms = collections.OrderedDict()  # least recently used first
+        self.loading = {}  # room_id -> [fills in flight, written since they started]
+        self.bytes = 0
+
+    def get(self, c, room_id):
+        if not self.per_room:
+            return None
+        room = self.rooms.get(room_id)
+        if room is not None:
+            self.rooms.move_to_end(room_id)
+            return room
+
+        state = self.loading.setdefault(room_id, [0, False])
+        state[0] += 1
+        try:
+            c.execute(f"SELECT {MESSAGE_COLUMNS} FROM messages WHERE room_id=? ORDER BY id DESC LIMIT ?",
+                      (room_id, self.per_room + 1))
+            rows = c.fetchall()
+            c.execute("SELECT seq FROM rooms WHERE room_id=?", (room_id,))
+            seq_row = c.fetchone()
+        finally:
+            state[0] -= 1
+            if not state[0]:
+                del self.loading[room_id]
+        if room_id in self.rooms:
+            return self.rooms[room_id]  # a concurrent fill got there first
+        if state[1] or seq_row is None:
+            return None  # a commit landed while reading: this snapshot may already be stale
+
+        room = self.rooms[room_id] = CachedRoom(format_messages(reversed(rows[:self.per_room])), seq_row[0],
+                                                len(rows) <= self.per_room)
+        self.bytes += room.bytes
+        self.evict()
+        return room
+
+    def encode(self, room, kind, build):
+        payload = room.encoded.get(kind)
+        if payload is None:
+            payload = room.encoded[kind] = encode_payload(build())
+            room.bytes += len(payload.data)
+            self.bytes += len(payload.data)
+        return payload
+
+    def history(self, c, room_id, columns=False):
+        room = self.get(c, room_id)
+        if room is None or not room.complete:
+            ROOM_CACHE_LOOKUPS.inc('history', 'miss')
+            c.execute(HISTORY_SQL, (room_id,))
+            return message_page(format_messages(c.fetchall()), columns)
+        ROOM_CACHE_LOOKUPS.inc('history', 'hit')
+        return self.encode(room, ('history', columns), lambda: message_page(list(room.messages.values()), columns))
+
+    def delta(self, c, room_id, since_seq, columns=False):
+        room = self.get(c, room_id)
+        if room is not None and since_seq > room.seq:
+            since_seq = 0
+        if room is None or not (room.complete if since_seq == 0 else since_seq >= room.floor):
+            ROOM_CACHE_LOOKUPS.inc('delta', 'miss')
+            return None
+        ROOM_CACHE_LOOKUPS.inc('delta', 'hit')
+        delta = {'room_id': room_id, 'since_seq': since_seq, 'seq': room.seq, 'full': since_seq == 0,
+                 'messages': [], 'deleted': []}
+        if since_seq == 0:
+            return self.encode(room, ('delta', columns),
+                               lambda: dict(delta, messages=message_page(list(room.messages.values()), columns)))
+        if since_seq < room.seq:
+            delta['messages'] = [m for m in room.messages.values() if m['seq'] > since_seq]
+            delta['deleted'] = [message_id for message_id, seq in room.tombstones if seq > since_seq]
+        delta['messages'] = message_page(delta['messages'], columns)
+        return delta
+
+    def recent(self, c, room_id, limit):
+        room = self.get(c, room_id)
+        if room is None or not (room.complete or len(room.messages) >= limit):
+            ROOM_CACHE_LOOKUPS.inc('recent', 'miss')
+            return None
+        ROOM_CACHE_LOOKUPS.inc('recent', 'hit')
+        return list(room.messages.values())[-limit:]
+
+    # Commit hooks. They may replay a write a racing fill already read, so each one is idempotent.
+
+    def written(self, room_id, seq=0):
+        state = self.loading.get(room_id)
+        if state:
+            state[1] = True
+        room = self.rooms.get(room_id)
+        if room is not None:
+            room.seq = max(room.seq, seq)
+            for payload in room.encoded.values():
+                room.bytes -= len(payload.data)
+                self.bytes -= len(payload.data)
+            room.encoded.clear()
+        return room
+
+    def replace(self, room, message):
+        # Cached dicts may still be referenced by payloads in flight, so they are never mutated
+        old = room.messages.get(message['id'])
+        delta = message_bytes(message) - (message_bytes(old) if old else 0)
+        room.messages[message['id']] = message
+        room.bytes += delta
+        self.bytes += delta
+
+    def on_insert(self, room_id, message):
+        room = self.written(room_id, message['seq'])
+        if room is None or message['id'] in room.messages:
+            return
+        out_of_order = room.messages and message['id'] < next(reversed(room.messages))
+        self.replace(room, message)
+        if out_of_order:
+            room.messages = dict(sorted(room.messages.items()))
+        while len(room.messages) > self.per_room:
+            oldest = room.messages.pop(next(iter(room.messages)))
+            room.bytes -= message_bytes(oldest)
+            self.bytes -= message_bytes(oldest)
+            room.complete = False
+            room.floor = max(room.floor, oldest['seq'])
+        self.evict()
+
+    def on_edit(self, room_id, message_id, content, seq):
+        room = self.written(room_id, seq)
+        if room is None:
+            return
+        if message_id in room.messages:
+            self.replace(room, dict(room.messages[message_id], content=content, seq=seq))
+        else:
+            room.floor = max(room.floor, seq)  # an older message than the cache holds changed
+
+    def on_delete(self, room_id, message_id, seq):
+        room = self.written(room_id, seq)
+        if room is None:
+            return
+        old = room.messages.pop(message_id, None)
+        if old is not None:
+            room.bytes -= message_bytes(old)
+            self.bytes -= message_bytes(old)
+        room.tombstones.append((message_id, seq))
+        if len(room.tombstones) > self.per_room:
+            _, oldest_seq = room.tombstones.popleft()
+            room.floor = max(room.floor, oldest_seq)
+
+    def on_read(self, room_id, reader_id):
+        # Mirrors MARK_READ_SQL, which changes status without a new seq
+        room = self.written(room_id)
+        if room is None:
+            return
+        for message in list(room.messages.values()):
+            if message['sender_id'] != reader_id and message['status'] != 'read':
+                self.replace(room, dict(message, status='read'))
+
+    def drop(self, room_id):
+        self.written(room_id)
+        room = self.rooms.pop(room_id, None)
+        if room is not None:
+            self.bytes -= room.bytes
+
+    def evict(self):
+        while self.bytes > self.max_bytes and len(self.rooms) > 1:
+            _, room = self.rooms.popitem(last=False)
+            self.bytes -= room.bytes
+            ROOM_CACHE_EVICTIONS.inc()
+
+room_cache = RoomCache(ROOM_CACHE_MESSAGES, ROOM_CACHE_MAX_BYTES)
 
 # ---------------------------
 # HTML/CSS/JS Frontend
 # ---------------------------
+MESSAGE_VIEW_JS = r"""
+        // --- MESSAGE RENDERING ---
+        // Kept in its own script so benchmarks/bench_render.js can load it under a DOM shim.
+        function escapeHtml(text) {
+            if (!text) return "";
+            return text.replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/>/g, "&gt;").replace(/"/g, "&quot;").replace(/'/g, "&#039;");
+        }
+
+        // Timestamps arrive as epoch milliseconds and are shown in the viewer's timezone
+        const timeFormat = new Intl.DateTimeFormat([], {hour: '2-digit', minute: '2-digit', hourCycle: 'h23'});
+        function formatTime(ms) {
+            return typeof ms === 'number' ? timeFormat.format(ms) : (ms || '');
+        }
+
+        function senderAvatar(senderId) {
+            if (senderId === currentUser.id) {
+                return currentUser.avatar || `https://ui-avatars.com/api/?name=${encodeURIComponent(currentUser.name)}`;
+            }
+            if (senderId === 'AI_ASSISTANT') return "https://img.icons8.com/fluency/96/bot.png";
+
+            // Default to a generic placeholder, NOT the group avatar
+            const u = roomUsersById.get(senderId);
+            if (!u) return `https://ui-avatars.com/api/?name=User&background=random`;
+            // Generate avatar from username if no image set
+            return u.avatar || `https://ui-avatars.com/api/?name=${encodeURIComponent(u.name)}&background=random`;
+        }
+
+        // One element and one innerHTML parse per row; `animate` only for live arrivals
+        function buildMessageRow(msg, animate) {
+            const row = document.createElement('div');
+            row.dataset.messageId = msg.id || '';
+            const settled = animate ? '' : ' settled';
+
+            if (msg.type === 'system') {
+                row.className = 'message-row system' + settled;
+                row.innerHTML = `<div class="message system">${escapeHtml(msg.content)}</div>`;
+                return row;
+            }
+
+            const isMe = msg.sender_id === currentUser.id;
+            const isAI = msg.sender_id === 'AI_ASSISTANT';
+            row.className = `message-row ${isMe ? 'sent' : ''}` + settled;
+
+            let contentHtml = '';
+            if (msg.type === 'text') {
+                const edited = msg.edited ? '<span style="font-size:0.6rem; opacity:0.6; margin-left:5px;">(edited)</span>' : '';
+                contentHtml = `<div>${escapeHtml(msg.content)}${edited}</div>`;
+            } else if (msg.type.startsWith('image')) {
+                contentHtml = `<img src="${msg.content}" class="msg-media" onclick="window.open(this.src)">`;
+            } else {
+                const fname = msg.filename || "Attachment";
+                contentHtml = `
+                    <a href="${msg.content}" target="_blank" class="file-card" download>
+                        <i class="fas fa-file-alt" style="font-size:1.5rem;"></i>
+                        <div><div style="font-weight:600;">${fname}</div></div>
+                    </a>`;
+            }
+
+            const ticks = isMe ? `<span class="ticks ${msg.status === 'read' ? 'read' : ''}"><i class="fas fa-check-double"></i></span>` : '';
+            const messageActions = isMe ? `
+                <div class="message-actions" onclick="toggleMessageMenu(event, '${msg.sender_id}', '${msg.time}', '${msg.id || ''}', '${msg.type}', '${escapeHtml(msg.content)}', '${msg.filename || ''}')">
+                    <i class="fas fa-ellipsis-v"></i>
+                </div>
+                <div class="message-menu" id="menu-${msg.sender_id}-${msg.time}">
+                    <button onclick="editMessage('${msg.sender_id}', '${msg.time}', '${msg.id || ''}')"><i class="fas fa-edit"></i> Edit</button>
+                    <button class="delete" onclick="deleteMessage('${msg.sender_id}', '${msg.time}', '${msg.id || ''}')"><i class="fas fa-trash"></i> Delete</button>
+                </div>
+            ` : '';
+
+            row.innerHTML = `<div class="msg-avatar"><img src="${senderAvatar(msg.sender_id)}" class="msg-avatar-img-${msg.sender_id}"></div>` +
+                `<div class="message ${isMe ? 'sent' : (isAI ? 'received ai-msg' : 'received')}" style="position:relative;">` +
+                contentHtml + `<div class="msg-info"><span>${formatTime(msg.time)}</span>${ticks}</div>` + messageActions + `</div>`;
+            return row;
+        }
+
+        // --- VIRTUALIZED MESSAGE LIST ---
+        // Only rows inside the viewport (plus overscan) are in the DOM. The rest of
+        // the history is two spacer divs sized from measured or estimated heights.
+        class MessageList {
+            constructor(container, buildRow, options = {}) {
+                this.container = container;
+                this.buildRow = buildRow;
+                this.overscan = options.overscan || 10;
+                this.estimate = options.estimate || 72;
+                this.items = [];
+                this.positions = new Map(); // message id -> index in items
+                this.heights = new Map();   // message id -> measured slot height
+                this.rows = new Map();      // message id -> rendered element
+                this.offsets = [0];         // offsets[i] = top of item i, offsets[n] = total
+                this.dirty = true;
+                this.first = 0;
+                this.last = -1;
+                this.fresh = null;
+                this.frame = null;
+                this.topPad = document.createElement('div');
+                this.bottomPad = document.createElement('div');
+                this.topPad.className = 'msg-spacer';
+                this.bottomPad.className = 'msg-spacer';
+                container.addEventListener('scroll', () => this.schedule());
+                this.reset();
+            }
+
+            reset() {
+                this.container.innerHTML = '';
+                this.container.appendChild(this.topPad);
+                this.container.appendChild(this.bottomPad);
+                this.rows.clear();
+                this.first = 0;
+                this.last = -1;
+            }
+
+            setMessages(items) {
+                this.items = items;
+                this.heights.clear();
+                this.positions.clear();
+                this.reindex(0);
+                this.reset();
+                this.render();
+            }
+
+            reindex(from) {
+                for (let i = from; i < this.items.length; i++) this.positions.set(this.items[i].id, i);
+                this.dirty = true;
+            }
+
+            isNearBottom() {
+                const c = this.container;
+                return c.scrollHeight - c.scrollTop - c.clientHeight < 150;
+            }
+
+            append(msg) {
+                const stick = this.isNearBottom();
+                this.items.push(msg);
+                this.positions.set(msg.id, this.items.length - 1);
+                this.dirty = true;
+                this.fresh = msg.id;
+                if (stick) this.scrollToBottom();
+                else this.render();
+            }
+
+            update(id, changes) {
+                const i = this.positions.get(id);
+                if (i === undefined) return;
+                Object.assign(this.items[i], changes);
+                const row = this.rows.get(id);
+                if (row) {
+                    const replacement = this.buildRow(this.items[i], false);
+                    row.parentNode.replaceChild(replacement, row);
+                    this.rows.set(id, replacement);
+                    this.measure();
+                }
+            }
+
+            remove(id) {
+                const i = this.positions.get(id);
+                if (i === undefined) return;
+                this.items.splice(i, 1);
+                this.positions.delete(id);
+                this.heights.delete(id);
+                this.reindex(i);
+                const row = this.rows.get(id);
+                if (row) {
+                    row.remove();
+                    this.rows.delete(id);
+                }
+                this.render();
+            }
+
+            // Rebuild the visible rows, e.g. after read ticks or avatars changed
+            refresh() {
+                this.rows.forEach(row => row.remove());
+                this.rows.clear();
+                this.render();
+            }
+
+            computeOffsets() {
+                if (!this.dirty) return;
+                const n = this.items.length;
+                const offsets = new Array(n + 1);
+                offsets[0] = 0;
+                for (let i = 0; i < n; i++) {
+                    offsets[i + 1] = offsets[i] + (this.heights.get(this.items[i].id) || this.estimate);
+                }
+                this.offsets = offsets;
+                this.dirty = false;
+            }
+
+            // Index of the first item whose bottom edge is below y
+            indexAt(y) {
+                let lo = 0, hi = this.items.length - 1;
+                while (lo < hi) {
+                    const mid = (lo + hi) >> 1;
+                    if (this.offsets[mid + 1] <= y) lo = mid + 1;
+                    else hi = mid;
+                }
+                return lo;
+            }
+
+            schedule() {
+                if (this.frame) return;
+                this.frame = requestAnimationFrame(() => {
+                    this.frame = null;
+                    this.render();
+                });
+            }
+
+            render() {
+                this.computeOffsets();
+                const n = this.items.length;
+                let first = 0, last = -1;
+                if (n) {
+                    const top = this.container.scrollTop;
+                    first = Math.max(0, this.indexAt(top) - this.overscan);
+                    last = Math.min(n - 1, this.indexAt(top + this.container.clientHeight) + this.overscan);
+                }
+
+                // The window is contiguous, so new rows go either before or after the
+                // rows we keep. Each side is built in one fragment and inserted once.
+                const keep = new Map();
+                const before = document.createDocumentFragment();
+                const after = document.createDocumentFragment();
+                let seenKept = false;
+                for (let i = first; i <= last; i++) {
+                    const item = this.items[i];
+                    let row = this.rows.get(item.id);
+                    if (row) {
+                        seenKept = true;
+                    } else {
+                        row = this.buildRow(item, item.id === this.fresh);
+                        (seenKept ? after : before).appendChild(row);
+                    }
+                    keep.set(item.id, row);
+                }
+                this.rows.forEach((row, id) => { if (!keep.has(id)) row.remove(); });
+                this.rows = keep;
+                if (before.firstChild) this.container.insertBefore(before, this.topPad.nextSibling);
+                if (after.firstChild) this.container.insertBefore(after, this.bottomPad);
+
+                this.first = first;
+                this.last = last;
+                this.fresh = null;
+                this.measure();
+            }
+
+            measure() {
+                // A row's slot is the distance to the next row's top, so gaps and margins count.
+                // All reads happen before the spacer writes below.
+                let changed = false;
+                for (let i = this.first; i <= this.last; i++) {
+                    const row = this.rows.get(this.items[i].id);
+                    const next = i < this.last ? this.rows.get(this.items[i + 1].id) : this.bottomPad;
+                    const h = next.offsetTop - row.offsetTop;
+                    if (h > 0 && this.heights.get(this.items[i].id) !== h) {
+                        this.heights.set(this.items[i].id, h);
+                        changed = true;
+                    }
+                }
+                if (changed) this.dirty = true;
+                this.computeOffsets();
+                const n = this.items.length;
+                this.topPad.style.height = this.offsets[this.first] + 'px';
+                this.bottomPad.style.height = (this.offsets[n] - this.offsets[this.last + 1]) + 'px';
+            }
+
+            scrollToBottom() {
+                this.computeOffsets();
+                this.container.scrollTop = this.offsets[this.items.length];
+                this.render();
+                // Measured heights can differ from the estimates: settle on the real bottom
+                this.container.scrollTop = this.container.scrollHeight;
+            }
+        }
+"""
+
 HTML_PAGE = """
 <!DOCTYPE html>
 <html lang="en">
@@ -395,8 +2509,10 @@ HTML_PAGE = """
         #messages {
             flex: 1; padding: 20px; overflow-y: auto;
             display: flex; flex-direction: column; gap: 15px;
-            scroll-behavior: smooth;
+            overflow-anchor: none;
         }
+        .msg-spacer { flex-shrink: 0; }
+        .message-row.settled .message { animation: none; }
 
         .message {
             max-width: 75%; padding: 12px 16px; border-radius: 18px;
@@ -679,12 +2795,13 @@ HTML_PAGE = """
     <div id="new-chat-dialog" class="dialog-overlay">
         <div class="auth-card">
             <h3>Start Conversation</h3>
-            <p>Enter the 10-character code:</p>
+            <p>Enter a 10-character user or channel code:</p>
             <input type="text" id="target-id" class="glass-input" placeholder="e.g. X1Y2Z3A4B5" maxlength="10" style="text-transform:uppercase; text-align:center; letter-spacing: 2px;">
             <div style="display:flex; gap:10px;">
                 <button class="glass-btn" style="background:rgba(255,255,255,0.2); color:white;" onclick="closeDialog('new-chat-dialog')">Cancel</button>
                 <button class="glass-btn" onclick="startNewChat()">Connect</button>
             </div>
+            <button class="glass-btn" style="background:rgba(255,255,255,0.2); color:white; margin-top:10px;" onclick="createChannel()"><i class="fas fa-bullhorn"></i> New Channel</button>
         </div>
     </div>
 
@@ -692,8 +2809,8 @@ HTML_PAGE = """
     <div id="add-member-dialog" class="dialog-overlay">
         <div class="auth-card">
             <h3>Add Member</h3>
-            <p>Enter the ID to add to this chat:</p>
-            <input type="text" id="add-member-id" class="glass-input" placeholder="e.g. X1Y2Z3A4B5" maxlength="10" style="text-transform:uppercase; text-align:center; letter-spacing: 2px;">
+            <p>Enter the IDs to add to this chat (comma or space separated):</p>
+            <input type="text" id="add-member-id" class="glass-input" placeholder="e.g. X1Y2Z3A4B5, Q9W8E7R6T5" style="text-transform:uppercase; text-align:center; letter-spacing: 2px;">
             <div style="display:flex; gap:10px;">
                 <button class="glass-btn" style="background:rgba(255,255,255,0.2); color:white;" onclick="closeDialog('add-member-dialog')">Cancel</button>
                 <button class="glass-btn" onclick="addMember()">Add User</button>
@@ -819,17 +2936,73 @@ HTML_PAGE = """
     </div>
 
     <!-- Scripts -->
-    <script src="https://cdnjs.cloudflare.com/ajax/libs/socket.io/4.5.4/socket.io.min.js"></script>
+    <script src="https://cdnjs.cloudflare.com/ajax/libs/socket.io/4.5.4/socket.io{{ '.msgpack' if msgpack }}.min.js"></script>
     <script src="https://cdnjs.cloudflare.com/ajax/libs/cropperjs/1.5.13/cropper.min.js"></script>
+    <script>""" + MESSAGE_VIEW_JS + """</script>
     <script>
-        const socket = io({reconnection: true});
+        const socket = io({reconnection: true, autoConnect: false}); // connects once /auth returns a token
         let currentUser = null;
         let currentRoom = null;
         let roomAvatars = {}; 
         let currentRoomUsers = [];
+        let roomUsersById = new Map(); // sender lookups while rendering rows
+        let chatMeta = {}; // room_id -> {is_channel, can_post}
+        const messageList = new MessageList(document.getElementById('messages'), buildMessageRow);
+        let roomState = null; // {room_id, seq, messages} mirrored into MessageCache
+        let cacheSaveTimer = null;
+        const TRACING = {{ 'true' if tracing else 'false' }}; // server samples messages for tracing
+
+        // --- LOCAL MESSAGE CACHE (IndexedDB) ---
+        // Rooms are cached per user so re-entering one renders instantly and the
+        // server only has to send what changed since the cached seq.
+        const MessageCache = {
+            dbPromise: null,
+            open() {
+                if(!this.dbPromise) {
+                    this.dbPromise = new Promise((resolve) => {
+                        if(!window.indexedDB) return resolve(null);
+                        const req = indexedDB.open('zylo-link-cache', 1);
+                        req.onupgradeneeded = () => req.result.createObjectStore('rooms', {keyPath: 'key'});
+                        req.onsuccess = () => resolve(req.result);
+                        req.onerror = () => resolve(null);
+                    });
+                }
+                return this.dbPromise;
+            },
+            async load(roomId) {
+                const db = await this.open();
+                if(!db) return null;
+                return new Promise((resolve) => {
+                    const req = db.transaction('rooms').objectStore('rooms').get(`${currentUser.id}:${roomId}`);
+                    req.onsuccess = () => resolve(req.result || null);
+                    req.onerror = () => resolve(null);
+                });
+            },
+            async save(state) {
+                const db = await this.open();
+                if(!db) return;
+                db.transaction('rooms', 'readwrite').objectStore('rooms')
+                  .put({key: `${currentUser.id}:${state.room_id}`, room_id: state.room_id, seq: state.seq, messages: state.messages});
+            },
+            async remove(roomId) {
+                const db = await this.open();
+                if(!db) return;
+                db.transaction('rooms', 'readwrite').objectStore('rooms').delete(`${currentUser.id}:${roomId}`);
+            }
+        };
+
+        function scheduleCacheSave() {
+            if(cacheSaveTimer) clearTimeout(cacheSaveTimer);
+            const state = roomState;
+            cacheSaveTimer = setTimeout(() => { if(state) MessageCache.save(state); }, 500);
+        }
         let pendingAttachment = null;
         let cropper = null;
+        let sessionToken = null;
         let typingTimeout = null;
+        let typingSentAt = 0;
+        let backoffUntil = 0;
+        let chatsRetryTimer = null;
 
         // --- AUTHENTICATION ---
         async function authenticate() {
@@ -847,6 +3020,9 @@ HTML_PAGE = """
                 
                 if(data.success) {
                     currentUser = data.user;
+                    sessionToken = data.token;
+                    socket.auth = {token: data.token};
+                    socket.connect();
                     setupUI();
                 } else {
                     alert(data.message);
@@ -861,14 +3037,9 @@ HTML_PAGE = """
             document.getElementById('display-name').innerText = currentUser.name;
             document.getElementById('my-id-code').innerText = currentUser.id;
             
-            const initialAvatar = currentUser.avatar ? 
-                (currentUser.avatar + '?t=' + new Date().getTime()) : 
-                `https://ui-avatars.com/api/?name=${currentUser.name}&background=random`;
+            const initialAvatar = currentUser.avatar || `https://ui-avatars.com/api/?name=${currentUser.name}&background=random`;
             
             updateMyAvatar(initialAvatar);
-
-            socket.emit('login', {user_id: currentUser.id});
-            loadChats();
         }
 
         function updateMyAvatar(url) {
@@ -879,12 +3050,18 @@ HTML_PAGE = """
         const msgInput = document.getElementById('msg-input');
         
         msgInput.addEventListener('input', () => {
-            if(currentRoom) {
-                socket.emit('typing', { room_id: currentRoom, user_id: currentUser.id });
+            // Typing indicators are the first thing to go while the server asks us to back off;
+            // one 'typing' per couple of seconds keeps the indicator up within the rate limit
+            if(currentRoom && Date.now() >= backoffUntil) {
+                if(Date.now() - typingSentAt >= 2000) {
+                    socket.emit('typing', { room_id: currentRoom, user_id: currentUser.id });
+                    typingSentAt = Date.now();
+                }
                 
                 if(typingTimeout) clearTimeout(typingTimeout);
                 typingTimeout = setTimeout(() => {
                     socket.emit('stop_typing', { room_id: currentRoom, user_id: currentUser.id });
+                    typingSentAt = 0;
                 }, 1000);
             }
         });
@@ -903,7 +3080,7 @@ HTML_PAGE = """
                     if(data.user_id === 'AI_ASSISTANT') {
                         avatarUrl = "https://img.icons8.com/fluency/96/bot.png";
                     } else {
-                        const user = currentRoomUsers.find(u => u.id === data.user_id);
+                        const user = roomUsersById.get(data.user_id);
                         if(user) avatarUrl = user.avatar || `https://ui-avatars.com/api/?name=${user.name}`;
                     }
 
@@ -1043,12 +3220,12 @@ HTML_PAGE = """
         async function uploadAvatarBlob(blob) {
             const formData = new FormData();
             formData.append('file', blob, 'avatar.png');
-            formData.append('user_id', currentUser.id);
             try {
-                const res = await fetch('/upload_avatar', {method:'POST', body:formData});
+                const res = await fetch('/upload_avatar', {method:'POST', body:formData,
+                                                           headers:{'Authorization': `Bearer ${sessionToken}`}});
                 const data = await res.json();
                 if(data.url) {
-                    const newUrl = data.url + '?t=' + new Date().getTime();
+                    const newUrl = data.url; // content-hashed, no cache-busting needed
                     currentUser.avatar = newUrl;
                     updateMyAvatar(newUrl);
                     socket.emit('avatar_update', { user_id: currentUser.id, avatar: newUrl });
@@ -1061,10 +3238,11 @@ HTML_PAGE = """
             formData.append('file', blob, 'avatar.png');
             formData.append('room_id', currentRoom);
             try {
-                const res = await fetch('/upload_room_avatar', {method:'POST', body:formData});
+                const res = await fetch('/upload_room_avatar', {method:'POST', body:formData,
+                                                                headers:{'Authorization': `Bearer ${sessionToken}`}});
                 const data = await res.json();
                 if(data.url) {
-                    const newUrl = data.url + '?t=' + new Date().getTime();
+                    const newUrl = data.url;
                     document.getElementById('current-chat-avatar').src = newUrl;
                     roomAvatars[currentRoom] = newUrl;
                     // Notify others
@@ -1114,22 +3292,48 @@ HTML_PAGE = """
             socket.emit('create_chat', {my_id: currentUser.id, target_id: targetId});
             closeDialog('new-chat-dialog');
         }
+
+        function createChannel() {
+            const name = prompt("Channel name:");
+            if(!name) return;
+            socket.emit('create_channel', {user_id: currentUser.id, name: name});
+            closeDialog('new-chat-dialog');
+        }
         
         async function addMember() {
-            const targetId = document.getElementById('add-member-id').value.trim().toUpperCase();
-            if(!targetId) return;
+            const targetIds = document.getElementById('add-member-id').value.toUpperCase().split(/[\\s,]+/).filter(Boolean);
+            if(!targetIds.length) return;
             if(!currentRoom) return alert("No chat selected");
-            socket.emit('add_member', { room_id: currentRoom, user_id: currentUser.id, target_id: targetId });
+            socket.emit('add_members', { room_id: currentRoom, user_id: currentUser.id, target_ids: targetIds });
             closeDialog('add-member-dialog');
             document.getElementById('add-member-id').value = '';
         }
 
         // Socket Listeners
         socket.on('error', (data) => alert(data.message));
+
+        // The server subscribes the socket from its session token on every (re)connect;
+        // after a reconnect fetch only what was missed in the open room.
+        socket.on('connect', () => {
+            if(!currentUser) return;
+            loadChats();
+            if(currentRoom) {
+                socket.emit('join_room', {room_id: currentRoom, user_id: currentUser.id, since_seq: roomState ? roomState.seq : 0, columns: true});
+            }
+            flushOutbox();
+        });
+        socket.on('connect_error', () => {
+            // A refused token (expired, or signed with another key) is not retried by the client
+            if(currentUser && !socket.active) {
+                alert("Your session has expired, please log in again");
+                location.reload();
+            }
+        });
         socket.on('chat_created', (data) => {
             if(data.success) {
                 loadChats(); 
-                enterRoom(data.room_id, data.chat_name, null);
+                if(data.is_channel) chatMeta[data.room_id] = {is_channel: true, can_post: !!data.can_post};
+                enterRoom(data.room_id, data.chat_name, null, !!data.is_channel);
             } else {
                 alert(data.message);
             }
@@ -1139,7 +3343,18 @@ HTML_PAGE = """
             loadChats();
         });
 
+        // Channel posts arrive as one room-level broadcast: update the sidebar
+        // locally instead of re-fetching the whole chat list.
+        socket.on('channel_activity', (data) => {
+            if(currentRoom === data.room_id) return;
+            const item = document.querySelector(`.chat-item[data-room-id="${data.room_id}"]`);
+            if(!item) return loadChats();
+            item.classList.add('has-unread');
+            item.parentNode.prepend(item);
+        });
+
         socket.on('chat_deleted', (data) => {
+            MessageCache.remove(data.room_id);
             loadChats();
             if (currentRoom === data.room_id) {
                 showSidebar();
@@ -1149,12 +3364,16 @@ HTML_PAGE = """
         });
 
         socket.on('user_avatar_updated', (data) => {
+            const user = roomUsersById.get(data.user_id);
+            if(user) user.avatar = data.avatar; // rows rendered later pick it up
             document.querySelectorAll(`.msg-avatar-img-${data.user_id}`).forEach(img => img.src = data.avatar);
             loadChats();
         });
 
         socket.on('messages_read', (data) => {
             if(currentRoom === data.room_id) {
+                messageList.items.forEach(m => { if(m.sender_id === currentUser.id) m.status = 'read'; });
+                if(roomState && roomState.room_id === data.room_id) scheduleCacheSave();
                 document.querySelectorAll('.ticks').forEach(el => el.classList.add('read'));
             }
         });
@@ -1178,9 +3397,45 @@ HTML_PAGE = """
         
         socket.on('room_users', (users) => {
             currentRoomUsers = users;
+            roomUsersById = new Map(users.map(u => [u.id, u]));
+            messageList.refresh();
         });
 
-        function loadChats() { socket.emit('get_chats', {user_id: currentUser.id}); }
+        function loadChats() {
+            const wait = backoffUntil - Date.now();
+            if(wait > 0) {
+                // One coalesced retry once the server is ready again
+                if(!chatsRetryTimer) chatsRetryTimer = setTimeout(() => { chatsRetryTimer = null; loadChats(); }, wait);
+                return;
+            }
+            socket.emit('get_chats', {user_id: currentUser.id});
+        }
+
+        // Sent before the server drops a connection that fell too far behind; the
+        // reconnect that follows re-syncs the open room
+        socket.on('resync', (data) => {
+            backoffUntil = Date.now() + data.retry_after_ms;
+        });
+
+        // Over a rate limit: sends are retried from the outbox, typing is best effort,
+        // and the rest are repeated once the bucket has a token again
+        socket.on('rate_limited', (data) => {
+            if(data.event === 'get_chats') {
+                backoffUntil = Math.max(backoffUntil, Date.now() + data.retry_after_ms);
+                loadChats();
+            } else if((data.event === 'join_room' || data.event === 'sync_room') && data.room_id === currentRoom) {
+                setTimeout(() => {
+                    if(currentRoom !== data.room_id) return;
+                    socket.emit(data.event, {room_id: currentRoom, user_id: currentUser.id, since_seq: roomState ? roomState.seq : 0, columns: true});
+                }, data.retry_after_ms);
+            }
+        });
+
+        // The server sheds low-priority requests while overloaded and says when to retry
+        socket.on('backoff', (data) => {
+            backoffUntil = Date.now() + data.retry_after_ms;
+            if(data.event === 'get_chats') loadChats();
+        });
 
         socket.on('chat_list', (chats) => {
             const list = document.getElementById('chat-list');
@@ -1193,23 +3448,23 @@ HTML_PAGE = """
                 const li = document.createElement('li');
                 li.className = `chat-item ${currentRoom === chat.room_id ? 'active' : ''} ${chat.has_unread ? 'has-unread' : ''}`;
                 li.dataset.roomId = chat.room_id; 
+                chatMeta[chat.room_id] = {is_channel: !!chat.is_channel, can_post: !!chat.can_post};
 
                 // Use room_avatar for groups, other_avatar for personal chats
                 let avatarUrl;
                 if(chat.is_group) {
-                    avatarUrl = chat.room_avatar || `https://ui-avatars.com/api/?name=${chat.chat_name}&background=random`;
+                    avatarUrl = chat.room_avatar || `https://ui-avatars.com/api/?name=${encodeURIComponent(chat.chat_name)}&background=random`;
                 } else {
-                    avatarUrl = chat.other_avatar || `https://ui-avatars.com/api/?name=${chat.chat_name}&background=random`;
+                    avatarUrl = chat.other_avatar || `https://ui-avatars.com/api/?name=${encodeURIComponent(chat.chat_name)}&background=random`;
                 }
 
-                if(avatarUrl && !avatarUrl.includes('?')) avatarUrl += '?t=' + new Date().getTime();
                 roomAvatars[chat.room_id] = avatarUrl;
 
                 li.innerHTML = `
                     <div class="chat-avatar-small"><img src="${avatarUrl}" id="avatar-room-${chat.room_id}"></div>
                     <div style="flex:1;">
-                        <div style="font-weight:600;">${chat.chat_name}</div>
-                        <div style="font-size:0.8rem; opacity:0.6;">${chat.is_group ? 'Group Chat' : 'Tap to chat'}</div>
+                        <div style="font-weight:600;">${escapeHtml(chat.chat_name)}</div>
+                        <div style="font-size:0.8rem; opacity:0.6;">${chat.is_channel ? 'Channel' : (chat.is_group ? 'Group Chat' : 'Tap to chat')}</div>
                     </div>
                     <div class="unread-dot"></div>
                 `;
@@ -1218,7 +3473,7 @@ HTML_PAGE = """
             });
         });
 
-        function enterRoom(roomId, name, avatarUrl, isGroup) {
+        async function enterRoom(roomId, name, avatarUrl, isGroup) {
             // Toggle Group Avatar Button visibility
             const groupAvatarBtn = document.getElementById('btn-change-group-avatar');
             if(groupAvatarBtn) {
@@ -1235,7 +3490,7 @@ HTML_PAGE = """
             document.getElementById('current-chat-name').innerText = name;
             document.getElementById('typing-container').innerHTML = ''; // clear old typing status
 
-            let finalAvatar = avatarUrl || roomAvatars[roomId] || `https://ui-avatars.com/api/?name=${name}`;
+            let finalAvatar = avatarUrl || roomAvatars[roomId] || `https://ui-avatars.com/api/?name=${encodeURIComponent(name)}`;
             document.getElementById('current-chat-avatar').src = finalAvatar;
             document.querySelectorAll('.chat-item').forEach(el => el.classList.remove('active'));
             const activeItem = document.querySelector(`.chat-item[data-room-id="${roomId}"]`);
@@ -1243,34 +3498,117 @@ HTML_PAGE = """
                 activeItem.classList.add('active');
                 activeItem.classList.remove('has-unread'); // Remove dot when opened
             }
+            // Channels are read-only for subscribers without posting rights
+            const meta = chatMeta[roomId];
+            document.getElementById('msg-form').style.display = (meta && meta.is_channel && !meta.can_post) ? 'none' : '';
+
             showChat(); 
-            socket.emit('join_room', {room_id: roomId, user_id: currentUser.id});
+
+            // Render the cached copy first, then ask only for what changed since
+            roomState = null;
+            messageList.setMessages([]);
+            const cached = await MessageCache.load(roomId);
+            if(currentRoom !== roomId) return;
+            if(cached) {
+                roomState = {room_id: roomId, seq: cached.seq, messages: cached.messages};
+                renderHistory(roomState.messages);
+            }
+            socket.emit('join_room', {room_id: roomId, user_id: currentUser.id, since_seq: cached ? cached.seq : 0, columns: true});
         }
 
-        socket.on('history', (messages) => {
-            const container = document.getElementById('messages');
-            container.innerHTML = '';
+        function renderHistory(messages) {
             messages.forEach(msg => {
                 // Ensure each message has an ID
                 if (!msg.id) {
                     msg.id = `${msg.sender_id}-${msg.time}`;
                 }
-                appendMessage(msg);
             });
-            container.scrollTop = container.scrollHeight;
+            messageList.setMessages(messages);
+            messageList.scrollToBottom();
+        }
+
+        // Room pages are requested as columns (one array per field) and expanded here
+        function expandMessages(page) {
+            if(Array.isArray(page)) return page;
+            const fields = Object.keys(page);
+            return (page.id || []).map((_, i) => {
+                const msg = {};
+                fields.forEach(f => { msg[f] = page[f][i]; });
+                return msg;
+            });
+        }
+
+        socket.on('history', (page) => {
+            const messages = expandMessages(page);
+            if(currentRoom) {
+                const seq = messages.reduce((max, m) => Math.max(max, m.seq || 0), 0);
+                roomState = {room_id: currentRoom, seq: seq, messages: messages};
+                scheduleCacheSave();
+            }
+            renderHistory(messages);
+        });
+
+        socket.on('room_delta', (delta) => {
+            if(currentRoom !== delta.room_id) return;
+            delta.messages = expandMessages(delta.messages);
+            if(delta.full || !roomState || roomState.room_id !== delta.room_id) {
+                roomState = {room_id: delta.room_id, seq: delta.seq, messages: delta.messages};
+                renderHistory(roomState.messages);
+                scheduleCacheSave();
+                return;
+            }
+            if(delta.seq === roomState.seq && !delta.messages.length && !delta.deleted.length) return;
+
+            // Merge: drop deleted ids, upsert new and edited messages in id order
+            const deleted = new Set(delta.deleted);
+            const byId = new Map();
+            roomState.messages.forEach(m => { if(!deleted.has(m.id)) byId.set(m.id, m); });
+            delta.messages.forEach(m => byId.set(m.id, m));
+            roomState.messages = Array.from(byId.values()).sort((a, b) => a.id - b.id);
+            roomState.seq = delta.seq;
+            renderHistory(roomState.messages);
+            scheduleCacheSave();
         });
 
+        // Track live events so the cache stays current; a seq gap means we missed something
+        function trackRoomSeq(roomId, seq) {
+            if(!roomState || roomState.room_id !== roomId || !seq) return false;
+            if(seq > roomState.seq + 1) {
+                socket.emit('sync_room', {room_id: roomId, since_seq: roomState.seq, columns: true});
+                return false;
+            }
+            roomState.seq = Math.max(roomState.seq, seq);
+            scheduleCacheSave();
+            return true;
+        }
+
+        function reportTrace(msg, receivedAt, rendered) {
+            const report = () => socket.emit('trace_report', {
+                trace: msg.trace, message_id: msg.id, user_id: currentUser && currentUser.id,
+                received_at: receivedAt, rendered_at: rendered ? Date.now() : null
+            });
+            // A timeout queued from the next frame callback runs once that frame is painted
+            if(rendered) requestAnimationFrame(() => setTimeout(report, 0));
+            else report();
+        }
+
         socket.on('message', (msg) => {
+            const receivedAt = Date.now();
             if(currentRoom === msg.room_id) {
-                appendMessage(msg);
-                const container = document.getElementById('messages');
-                container.scrollTop = container.scrollHeight;
+                if(roomState && roomState.room_id === msg.room_id && msg.seq) {
+                    if(msg.seq <= roomState.seq) return; // already have it
+                    trackRoomSeq(msg.room_id, msg.seq);
+                }
+                // roomState.messages is the list's own array, so this updates the cache too
+                messageList.append(msg);
+                if(msg.trace) reportTrace(msg, receivedAt, true);
 
                 // If we are looking at the chat, immediately mark as read in DB
                 if(msg.sender_id !== currentUser.id) {
                     socket.emit('mark_read', {room_id: currentRoom, user_id: currentUser.id});
                 }
             } else {
+                if(msg.trace) reportTrace(msg, receivedAt, false);
                 // This part is now handled more reliably by 'refresh_sidebar'
                 loadChats();
             }
@@ -1278,109 +3616,63 @@ HTML_PAGE = """
 
         socket.on('message_deleted', (data) => {
             if(currentRoom === data.room_id) {
-                const messageElements = document.querySelectorAll(`.message-row[data-message-id="${data.message_id}"]`);
-                messageElements.forEach(el => {
-                    el.remove();
-                });
+                trackRoomSeq(data.room_id, data.seq);
+                messageList.remove(data.message_id);
             }
         });
 
         socket.on('message_edited', (data) => {
             if(currentRoom === data.room_id) {
-                const messageRow = document.querySelector(`.message-row[data-message-id="${data.message_id}"]`);
-                if (messageRow) {
-                    const messageDiv = messageRow.querySelector('.message');
-                    const contentDiv = messageDiv.querySelector('div:not(.msg-info):not(.message-menu):not(.message-actions)');
-                    if (contentDiv) {
-                        contentDiv.innerHTML = escapeHtml(data.new_content);
-                        // Add (edited) indicator
-                        const editedSpan = document.createElement('span');
-                        editedSpan.style.fontSize = '0.6rem';
-                        editedSpan.style.opacity = '0.6';
-                        editedSpan.style.marginLeft = '5px';
-                        editedSpan.textContent = '(edited)';
-                        contentDiv.appendChild(editedSpan);
-                    }
-                }
+                trackRoomSeq(data.room_id, data.seq);
+                messageList.update(data.message_id, {content: data.new_content, seq: data.seq, edited: true});
             }
         });
 
-        function appendMessage(msg) {
-            const isMe = msg.sender_id === currentUser.id;
-            const isAI = msg.sender_id === 'AI_ASSISTANT';
-            const container = document.getElementById('messages');
-            
-            if(msg.type === 'system') {
-                 const row = document.createElement('div');
-                 row.className = 'message-row system';
-                 row.innerHTML = `<div class="message system">${msg.content}</div>`;
-                 container.appendChild(row);
-                 return;
-            }
-            
-            const row = document.createElement('div');
-            row.className = `message-row ${isMe ? 'sent' : ''}`;
-            
-            let avatarSrc;
-            if (isMe) {
-                avatarSrc = currentUser.avatar || `https://ui-avatars.com/api/?name=${currentUser.name}`;
-            } else if (isAI) {
-                avatarSrc = "https://img.icons8.com/fluency/96/bot.png";
-            } else {
-                // Default to a generic placeholder, NOT the group avatar
-                avatarSrc = `https://ui-avatars.com/api/?name=User&background=random`;
-
-                // Try to find exact user from room participants
-                const u = currentRoomUsers.find(x => x.id === msg.sender_id);
-                if(u) {
-                    if(u.avatar) {
-                        avatarSrc = u.avatar;
-                    } else {
-                        // Generate avatar from username if no image set
-                        avatarSrc = `https://ui-avatars.com/api/?name=${u.name}&background=random`;
-                    }
-                }
-            }
+        // --- OUTBOX ---
+        // Every send carries a client-generated id and stays here until the server
+        // acknowledges it with the stored message id. Unacknowledged sends are
+        // retried with exponential backoff and after a reconnect; the server answers
+        // a retry of an already stored send from the original row, so nothing posts twice.
+        const OUTBOX_ACK_TIMEOUT_MS = 5000;
+        const OUTBOX_MAX_BACKOFF_MS = 30000;
+        const outbox = new Map(); // client_id -> {data, attempts, timer}
+
+        function newClientId() {
+            if(window.crypto && crypto.randomUUID) return crypto.randomUUID();
+            return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2, 12);
+        }
 
-            const avatarDiv = document.createElement('div');
-            avatarDiv.className = 'msg-avatar';
-            avatarDiv.innerHTML = `<img src="${avatarSrc}" class="msg-avatar-img-${msg.sender_id}">`;
-            
-            const msgBubble = document.createElement('div');
-            msgBubble.className = `message ${isMe ? 'sent' : (isAI ? 'received ai-msg' : 'received')}`;
-            
-            let contentHtml = '';
-            if (msg.type === 'text') {
-                contentHtml = `<div>${escapeHtml(msg.content)}</div>`;
-            } else if (msg.type.startsWith('image')) {
-                contentHtml = `<img src="${msg.content}" class="msg-media" onclick="window.open(this.src)">`;
-            } else {
-                const fname = msg.filename || "Attachment";
-                contentHtml = `
-                    <a href="${msg.content}" target="_blank" class="file-card" download>
-                        <i class="fas fa-file-alt" style="font-size:1.5rem;"></i>
-                        <div><div style="font-weight:600;">${fname}</div></div>
-                    </a>`;
-            }
-            
-            const ticks = isMe ? `<span class="ticks ${msg.status === 'read' ? 'read' : ''}"><i class="fas fa-check-double"></i></span>` : '';
-            const messageActions = isMe ? `
-                <div class="message-actions" onclick="toggleMessageMenu(event, '${msg.sender_id}', '${msg.time}', '${msg.id || ''}', '${msg.type}', '${escapeHtml(msg.content)}', '${msg.filename || ''}')">
-                    <i class="fas fa-ellipsis-v"></i>
-                </div>
-                <div class="message-menu" id="menu-${msg.sender_id}-${msg.time}">
-                    <button onclick="editMessage('${msg.sender_id}', '${msg.time}', '${msg.id || ''}')"><i class="fas fa-edit"></i> Edit</button>
-                    <button class="delete" onclick="deleteMessage('${msg.sender_id}', '${msg.time}', '${msg.id || ''}')"><i class="fas fa-trash"></i> Delete</button>
-                </div>
-            ` : '';
+        function queueSend(data) {
+            data.client_id = newClientId();
+            outbox.set(data.client_id, {data: data, attempts: 0, timer: null});
+            attemptSend(data.client_id);
+        }
 
-            msgBubble.innerHTML = contentHtml + `<div class="msg-info"><span>${msg.time}</span>${ticks}</div>` + messageActions;
-            msgBubble.style.position = 'relative';
+        function attemptSend(clientId) {
+            const entry = outbox.get(clientId);
+            if(!entry) return;
+            clearTimeout(entry.timer);
+            entry.timer = null;
+            if(!socket.connected) return; // the connect handler flushes the outbox
+            entry.attempts++;
+            socket.timeout(OUTBOX_ACK_TIMEOUT_MS).emit('send_message', entry.data, (err, ack) => {
+                if(!outbox.has(clientId)) return;
+                if(!err && ack && ack.error === 'rate_limited') {
+                    entry.timer = setTimeout(() => attemptSend(clientId), ack.retry_after_ms);
+                    return;
+                }
+                if(!err && ack) {
+                    // Rejections (e.g. a read-only channel) are final; the server reports them separately
+                    outbox.delete(clientId);
+                    return;
+                }
+                const backoff = Math.min(OUTBOX_MAX_BACKOFF_MS, 500 * 2 ** entry.attempts);
+                entry.timer = setTimeout(() => attemptSend(clientId), backoff * (0.5 + Math.random() / 2));
+            });
+        }
 
-            row.dataset.messageId = msg.id || '';
-            row.appendChild(avatarDiv);
-            row.appendChild(msgBubble);
-            container.appendChild(row);
+        function flushOutbox() {
+            outbox.forEach((entry, clientId) => attemptSend(clientId));
         }
 
         // --- SENDING LOGIC ---
@@ -1395,17 +3687,19 @@ HTML_PAGE = """
             document.getElementById('file-input').value = '';
 
             if (attachmentToSend) {
-                socket.emit('send_message', {
+                queueSend({
                     room_id: currentRoom, sender_id: currentUser.id,
-                    type: attachmentToSend.type, content: attachmentToSend.url, filename: attachmentToSend.filename
+                    type: attachmentToSend.type, content: attachmentToSend.url, filename: attachmentToSend.filename,
+                    client_sent_at: TRACING ? Date.now() : undefined
                 });
             }
 
             if(text) {
                 setTimeout(() => {
-                    socket.emit('send_message', {
+                    queueSend({
                         room_id: currentRoom, sender_id: currentUser.id,
-                        type: 'text', content: text
+                        type: 'text', content: text,
+                        client_sent_at: TRACING ? Date.now() : undefined
                     });
                 }, attachmentToSend ? 150 : 0);
                 input.value = '';
@@ -1481,11 +3775,6 @@ HTML_PAGE = """
             return Array.from(elements).filter(el => el.textContent.includes(text));
         }
 
-        function escapeHtml(text) {
-            if (!text) return "";
-            return text.replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/>/g, "&gt;").replace(/"/g, "&quot;").replace(/'/g, "&#039;");
-        }
-
         function toggleMessageMenu(event, senderId, time, messageId, type, content, filename) {
             event.stopPropagation();
             const menuId = `menu-${senderId}-${time}`;
@@ -1519,12 +3808,11 @@ HTML_PAGE = """
             // For text messages, show a prompt for editing
             if (message.type === 'text') {
                 const newContent = prompt("Edit your message:", message.content);
-                if (newContent !== null && newContent.trim() !== "") {
+                if (newContent !== null && newContent.trim() !== "" && messageId) {
                     socket.emit('edit_message', {
                         room_id: currentRoom,
                         message_id: messageId,
                         sender_id: senderId,
-                        timestamp: time,
                         new_content: newContent.trim()
                     });
                 }
@@ -1536,13 +3824,12 @@ HTML_PAGE = """
         }
 
         function deleteMessage(senderId, time, messageId) {
-            if (!currentRoom) return;
+            if (!currentRoom || !messageId) return;
             if (confirm("Are you sure you want to delete this message?")) {
                 socket.emit('delete_message', {
                     room_id: currentRoom,
                     message_id: messageId,
-                    sender_id: senderId,
-                    timestamp: time
+                    sender_id: senderId
                 });
             }
         }
@@ -1558,52 +3845,208 @@ HTML_PAGE = """
 </html>
 """
 
+# ---------------------------
+# Sessions & Passwords
+# ---------------------------
+# /auth returns a signed token holding the user id. The socket presents it once
+# at connect; the profile is loaded there and kept in the Socket.IO session, so
+# event handlers take identity from session['user'] rather than from ids in the
+# payload. HTTP routes that act for a user take the same token as
+# "Authorization: Bearer <token>". PBKDF2 is deliberately slow, so hashing runs
+# on the thread pool.
+SESSION_MAX_AGE = int(os.environ.get('ZYLO_SESSION_DAYS', 30)) * 86400
+PASSWORD_ITERATIONS = int(os.environ.get('ZYLO_PASSWORD_ITERATIONS', 200000))
+PASSWORD_SCHEME = 'pbkdf2_sha256'
+
+session_tokens = URLSafeTimedSerializer(app.config['SECRET_KEY'], salt='zylo-session')
+
+def hash_password(password, salt=None, iterations=PASSWORD_ITERATIONS):
+    salt = salt or os.urandom(16).hex()
+    digest = tpool.execute(hashlib.pbkdf2_hmac, 'sha256', password.encode(), salt.encode(), iterations)
+    return f"{PASSWORD_SCHEME}${iterations}${salt}${digest.hex()}"
+
+def verify_password(password, stored):
+    if not stored:
+        return False
+    if not stored.startswith(PASSWORD_SCHEME + '$'):
+        # Stored before hashing was introduced
+        return hmac.compare_digest(password.encode(), stored.encode())
+    _, iterations, salt, _ = stored.split('$')
+    return hmac.compare_digest(hash_password(password, salt, int(iterations)).encode(), stored.encode())
+
+def session_user_id(token):
+    try:
+        return session_tokens.loads(token, max_age=SESSION_MAX_AGE)
+    except (BadSignature, TypeError):
+        return None
+
+def current_user_id():
+    return session['user']['id']
+
+def login_required(view):
+    @functools.wraps(view)
+    def guarded(*args, **kwargs):
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        g.user_id = session_user_id(token) if scheme.lower() == 'bearer' else None
+        if g.user_id is None:
+            return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+        return view(*args, **kwargs)
+    return guarded
+
+# ---------------------------
+# Export
+# ---------------------------
+# /admin/export streams a room, or every room a user belongs to, as NDJSON: a
+# header line, then one {"type": ..., column: value} object per row of each
+# table in EXPORT_RECORDS, messages in room and id order. Rows come from
+# fetchmany on a connection of its own, inside one read transaction, so the
+# export is a consistent snapshot, memory stays flat however big the room is,
+# and a slow download never holds a pooled reader. tools/import_ndjson.py
+# loads the files back. Password hashes are exported, plaintext passwords and
+# API keys never.
+EXPORT_VERSION = 1
+EXPORT_BATCH_ROWS = 1000
+EXPORT_RECORDS = {  # record type -> (table, columns), in file order
+    'room': ('rooms', ('room_id', 'room_name', 'room_avatar', 'is_group', 'is_channel')),
+    'user': ('users', ('user_id', 'username', 'password', 'avatar_url')),
+    'participant': ('chat_participants', ('room_id', 'user_id', 'chat_name')),
+    'channel_member': ('channel_members', ('room_id', 'user_id', 'can_post', 'last_read_id')),
+    'message': ('messages', ('id', 'room_id', 'sender_id', 'msg_type', 'content', 'filename', 'timestamp',
+                             'status', 'seq', 'client_id')),
+}
+EXPORT_SCOPES = {  # rooms covered by an export of a room or of a user
+    'room_id': "SELECT ?",
+    'user_id': "SELECT room_id FROM chat_participants WHERE user_id = ? UNION SELECT room_id FROM channel_members WHERE user_id = ?",
+}
+
+EXPORT_ROWS = Counter('zylo_export_rows_total', 'Rows streamed by /admin/export, by record type.', ('type',))
+
+def export_queries(scope):
+    # (record type, sql, how many times the scope's parameters repeat)
+    members = f"SELECT user_id FROM chat_participants WHERE room_id IN ({scope}) UNION " \
+              f"SELECT user_id FROM channel_members WHERE room_id IN ({scope})"
+    for kind, (table, columns) in EXPORT_RECORDS.items():
+        select = ', '.join(f"CASE WHEN instr(password, '{PASSWORD_SCHEME}$') = 1 THEN password END AS password"
+                           if column == 'password' else column for column in columns)
+        if kind == 'user':
+            yield kind, f"SELECT {select} FROM users WHERE user_id IN ({members})", 2
+        else:
+            order = " ORDER BY room_id, id" if kind == 'message' else ""
+            yield kind, f"SELECT {select} FROM {table} WHERE room_id IN ({scope}){order}", 1
+
+def export_ndjson(scope_key, scope_id, compress):
+    scope = EXPORT_SCOPES[scope_key]
+    encoder = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, 31) if compress else None  # 31: gzip container
+
+    def encode(text):
+        data = text.encode()
+        return encoder.compress(data) if encoder else data
+
+    conn = run_db(functools.partial(sqlite3.connect, DB_FILE, factory=MeteredConnection,
+                                    check_same_thread=False, isolation_level=None))
+    try:
+        run_db(conn.execute, "BEGIN")
+        yield encode(json_dumps({'type': 'export', 'version': EXPORT_VERSION, 'schema_version': len(MIGRATIONS),
+                                 scope_key: scope_id, 'exported_at': int(time.time() * 1000)}) + '\n')
+        for kind, sql, repeat in export_queries(scope):
+            cur = run_db(conn.execute, sql, (scope_id,) * (scope.count('?') * repeat))
+            columns = [d[0] for d in cur.description]
+            while True:
+                rows = run_db(cur.fetchmany, EXPORT_BATCH_ROWS)
+                if not rows:
+                    break
+                EXPORT_ROWS.inc(kind, amount=len(rows))
+                chunk = encode(''.join(json_dumps({'type': kind, **dict(zip(columns, row))}) + '\n' for row in rows))
+                if chunk:
+                    yield chunk
+        if encoder:
+            yield encoder.flush()
+    finally:
+        run_db(conn.close)  # also ends the read transaction
+
 # ---------------------------
 # Flask Routes
 # ---------------------------
 @app.route('/')
 def index():
-    return render_template_string(HTML_PAGE)
+    return render_template_string(HTML_PAGE, tracing=TRACING, msgpack=SERIALIZER == 'msgpack')
+
+# Names are unique for accounts created from now on; databases from before may
+# hold a few accounts per name, and a login hashes the password for at most
+# LOGIN_MAX_CANDIDATES of them, so a popular name cannot multiply PBKDF2 work.
+LOGIN_MAX_CANDIDATES = 5
+USER_LOGIN_SQL = "SELECT user_id, username, password, avatar_url FROM users WHERE username=? ORDER BY rowid LIMIT ?"
 
 @app.route('/auth', methods=['POST'])
 def auth():
     data = request.json
     name = data.get('name')
     password = data.get('pass')
-    
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row
-        c = conn.cursor()
-        c.execute("SELECT * FROM users WHERE username=? AND password=?", (name, password))
-        user = c.fetchone()
-        
-        if user:
-            return jsonify({'success': True, 'user': {'id': user['user_id'], 'name': user['username'], 'avatar': user['avatar_url']}})
-        else:
-            new_id = generate_id()
-            c.execute("INSERT INTO users (user_id, username, password) VALUES (?, ?, ?)", (new_id, name, password))
+    if not name or not password:
+        return jsonify({'success': False, 'message': 'Name and password are required'}), 400
+
+    with db_read() as conn:
+        candidates = conn.execute(USER_LOGIN_SQL, (name, LOGIN_MAX_CANDIDATES)).fetchall()
+    # The password picks the account among legacy duplicates; an unknown name signs up
+    user = next((u for u in candidates if verify_password(password, u[2])), None)
+    if not user and candidates:
+        return jsonify({'success': False, 'message': 'Wrong password for this name'}), 401
+
+    if user:
+        user_id, username, stored, avatar = user
+        if not stored.startswith(PASSWORD_SCHEME + '$'):
+            upgraded = hash_password(password)
+            with db_connect() as conn:
+                conn.execute("UPDATE users SET password=? WHERE user_id=?", (upgraded, user_id))
+                conn.commit()
+        profile = {'id': user_id, 'name': username, 'avatar': avatar}
+    else:
+        hashed = hash_password(password)
+        new_id = generate_id()
+        with db_connect() as conn:
+            # Conditional, so two sign-ups racing for the same name create one account
+            created = conn.execute("""
+                INSERT INTO users (user_id, username, password)
+                SELECT ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM users WHERE username=?)
+            """, (new_id, name, hashed, name)).rowcount
             conn.commit()
-            return jsonify({'success': True, 'user': {'id': new_id, 'name': name, 'avatar': None}})
+        if not created:
+            return jsonify({'success': False, 'message': 'This name is already taken'}), 409
+        profile = {'id': new_id, 'name': name, 'avatar': None}
+    return jsonify({'success': True, 'user': profile, 'token': session_tokens.dumps(profile['id'])})
+
+VERSIONED_AVATAR_RE = re.compile(r'^(avatar|room)_.+_[0-9a-f]{12}\.png$')
+
+def save_versioned_avatar(file, prefix):
+    # Avatars are named by a hash of their bytes: a new picture gets a new URL,
+    # so clients never need cache-busting and the old URL can be cached forever.
+    data = file.read()
+    fname = secure_filename(f"{prefix}_{hashlib.sha256(data).hexdigest()[:12]}.png")
+    path = os.path.join(app.config['UPLOAD_FOLDER'], fname)
+    if not os.path.exists(path):
+        with open(path, 'wb') as f:
+            f.write(data)
+    return f"/uploads/{fname}"
 
 @app.route('/upload_avatar', methods=['POST'])
+@login_required
+@metered_upload('avatar')
 def upload_avatar():
     if 'file' not in request.files: return jsonify({'error': 'No file'})
     file = request.files['file']
-    user_id = request.form.get('user_id')
-    
-    if file and user_id:
-        fname = secure_filename(f"avatar_{user_id}_{int(datetime.datetime.now().timestamp())}.png")
-        path = os.path.join(app.config['UPLOAD_FOLDER'], fname)
-        file.save(path)
-        url = f"/uploads/{fname}"
+    user_id = g.user_id
+
+    if file:
+        url = save_versioned_avatar(file, f"avatar_{user_id}")
         
-        with sqlite3.connect(DB_FILE) as conn:
+        with db_connect() as conn:
             conn.execute("UPDATE users SET avatar_url=? WHERE user_id=?", (url, user_id))
             
         return jsonify({'url': url})
     return jsonify({'error': 'Failed'})
 
 @app.route('/upload', methods=['POST'])
+@metered_upload('file')
 def upload_file():
     if 'file' not in request.files: return jsonify({'error': 'No file'})
     file = request.files['file']
@@ -1620,59 +4063,216 @@ def upload_file():
     return jsonify({'error': 'Failed'})
 
 @app.route('/upload_room_avatar', methods=['POST'])
+@login_required
+@metered_upload('room_avatar')
 def upload_room_avatar():
     if 'file' not in request.files: return jsonify({'error': 'No file'})
     file = request.files['file']
     room_id = request.form.get('room_id')
 
     if file and room_id:
-        fname = secure_filename(f"room_{room_id}_{int(datetime.datetime.now().timestamp())}.png")
-        path = os.path.join(app.config['UPLOAD_FOLDER'], fname)
-        file.save(path)
-        url = f"/uploads/{fname}"
+        with db_read() as conn:
+            if not can_edit_room(conn.cursor(), room_id, g.user_id):
+                return jsonify({'error': 'Not allowed to change this chat'}), 403
+        url = save_versioned_avatar(file, f"room_{room_id}")
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with db_connect() as conn:
             conn.execute("UPDATE rooms SET room_avatar=? WHERE room_id=?", (url, room_id))
 
         return jsonify({'url': url})
     return jsonify({'error': 'Failed'})
 
+@app.route('/add_members', methods=['POST'])
+@login_required
+def add_members_endpoint():
+    data = request.json or {}
+    if not data.get('room_id'):
+        return jsonify({'success': False, 'message': 'room_id is required'}), 400
+    if not is_id_list(data.get('target_ids')):
+        return jsonify({'success': False, 'message': 'target_ids must be a list of user ids'}), 400
+    result = add_members_to_room(data['room_id'], g.user_id, data['target_ids'])
+    return jsonify(result), (200 if result['success'] else 400)
+
 @app.route('/uploads/<filename>')
 def serve_file(filename):
+    if VERSIONED_AVATAR_RE.match(filename):
+        # The name changes whenever the picture does, so this URL never goes stale
+        response = send_from_directory(app.config['UPLOAD_FOLDER'], filename, max_age=AVATAR_MAX_AGE)
+        response.headers['Cache-Control'] = f"public, max-age={AVATAR_MAX_AGE}, immutable"
+        return response
     return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
+@app.route('/metrics')
+def metrics():
+    return render_metrics(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+def admin_required(view):
+    @functools.wraps(view)
+    def guarded(*args, **kwargs):
+        token = request.headers.get('X-Admin-Token', '')
+        if not ADMIN_TOKEN or not hmac.compare_digest(token, ADMIN_TOKEN):
+            return jsonify({'error': 'Forbidden'}), 403
+        return view(*args, **kwargs)
+    return guarded
+
+@app.route('/admin/queries')
+@admin_required
+def admin_queries():
+    global query_stats_since
+    result = {
+        'since': query_stats_since,
+        'slow_threshold_ms': SLOW_QUERY_MS,
+        'queries': top_queries(request.args.get('sort', 'total'), request.args.get('limit', 20, type=int)),
+    }
+    if request.args.get('reset'):
+        with query_stats_lock:
+            query_stats.clear()
+        query_stats_since = time.time()
+    return jsonify(result)
+
+@app.route('/admin/profile')
+@admin_required
+def admin_profile():
+    seconds = request.args.get('seconds', 10, type=float)
+    hz = request.args.get('hz', 100, type=int)
+    if not 0 < seconds <= PROFILE_MAX_SECONDS or not 0 < hz <= PROFILE_MAX_HZ:
+        return jsonify({'error': f'seconds must be in (0, {PROFILE_MAX_SECONDS}], hz in (0, {PROFILE_MAX_HZ}]'}), 400
+    if not profile_lock.acquire(blocking=False):
+        return jsonify({'error': 'A profile is already running'}), 409
+    try:
+        report = run_profile(seconds, hz, include_waiting=request.args.get('waiting') == '1')
+    finally:
+        profile_lock.release()
+    if request.args.get('format') == 'collapsed':
+        return report['collapsed'] + "\n", 200, {'Content-Type': 'text/plain; charset=utf-8'}
+    return jsonify(report)
+
+@app.route('/admin/memory')
+@admin_required
+def admin_memory():
+    current, peak = tracemalloc.get_traced_memory()
+    return jsonify({
+        'rss_mb': round(resident_bytes() / 1e6, 1),
+        'greenlets': greenlet_count(max_age=0),
+        'gc_objects': len(gc.get_objects()),
+        'structures': {name: n for (name,), n in structure_sizes().items()},
+        'tracemalloc': {'tracing': tracemalloc.is_tracing(), 'frames': tracemalloc.get_traceback_limit(),
+                        'traced_mb': round(current / 1e6, 1), 'peak_mb': round(peak / 1e6, 1)},
+    })
+
+@app.route('/admin/export')
+@admin_required
+def admin_export():
+    scope_key = next((key for key in EXPORT_SCOPES if request.args.get(key)), None)
+    if scope_key is None:
+        return jsonify({'error': 'room_id or user_id is required'}), 400
+    scope_id = request.args[scope_key]
+    table = 'rooms' if scope_key == 'room_id' else 'users'
+    with db_read() as conn:
+        if not conn.execute(f"SELECT 1 FROM {table} WHERE {scope_key} = ?", (scope_id,)).fetchone():
+            return jsonify({'error': f'Unknown {scope_key}'}), 404
+    compress = request.args.get('gzip') == '1'
+    filename = f"zylo-{table[:-1]}-{secure_filename(scope_id)}.ndjson" + ('.gz' if compress else '')
+    return Response(export_ndjson(scope_key, scope_id, compress),
+                    mimetype='application/gzip' if compress else 'application/x-ndjson',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@app.route('/admin/tracemalloc/<action>', methods=['GET', 'POST'])
+@admin_required
+def admin_tracemalloc(action):
+    global tracemalloc_baseline
+    if action in ('start', 'stop') and request.method != 'POST':
+        return jsonify({'error': f'POST to {action} tracing'}), 405
+    if action == 'start':
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(max(1, min(request.args.get('frames', 1, type=int), 64)))
+        tracemalloc_baseline = None
+        return jsonify({'tracing': True, 'frames': tracemalloc.get_traceback_limit()})
+    if action == 'stop':
+        tracemalloc.stop()
+        tracemalloc_baseline = None
+        return jsonify({'tracing': False})
+    if action != 'snapshot':
+        return jsonify({'error': 'Unknown action'}), 404
+    if not tracemalloc.is_tracing():
+        return jsonify({'error': 'tracemalloc is not running; POST /admin/tracemalloc/start first'}), 409
+    group_by = request.args.get('group', 'lineno')
+    if group_by not in ('lineno', 'filename', 'traceback'):
+        return jsonify({'error': 'group must be lineno, filename or traceback'}), 400
+    limit = request.args.get('limit', 20, type=int)
+    # Each snapshot is diffed against the previous one, then becomes the new baseline
+    snapshot = take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    result = {'traced_mb': round(current / 1e6, 2), 'peak_mb': round(peak / 1e6, 2),
+              'top': allocation_stats(snapshot, None, group_by, limit)}
+    if tracemalloc_baseline is not None:
+        result['diff'] = allocation_stats(snapshot, tracemalloc_baseline, group_by, limit)
+    tracemalloc_baseline = snapshot
+    return jsonify(result)
+
 # ---------------------------
 # SocketIO Logic
 # ---------------------------
-@socketio.on('login')
-def on_login(data):
-    join_room(data['user_id'])
+@socketio.on('connect')
+def on_connect(auth=None):
+    user_id = session_user_id(auth.get('token')) if isinstance(auth, dict) else None
+    if user_id is None:
+        return False  # rejected: the client goes back to the login screen
+
+    with db_read() as conn:
+        c = conn.cursor()
+        c.execute("SELECT username, avatar_url FROM users WHERE user_id=?", (user_id,))
+        profile = c.fetchone()
+        if profile is None:
+            return False
+        # Subscribe this socket to the activity feed of every channel the user follows
+        c.execute("SELECT room_id FROM channel_members WHERE user_id=?", (user_id,))
+        feeds = [room_id for (room_id,) in c.fetchall()]
+
+    session['user'] = {'id': user_id, 'name': profile[0], 'avatar': profile[1]}
+    join_room(user_id)
+    socket_users[request.sid] = user_id
+    for room_id in feeds:
+        join_room(channel_feed(room_id))
+    if RECORD_FILE:
+        record_event('login', ({'user_id': user_id},))
 
 @socketio.on('create_chat')
 def on_create_chat(data):
-    my_id = data['my_id']
+    my_id = current_user_id()
     target_id = data['target_id']
 
-    with sqlite3.connect(DB_FILE) as conn:
+    with db_connect() as conn:
         c = conn.cursor()
         c.execute("SELECT username FROM users WHERE user_id=?", (target_id,))
         target = c.fetchone()
 
         if not target:
-            emit('chat_created', {'success': False, 'message': 'User ID not found'})
+            # The code may belong to a channel rather than a user: subscribe to it
+            c.execute("SELECT room_name FROM rooms WHERE room_id=? AND is_channel=1", (target_id,))
+            channel = c.fetchone()
+            if not channel:
+                emit('chat_created', {'success': False, 'message': 'User ID not found'})
+                return
+
+            c.execute("INSERT OR IGNORE INTO channel_members (room_id, user_id) VALUES (?, ?)", (target_id, my_id))
+            c.execute("SELECT can_post FROM channel_members WHERE room_id=? AND user_id=?", (target_id, my_id))
+            can_post = c.fetchone()[0]
+            conn.commit()
+            join_user_sockets(my_id, channel_feed(target_id))
+            emit('chat_created', {'success': True, 'room_id': target_id, 'chat_name': channel[0],
+                                  'is_channel': 1, 'can_post': can_post})
             return
 
         room_id = get_unique_room_id(my_id, target_id)
-        c.execute("SELECT username FROM users WHERE user_id=?", (my_id,))
-        my_name = c.fetchone()[0]
+        my_name = session['user']['name']
 
         c.execute("INSERT OR IGNORE INTO chat_participants (room_id, user_id, chat_name) VALUES (?, ?, ?)", (room_id, my_id, target[0]))
         c.execute("INSERT OR IGNORE INTO chat_participants (room_id, user_id, chat_name) VALUES (?, ?, ?)", (room_id, target_id, my_name))
         c.execute("INSERT OR IGNORE INTO rooms (room_id, is_group) VALUES (?, ?)", (room_id, 0))
 
         # Add initial system message so the chat has a timestamp for sorting
-        c.execute("INSERT INTO messages (room_id, sender_id, msg_type, content) VALUES (?, ?, ?, ?)",
-                  (room_id, 'SYSTEM', 'system', 'Conversation started'))
+        insert_message(c, room_id, 'SYSTEM', 'system', 'Conversation started')
 
         conn.commit()
 
@@ -1682,124 +4282,213 @@ def on_create_chat(data):
 
         emit('chat_created', {'success': True, 'room_id': room_id, 'chat_name': target[0]})
 
-@socketio.on('add_member')
-def on_add_member(data):
-    room_id = data['room_id']
-    target_id = data['target_id']
-    requester_id = data['user_id']
+@socketio.on('create_channel')
+def on_create_channel(data):
+    owner_id = current_user_id()
+    # Every subscriber sees the name (the client escapes it); keep it one short line of printable text
+    name = ' '.join(''.join(ch for ch in str(data.get('name') or '') if ch.isprintable()).split())
+    name = name[:CHANNEL_NAME_MAX].strip() or 'Channel'
 
-    with sqlite3.connect(DB_FILE) as conn:
+    with db_connect() as conn:
         c = conn.cursor()
-        
-        # 1. Validate Target User
-        c.execute("SELECT username FROM users WHERE user_id=?", (target_id,))
-        target_row = c.fetchone()
-        if not target_row:
-            emit('error', {'message': 'User not found'}) 
-            return
-        target_name = target_row[0]
+        room_id = generate_id()
+        c.execute("INSERT INTO rooms (room_id, room_name, room_avatar, is_group, is_channel) VALUES (?, ?, ?, 1, 1)",
+                  (room_id, name, CHANNEL_AVATAR_URL))
 
-        # 2. Check if target already in THIS room
-        c.execute("SELECT 1 FROM chat_participants WHERE room_id=? AND user_id=?", (room_id, target_id))
-        if c.fetchone():
-            emit('error', {'message': 'User already in chat'})
-            return
+        last_id, _ = insert_message(c, room_id, 'SYSTEM', 'system',
+                                    f"Channel {name} created. Share code {room_id} to let people follow it.")
+        c.execute("UPDATE rooms SET last_msg_id=? WHERE room_id=?", (last_id, room_id))
+
+        # The creator is the only poster until more are granted
+        c.execute("INSERT INTO channel_members (room_id, user_id, can_post, last_read_id) VALUES (?, ?, 1, ?)",
+                  (room_id, owner_id, last_id))
+        conn.commit()
+
+    join_user_sockets(owner_id, channel_feed(room_id))
+    emit('chat_created', {'success': True, 'room_id': room_id, 'chat_name': name, 'is_channel': 1, 'can_post': 1})
+
+def describe_names(names):
+    if len(names) <= 3:
+        return ", ".join(names)
+    return f"{names[0]}, {names[1]} and {len(names) - 2} others"
+
+def is_id_list(value):
+    return isinstance(value, list) and all(isinstance(v, str) for v in value)
 
-        # 3. Check if current room is a group
-        c.execute("SELECT is_group, room_name FROM rooms WHERE room_id=?", (room_id,))
+def add_members_to_room(room_id, requester_id, target_ids):
+    # Shared by add_member, add_members and the /add_members endpoint: one
+    # validation query, one transaction, one system message and a single
+    # chat_added per affected user, however many people are added.
+    target_ids = list(dict.fromkeys(t for t in target_ids if t))
+    if not target_ids:
+        return {'success': False, 'message': 'No users given'}
+
+    with db_connect() as conn:
+        c = conn.cursor()
+
+        # 1. Validate every target (and resolve the requester's name) in one query
+        c.execute("SELECT user_id, username FROM users WHERE user_id IN (SELECT value FROM json_each(?))",
+                  (json.dumps(target_ids + [requester_id]),))
+        names = dict(c.fetchall())
+        missing = [t for t in target_ids if t not in names]
+        req_name = names.get(requester_id, requester_id)
+
+        # 2. Check if current room is a group
+        c.execute("SELECT is_group, room_name, is_channel FROM rooms WHERE room_id=?", (room_id,))
         room_info = c.fetchone()
         is_currently_group = room_info[0] if room_info else 0
-        
+        is_channel = room_info[2] if room_info else 0
+
+        # 3. Only members add people, and in a channel only those who may post
+        members_table = 'channel_members' if is_channel else 'chat_participants'
+        c.execute(f"SELECT {'can_post' if is_channel else '1'} FROM {members_table} WHERE room_id=? AND user_id=?",
+                  (room_id, requester_id))
+        membership = c.fetchone()
+        if not membership or not membership[0]:
+            return {'success': False, 'message': 'Not allowed to add members here'}
+
+        # 4. Drop targets that are already in THIS room
+        c.execute(f"SELECT user_id FROM {members_table} WHERE room_id=? AND user_id IN (SELECT value FROM json_each(?))",
+                  (room_id, json.dumps(target_ids)))
+        existing = set(r[0] for r in c.fetchall())
+        to_add = [t for t in target_ids if t in names and t not in existing]
+
+        result = {'missing': missing, 'already_members': [t for t in target_ids if t in existing]}
+        if not to_add:
+            result.update(success=False, message='User not found' if missing else 'User already in chat')
+            return result
+
+        if is_channel:
+            # === CHANNEL: subscribe silently, no per-member system message ===
+            c.executemany("INSERT OR IGNORE INTO channel_members (room_id, user_id) VALUES (?, ?)",
+                          [(room_id, uid) for uid in to_add])
+            conn.commit()
+            for uid in to_add:
+                join_user_sockets(uid, channel_feed(room_id))
+                socketio.emit('chat_added', {'room_id': room_id}, room=uid)
+            result.update(success=True, message='Member added', room_id=room_id, added=to_add, converted=False)
+            return result
+
+        added_names = describe_names([names[t] for t in to_add])
+
         if not is_currently_group:
             # === CASE A: CONVERT PRIVATE TO NEW GROUP (Fix DM Hijack) ===
             # Create a BRAND NEW room ID for the group
-            new_room_id = generate_id() 
-            
+            new_room_id = generate_id()
+
             # Fetch existing participants (The two people in the DM)
             c.execute("SELECT user_id FROM chat_participants WHERE room_id=?", (room_id,))
             existing_users = [r[0] for r in c.fetchall()]
-            
+
             # Create the new room entry
             c.execute("INSERT INTO rooms (room_id, is_group, room_name, room_avatar) VALUES (?, 1, 'Group Chat', 'https://img.icons8.com/fluency/96/group-foreground-selected.png')", (new_room_id,))
-            
-            # Add ALL participants to the new room (Existing + New Target)
-            all_users = existing_users + [target_id]
-            for uid in all_users:
-                c.execute("INSERT INTO chat_participants (room_id, user_id, chat_name) VALUES (?, ?, 'Group Chat')", (new_room_id, uid))
-            
+
+            # Add ALL participants to the new room (Existing + New Targets)
+            all_users = existing_users + to_add
+            c.executemany("INSERT INTO chat_participants (room_id, user_id, chat_name) VALUES (?, ?, 'Group Chat')",
+                          [(new_room_id, uid) for uid in all_users])
+
             # System Message
-            c.execute("SELECT username FROM users WHERE user_id=?", (requester_id,))
-            req_name = c.fetchone()[0]
-            sys_msg = f"{req_name} created group with {target_name}"
-            
-            # Insert initial message
-            now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            c.execute("INSERT INTO messages (room_id, sender_id, msg_type, content, timestamp) VALUES (?, 'SYSTEM', 'system', ?, ?)", (new_room_id, sys_msg, now))
+            sys_msg = f"{req_name} created group with {added_names}"
+            insert_message(c, new_room_id, 'SYSTEM', 'system', sys_msg)
             conn.commit()
-            
+
             # Notify everyone to update their lists
             for uid in all_users:
                 socketio.emit('chat_added', {'room_id': new_room_id}, room=uid)
-                
-            # Tell the requester to switch to the new room immediately
-            emit('chat_created', {'success': True, 'room_id': new_room_id, 'chat_name': 'Group Chat'})
-            
-        else:
-            # === CASE B: ADD TO EXISTING GROUP (Legacy Logic) ===
-            current_name = room_info[1] if (room_info and room_info[1]) else "Group Chat"
-            
-            c.execute("INSERT INTO chat_participants (room_id, user_id, chat_name) VALUES (?, ?, ?)",
-                      (room_id, target_id, current_name))
 
-            c.execute("SELECT username FROM users WHERE user_id=?", (requester_id,))
-            requester_name = c.fetchone()[0]
-            sys_msg = f"{requester_name} added {target_name}"
+            result.update(success=True, message='Group created', room_id=new_room_id,
+                          chat_name='Group Chat', added=to_add, converted=True)
+            return result
 
-            now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            c.execute("INSERT INTO messages (room_id, sender_id, msg_type, content, timestamp) VALUES (?, 'SYSTEM', 'system', ?, ?)",
-                      (room_id, sys_msg, now))
-            conn.commit()
+        # === CASE B: ADD TO EXISTING GROUP (Legacy Logic) ===
+        current_name = room_info[1] if (room_info and room_info[1]) else "Group Chat"
 
-            display_time = datetime.datetime.now().strftime('%H:%M')
-            socketio.emit('message', {'sender_id': 'SYSTEM', 'type': 'system', 'content': sys_msg, 'time': display_time, 'room_id': room_id}, room=room_id)
-            
-            # Refresh everyone's sidebar
-            socketio.emit('chat_added', {'room_id': room_id}, room=room_id)
-            socketio.emit('chat_added', {'room_id': room_id}, room=target_id)
-            emit('success', {'message': 'Member added'})
+        c.executemany("INSERT INTO chat_participants (room_id, user_id, chat_name) VALUES (?, ?, ?)",
+                      [(room_id, uid, current_name) for uid in to_add])
+
+        sys_msg = f"{req_name} added {added_names}"
+        sys_time = now_ms()
+        sys_msg_id, sys_seq = insert_message(c, room_id, 'SYSTEM', 'system', sys_msg, timestamp=sys_time)
+        conn.commit()
+
+    socketio.emit('message', {'sender_id': 'SYSTEM', 'type': 'system', 'content': sys_msg, 'time': sys_time, 'room_id': room_id,
+                              'id': sys_msg_id, 'seq': sys_seq}, room=room_id)
+
+    # Refresh everyone's sidebar: one room-wide wave plus one per new member
+    socketio.emit('chat_added', {'room_id': room_id}, room=room_id)
+    for uid in to_add:
+        socketio.emit('chat_added', {'room_id': room_id}, room=uid)
+
+    result.update(success=True, message='Member added' if len(to_add) == 1 else f"{len(to_add)} members added",
+                  room_id=room_id, added=to_add, converted=False)
+    return result
+
+def emit_add_members_result(result):
+    if not result['success']:
+        emit('error', {'message': result['message']})
+    elif result['converted']:
+        # Tell the requester to switch to the new room immediately
+        emit('chat_created', {'success': True, 'room_id': result['room_id'], 'chat_name': result['chat_name']})
+    else:
+        emit('success', {'message': result['message']})
+
+@socketio.on('add_member')
+def on_add_member(data):
+    emit_add_members_result(add_members_to_room(data['room_id'], current_user_id(), [data['target_id']]))
+
+@socketio.on('add_members')
+def on_add_members(data):
+    if not is_id_list(data.get('target_ids')):
+        emit('error', {'message': 'target_ids must be a list of user ids'})
+        return
+    emit_add_members_result(add_members_to_room(data['room_id'], current_user_id(), data['target_ids']))
+
+# Channels: unread is derived lazily from the member's read watermark
+CHAT_LIST_SQL = '''
+    SELECT cp.room_id, cp.chat_name, r.is_group, r.room_avatar,
+           (SELECT u.avatar_url FROM chat_participants cp2
+            JOIN users u ON cp2.user_id = u.user_id
+            WHERE cp2.room_id = cp.room_id AND cp2.user_id != ? LIMIT 1) as other_avatar,
+           (SELECT COUNT(*) FROM messages m
+            WHERE m.room_id = cp.room_id AND m.sender_id != ? AND m.status = 'sent' AND m.msg_type != 'system') as unread_count,
+           (SELECT MAX(timestamp) FROM messages WHERE room_id = cp.room_id) as last_msg_time,
+           0 as is_channel, 1 as can_post
+    FROM chat_participants cp
+    JOIN rooms r ON cp.room_id = r.room_id
+    WHERE cp.user_id = ?
+    UNION ALL
+    SELECT cm.room_id, r.room_name, 1, r.room_avatar, NULL,
+           r.last_msg_id > cm.last_read_id,
+           (SELECT timestamp FROM messages WHERE id = r.last_msg_id),
+           1, cm.can_post
+    FROM channel_members cm
+    JOIN rooms r ON cm.room_id = r.room_id
+    WHERE cm.user_id = ?
+    ORDER BY unread_count DESC, last_msg_time DESC
+'''
 
 @socketio.on('get_chats')
 def on_get_chats(data):
-    user_id = data['user_id']
-    with sqlite3.connect(DB_FILE) as conn:
+    user_id = current_user_id()
+    with db_read() as conn:
         conn.row_factory = sqlite3.Row
         c = conn.cursor()
-        query = '''
-            SELECT cp.room_id, cp.chat_name, r.is_group, r.room_avatar,
-                   (SELECT u.avatar_url FROM chat_participants cp2
-                    JOIN users u ON cp2.user_id = u.user_id
-                    WHERE cp2.room_id = cp.room_id AND cp2.user_id != ? LIMIT 1) as other_avatar,
-                   (SELECT COUNT(*) FROM messages m
-                    WHERE m.room_id = cp.room_id AND m.sender_id != ? AND m.status = 'sent' AND m.msg_type != 'system') as unread_count,
-                   (SELECT MAX(timestamp) FROM messages WHERE room_id = cp.room_id) as last_msg_time
-            FROM chat_participants cp
-            JOIN rooms r ON cp.room_id = r.room_id
-            WHERE cp.user_id = ?
-            ORDER BY unread_count DESC, last_msg_time DESC
-        '''
-        c.execute(query, (user_id, user_id, user_id))
+        c.execute(CHAT_LIST_SQL, (user_id, user_id, user_id, user_id))
         chats = [{
             'room_id': r['room_id'],
             'chat_name': r['chat_name'],
             'other_avatar': r['other_avatar'],
             'is_group': r['is_group'],
+            'is_channel': r['is_channel'],
+            'can_post': r['can_post'],
             'room_avatar': r['room_avatar'],
             'has_unread': r['unread_count'] > 0
         } for r in c.fetchall()]
         emit('chat_list', chats)
 
 def get_room_participants(room_id):
-    with sqlite3.connect(DB_FILE) as conn:
+    with db_read() as conn:
         c = conn.cursor()
         c.execute("""
             SELECT u.user_id, u.username, u.avatar_url 
@@ -1809,43 +4498,139 @@ def get_room_participants(room_id):
         """, (room_id,))
         return [{'id': r[0], 'name': r[1], 'avatar': r[2]} for r in c.fetchall()]
 
+def get_channel_posters(room_id):
+    # Only posters author channel messages, so they are all the client needs for avatars
+    with db_read() as conn:
+        c = conn.cursor()
+        c.execute("""
+            SELECT u.user_id, u.username, u.avatar_url
+            FROM channel_members cm
+            JOIN users u ON cm.user_id = u.user_id
+            WHERE cm.room_id = ? AND cm.can_post = 1
+        """, (room_id,))
+        return [{'id': r[0], 'name': r[1], 'avatar': r[2]} for r in c.fetchall()]
+
+def advance_channel_watermark(c, room_id, user_id):
+    c.execute("""
+        UPDATE channel_members
+        SET last_read_id = (SELECT last_msg_id FROM rooms WHERE room_id = ?)
+        WHERE room_id = ? AND user_id = ?
+    """, (room_id, room_id, user_id))
+
+MESSAGE_COLUMNS = "id, sender_id, msg_type, content, filename, timestamp, status, seq"
+HISTORY_SQL = f"SELECT {MESSAGE_COLUMNS} FROM messages WHERE room_id=? ORDER BY id ASC"
+MARK_READ_SQL = "UPDATE messages SET status='read' WHERE room_id=? AND sender_id!=?"
+
+MESSAGE_FIELDS = ('id', 'sender_id', 'type', 'content', 'filename', 'time', 'status', 'seq')
+
+def format_messages(rows):
+    return [{'id': r[0], 'sender_id': r[1], 'type': r[2], 'content': r[3], 'filename': r[4], 'time': r[5],
+             'status': r[6], 'seq': r[7]} for r in rows]
+
+def message_page(messages, columns=False):
+    # Clients that ask for columns get one array per field: each key goes over the wire once per page
+    if not columns:
+        return messages
+    return {field: [m[field] for m in messages] for field in MESSAGE_FIELDS}
+
+def build_room_delta(c, room_id, since_seq, columns=False):
+    cached = room_cache.delta(c, room_id, since_seq or 0, columns)
+    if cached is not None:
+        return cached
+
+    c.execute("SELECT seq FROM rooms WHERE room_id=?", (room_id,))
+    row = c.fetchone()
+    room_seq = row[0] if row else 0
+
+    since_seq = since_seq or 0
+    if since_seq > room_seq:
+        # The cache is from a room that was deleted and recreated: start over
+        since_seq = 0
+    delta = {'room_id': room_id, 'since_seq': since_seq, 'seq': room_seq, 'full': since_seq == 0,
+             'messages': [], 'deleted': []}
+    if since_seq == room_seq:
+        return delta
+
+    c.execute(f"SELECT {MESSAGE_COLUMNS} FROM messages WHERE room_id=? AND seq>? ORDER BY id ASC", (room_id, since_seq))
+    delta['messages'] = message_page(format_messages(c.fetchall()), columns)
+    if since_seq:
+        c.execute("SELECT message_id FROM message_tombstones WHERE room_id=? AND seq>?", (room_id, since_seq))
+        delta['deleted'] = [r[0] for r in c.fetchall()]
+    return delta
+
+def parse_since_seq(value):
+    # A cached room's sequence number; None when it is not a non-negative integer
+    try:
+        since_seq = int(value or 0)
+    except (TypeError, ValueError):
+        return None
+    return since_seq if since_seq >= 0 else None
+
+def is_room_member(c, room_id, user_id):
+    c.execute("""
+        SELECT EXISTS (SELECT 1 FROM chat_participants WHERE room_id=? AND user_id=?)
+            OR EXISTS (SELECT 1 FROM channel_members WHERE room_id=? AND user_id=?)
+    """, (room_id, user_id, room_id, user_id))
+    return bool(c.fetchone()[0])
+
+def can_edit_room(c, room_id, user_id):
+    # Participants of chats and groups; in a channel only members who may post
+    c.execute("""
+        SELECT EXISTS (SELECT 1 FROM chat_participants WHERE room_id=? AND user_id=?)
+            OR EXISTS (SELECT 1 FROM channel_members WHERE room_id=? AND user_id=? AND can_post)
+    """, (room_id, user_id, room_id, user_id))
+    return bool(c.fetchone()[0])
+
 @socketio.on('join_room')
 def on_join(data):
     room_id = data['room_id']
-    user_id = data['user_id']
+    user_id = current_user_id()
+    since_seq = parse_since_seq(data.get('since_seq'))
+    if since_seq is None:
+        emit('error', {'message': 'since_seq must be a non-negative integer'})
+        return
+    with db_read() as conn:
+        if not is_room_member(conn.cursor(), room_id, user_id):
+            emit('error', {'message': 'Not a member of this chat'})
+            return
 
     # Track presence
     user_current_room[user_id] = room_id
     join_room(room_id)
 
-    with sqlite3.connect(DB_FILE) as conn:
+    with db_connect() as conn:
         c = conn.cursor()
-        c.execute("UPDATE messages SET status='read' WHERE room_id=? AND sender_id!=?", (room_id, user_id))
-        conn.commit()
+        c.execute("SELECT is_group, is_channel FROM rooms WHERE room_id=?", (room_id,))
+        is_group, is_channel = c.fetchone()
 
+        if is_channel:
+            # Channels only move this member's watermark; no per-message read state
+            advance_channel_watermark(c, room_id, user_id)
+        else:
+            c.execute(MARK_READ_SQL, (room_id, user_id))
+            c.db.after_commit(room_cache.on_read, room_id, user_id)
+        conn.commit()
+    if not is_channel:
         emit('messages_read', {'room_id': room_id}, room=room_id)
-        users = get_room_participants(room_id)
-        emit('room_users', users, room=user_id)
 
-        c.execute("SELECT id, sender_id, msg_type, content, filename, timestamp, status FROM messages WHERE room_id=? ORDER BY id ASC", (room_id,))
-        msgs = []
-        for r in c.fetchall():
-            try:
-                dt = datetime.datetime.strptime(r[5], '%Y-%m-%d %H:%M:%S')
-                time_str = dt.strftime('%H:%M')
-            except:
-                time_str = r[5]
-            msgs.append({'id': r[0], 'sender_id': r[1], 'type': r[2], 'content': r[3], 'filename': r[4], 'time': time_str, 'status': r[6]})
+    # History can be large: load it on a reader so it doesn't hold up the writer
+    with db_read() as conn:
+        c = conn.cursor()
+        users = get_channel_posters(room_id) if is_channel else get_room_participants(room_id)
+        emit('room_users', users, room=user_id)
 
-        emit('history', msgs)
+        if 'since_seq' in data:
+            # Client has a local cache: send only what changed since it was saved
+            emit('room_delta', build_room_delta(c, room_id, since_seq, bool(data.get('columns'))))
+        else:
+            emit('history', room_cache.history(c, room_id, bool(data.get('columns'))))
 
     # Presence Logic
-    participants = get_room_participants(room_id)
-    with sqlite3.connect(DB_FILE) as conn:
-        c = conn.cursor()
-        c.execute("SELECT is_group FROM rooms WHERE room_id=?", (room_id,))
-        is_group = c.fetchone()[0]
+    if is_channel:
+        emit('presence_update', {'status': 'Channel'}, room=user_id)
+        return
 
+    participants = get_room_participants(room_id)
     if is_group == 0 and len(participants) == 2:
         other = next(p for p in participants if p['id'] != user_id)
         if user_current_room.get(other['id']) == room_id:
@@ -1855,35 +4640,67 @@ def on_join(data):
     else:
         emit('presence_update', {'status': 'Group Chat' if is_group else 'Connected'}, room=user_id)
 
+@socketio.on('sync_room')
+def on_sync_room(data):
+    # Reconnect resync: no presence or read side effects, only the delta
+    since_seq = parse_since_seq(data.get('since_seq'))
+    if since_seq is None:
+        emit('error', {'message': 'since_seq must be a non-negative integer'})
+        return
+    with db_read() as conn:
+        c = conn.cursor()
+        if not is_room_member(c, data['room_id'], current_user_id()):
+            emit('error', {'message': 'Not a member of this chat'})
+            return
+        emit('room_delta', build_room_delta(c, data['room_id'], since_seq, bool(data.get('columns'))))
+
 @socketio.on('typing')
 def on_typing(data):
     # Broadcast to room except sender
-    emit('typing_status', {'room_id': data['room_id'], 'user_id': data['user_id'], 'is_typing': True}, 
+    emit('typing_status', {'room_id': data['room_id'], 'user_id': current_user_id(), 'is_typing': True}, 
          room=data['room_id'], include_self=False)
 
 @socketio.on('stop_typing')
 def on_stop_typing(data):
-    emit('typing_status', {'room_id': data['room_id'], 'user_id': data['user_id'], 'is_typing': False}, 
+    emit('typing_status', {'room_id': data['room_id'], 'user_id': current_user_id(), 'is_typing': False}, 
          room=data['room_id'], include_self=False)
 
 @socketio.on('mark_read')
 def on_mark_read(data):
     room_id = data['room_id']
-    user_id = data['user_id']
-    with sqlite3.connect(DB_FILE) as conn:
+    user_id = current_user_id()
+    with db_connect() as conn:
         c = conn.cursor()
-        c.execute("UPDATE messages SET status='read' WHERE room_id=? AND sender_id!=?", (room_id, user_id))
+        c.execute("SELECT is_channel FROM rooms WHERE room_id=?", (room_id,))
+        row = c.fetchone()
+        is_channel = row[0] if row else 0
+        if is_channel:
+            advance_channel_watermark(c, room_id, user_id)
+        else:
+            c.execute(MARK_READ_SQL, (room_id, user_id))
+            c.db.after_commit(room_cache.on_read, room_id, user_id)
         conn.commit()
-    emit('messages_read', {'room_id': room_id}, room=room_id)
+    if not is_channel:
+        emit('messages_read', {'room_id': room_id}, room=room_id)
     # Refresh the sidebar for the person who just read the messages
     emit('refresh_sidebar', {'room_id': room_id}, room=user_id)
 
+@socketio.on('disconnect')
+def on_disconnect(reason=None):
+    user_id = socket_users.pop(request.sid, None)
+    if user_id is None:
+        return
+    # Rooms still list this sid while the handler runs; other tabs keep the presence entry
+    others = set(socketio.server.manager.rooms.get('/', {}).get(user_id, {})) - {request.sid}
+    if not others:
+        user_current_room.pop(user_id, None)
+
 @socketio.on('leave_room_manually')
 def on_leave_room_manually(data):
-    user_id = data['user_id']
+    user_id = current_user_id()
     room_id = data['room_id']
     if user_current_room.get(user_id) == room_id:
-        user_current_room[user_id] = None
+        del user_current_room[user_id]
     leave_room(room_id)
     # Notify others in 1-on-1 that user left the view
     participants = get_room_participants(room_id)
@@ -1892,88 +4709,141 @@ def on_leave_room_manually(data):
 
 @socketio.on('save_api_key')
 def on_save_key(data):
-    user_id = data['user_id']
+    user_id = current_user_id()
     key = data['key']
-    with sqlite3.connect(DB_FILE) as conn:
+    with db_connect() as conn:
         conn.execute("UPDATE users SET groq_key=? WHERE user_id=?", (key, user_id))
         conn.commit()
 
+CLIENT_ID_RE = re.compile(r'^[A-Za-z0-9_-]{8,64}$')  # e.g. crypto.randomUUID()
+
 @socketio.on('send_message')
 def on_send(data):
     room_id = data['room_id']
     content = data['content']
     msg_type = data.get('type', 'text')
     fname = data.get('filename', '')
-    sender_id = data['sender_id']
+    sender_id = current_user_id()
 
-    if not room_id or not sender_id:
-        return
+    client_id = data.get('client_id')
 
-    # Get current timestamp for database
-    now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    display_time = datetime.datetime.now().strftime('%H:%M')
+    if not room_id:
+        return {'success': False, 'message': 'room_id is required'}
+    if client_id is not None and not (isinstance(client_id, str) and CLIENT_ID_RE.match(client_id)):
+        return {'success': False, 'message': 'Invalid client_id'}
+
+    with message_trace('send_message', **{'zylo.room_id': room_id, 'zylo.sender_id': sender_id,
+                                          'zylo.msg_type': msg_type}) as trace:
+        if trace:
+            record_client_span(trace.trace_id, trace.span_id, 'client.send', data.get('client_sent_at'),
+                               trace.start / 1_000_000, **{'zylo.sender_id': sender_id})
+        # The return value is the Socket.IO acknowledgement
+        return deliver_message(room_id, content, msg_type, fname, sender_id, trace, client_id)
+
+def deliver_message(room_id, content, msg_type, fname, sender_id, trace, client_id=None):
+    now = now_ms()
 
     # Save User Message
-    with sqlite3.connect(DB_FILE) as conn:
+    with trace_span(trace, 'db.insert'), db_connect() as conn:
         c = conn.cursor()
         c.execute("""
-            INSERT INTO messages (room_id, sender_id, msg_type, content, filename, timestamp, status)
-            VALUES (?, ?, ?, ?, ?, ?, 'sent')
-        """, (room_id, sender_id, msg_type, content, fname, now))
+            SELECT r.is_channel, cm.can_post
+            FROM rooms r
+            LEFT JOIN channel_members cm ON cm.room_id = r.room_id AND cm.user_id = ?
+            WHERE r.room_id = ?
+        """, (sender_id, room_id))
+        room_row = c.fetchone()
+        is_channel = room_row[0] if room_row else 0
+        if is_channel and not room_row[1]:
+            emit('error', {'message': 'Only channel admins can post here'})
+            return {'success': False, 'message': 'Only channel admins can post here'}
+
+        if client_id:
+            # A retry whose first attempt was stored: acknowledge it again, deliver nothing twice
+            c.execute("SELECT id, seq, timestamp FROM messages WHERE sender_id=? AND client_id=?", (sender_id, client_id))
+            original = c.fetchone()
+            if original:
+                SEND_DUPLICATES.inc()
+                return {'success': True, 'id': original[0], 'seq': original[1], 'time': original[2],
+                        'client_id': client_id, 'duplicate': True}
+
+        message_id, seq = insert_message(c, room_id, sender_id, msg_type, content, fname, now, client_id=client_id)
+
+        if is_channel:
+            c.execute("UPDATE rooms SET last_msg_id=? WHERE room_id=?", (message_id, room_id))
+            c.execute("UPDATE channel_members SET last_read_id=? WHERE room_id=? AND user_id=?",
+                      (message_id, room_id, sender_id))
         conn.commit()
 
-        # Get the ID of the inserted message
-        message_id = c.lastrowid
-
-    emit('message', {
+    payload = {
         'sender_id': sender_id,
         'type': msg_type,
         'content': content,
         'filename': fname,
-        'time': display_time,
+        'time': now,
         'room_id': room_id,
         'status': 'sent',
-        'id': message_id
-    }, room=room_id)
-
-    # --- ADD THIS BLOCK HERE ---
-    # Notify all participants to refresh their sidebar for unread dots
-    participants = get_room_participants(room_id)
-    for p in participants:
-        if p['id'] != sender_id:
-            # Send to the user's private room (their user_id)
-            socketio.emit('refresh_sidebar', {'room_id': room_id}, room=p['id'])
-    # ---------------------------
+        'id': message_id,
+        'seq': seq,
+        'client_id': client_id
+    }
+    with trace_span(trace, 'emit.message', **{'zylo.message_id': message_id}) as span:
+        if span:
+            payload['trace'] = span.context()
+        emit('message', payload, room=room_id)
+    ack = {'success': True, 'id': message_id, 'seq': seq, 'time': now, 'client_id': client_id}
+
+    if is_channel:
+        # Single room-level broadcast; subscribers update their sidebar locally
+        with trace_span(trace, 'emit.channel_activity'):
+            socketio.emit('channel_activity', {'room_id': room_id, 'message_id': message_id},
+                          room=channel_feed(room_id), skip_sid=request.sid)
+    else:
+        # --- ADD THIS BLOCK HERE ---
+        # Notify all participants to refresh their sidebar for unread dots
+        with trace_span(trace, 'fanout.sidebar') as span:
+            participants = get_room_participants(room_id)
+            for p in participants:
+                if p['id'] != sender_id:
+                    # Send to the user's private room (their user_id)
+                    socketio.emit('refresh_sidebar', {'room_id': room_id}, room=p['id'])
+            if span:
+                span.attributes['zylo.recipients'] = len(participants) - 1
+        # ---------------------------
 
     # ---------------- AI LOGIC ----------------
     if msg_type == 'text' and content.startswith('@Assistant'):
         user_prompt = content.replace('@Assistant', '').strip()
 
-        with sqlite3.connect(DB_FILE) as conn:
+        with trace_span(trace, 'ai.context'), db_connect() as conn:
             c = conn.cursor()
 
-            # Check usage
-            c.execute("SELECT ai_usage, groq_key FROM users WHERE user_id=?", (sender_id,))
-            usage, user_key = c.fetchone()
-
-            active_key = GROQ_DEFAULT_KEY
-            if usage >= 5:
-                if not user_key:
-                    emit('ai_limit_reached', room=sender_id)
-                    return
-                active_key = user_key
-
-            c.execute("UPDATE users SET ai_usage=? WHERE user_id=?", (usage + 1, sender_id))
+            # Count the request, unless the free quota is spent and the user has no key of their own
+            c.execute("""
+                UPDATE users SET ai_usage = ai_usage + 1
+                WHERE user_id=? AND (ai_usage < 5 OR groq_key != '')
+                RETURNING ai_usage, groq_key
+            """, (sender_id,))
+            quota = c.fetchone()
+            if quota is None:
+                emit('ai_limit_reached', room=sender_id)
+                return ack
+            usage, user_key = quota
+            active_key = user_key if usage > 5 else GROQ_DEFAULT_KEY
 
             # Fetch Recent Messages for Context
-            c.execute("""
-                SELECT sender_id, content
-                FROM messages
-                WHERE room_id=?
-                ORDER BY id DESC
-                LIMIT 15
-            """, (room_id,))
-            recent_msgs = reversed(c.fetchall())
+            cached = room_cache.recent(c, room_id, AI_CONTEXT_MESSAGES)
+            if cached is not None:
+                recent_msgs = [(m['sender_id'], m['content']) for m in cached]
+            else:
+                c.execute("""
+                    SELECT sender_id, content
+                    FROM messages
+                    WHERE room_id=?
+                    ORDER BY id DESC
+                    LIMIT ?
+                """, (room_id, AI_CONTEXT_MESSAGES))
+                recent_msgs = reversed(c.fetchall())
 
             # Construct history string
             history_text = ""
@@ -1998,130 +4868,169 @@ Keep it helpful and concise.
         socketio.emit('typing_status', {'room_id': room_id, 'user_id': AI_BOT_ID, 'is_typing': True}, room=room_id)
         
         # Process asynchronously
-        eventlet.spawn(handle_ai_response, room_id, final_prompt, active_key)
+        eventlet.spawn(handle_ai_response, room_id, final_prompt, active_key, trace)
+
+    return ack
 
-def handle_ai_response(room_id, prompt, api_key):
+def handle_ai_response(room_id, prompt, api_key, trace=None):
+    with trace_span(trace, 'ai_response', **{'zylo.room_id': room_id}) as ai_trace:
+        ai_reply_to_room(room_id, prompt, api_key, ai_trace)
+
+def ai_reply_to_room(room_id, prompt, api_key, trace):
     # Simulate processing time slightly for realism/debounce
-    eventlet.sleep(0.5)
+    with trace_span(trace, 'ai.queue'):
+        eventlet.sleep(0.5)
+        wait_for_capacity('ai_response', AI_MAX_DEFER_SECONDS)
     
-    ai_reply = get_ai_response(prompt, api_key)
+    with trace_span(trace, 'ai.request', **{'zylo.model': AI_MODEL}):
+        ai_reply = get_ai_response(prompt, api_key)
     
     # Save & Emit AI Reply
-    with sqlite3.connect(DB_FILE) as conn:
+    with trace_span(trace, 'db.insert'), db_connect() as conn:
         c = conn.cursor()
-        c.execute("INSERT INTO messages (room_id, sender_id, msg_type, content, filename, status) VALUES (?, ?, ?, ?, ?, ?)", 
-                  (room_id, AI_BOT_ID, 'text', ai_reply, '', 'sent'))
+        now = now_ms()
+        ai_msg_id, ai_seq = insert_message(c, room_id, AI_BOT_ID, 'text', ai_reply, timestamp=now)
+        c.execute("UPDATE rooms SET last_msg_id=? WHERE room_id=? AND is_channel=1", (ai_msg_id, room_id))
+        is_channel = c.rowcount > 0
         conn.commit()
-
-    now = datetime.datetime.now().strftime('%H:%M')
     
     # Stop Typing
     socketio.emit('typing_status', {'room_id': room_id, 'user_id': AI_BOT_ID, 'is_typing': False}, room=room_id)
     
     # Send Message
-    socketio.emit('message', {'sender_id': AI_BOT_ID, 'type': 'text', 'content': ai_reply, 'filename': '', 'time': now, 'room_id': room_id, 'status': 'sent'}, room=room_id)
+    payload = {'sender_id': AI_BOT_ID, 'type': 'text', 'content': ai_reply, 'filename': '', 'time': now, 'room_id': room_id, 'status': 'sent',
+               'id': ai_msg_id, 'seq': ai_seq}
+    with trace_span(trace, 'emit.message', **{'zylo.message_id': ai_msg_id}) as span:
+        if span:
+            payload['trace'] = span.context()
+        socketio.emit('message', payload, room=room_id)
+    if is_channel:
+        socketio.emit('channel_activity', {'room_id': room_id, 'message_id': ai_msg_id}, room=channel_feed(room_id))
+
+@socketio.on('trace_report')
+def on_trace_report(data):
+    # A browser got a traced message: received_at/rendered_at are its own clock in epoch ms
+    trace = data.get('trace') or {}
+    trace_id, parent_id = str(trace.get('id', '')), str(trace.get('span', ''))
+    if not TRACING or not TRACE_ID_RE.match(trace_id) or not SPAN_ID_RE.match(parent_id):
+        return
+    message_id = data.get('message_id')
+    attributes = {'zylo.message_id': message_id if isinstance(message_id, int) else None,
+                  'zylo.user_id': current_user_id(), 'zylo.rendered': 1 if data.get('rendered_at') else 0}
+    record_client_span(trace_id, parent_id, 'client.receive', data.get('received_at'),
+                       data.get('rendered_at') or data.get('received_at'), **attributes)
 
 @socketio.on('rename_chat')
 def on_rename(data):
-    with sqlite3.connect(DB_FILE) as conn:
+    with db_connect() as conn:
         conn.execute("UPDATE chat_participants SET chat_name=? WHERE room_id=? AND user_id=?", 
-                     (data['new_name'], data['room_id'], data['user_id']))
+                     (data['new_name'], data['room_id'], current_user_id()))
 
 @socketio.on('delete_chat')
 def on_delete_chat(data):
     room_id = data['room_id']
-    user_id = data['user_id']
-    with sqlite3.connect(DB_FILE) as conn:
+    user_id = current_user_id()
+    with db_connect() as conn:
         conn.execute("DELETE FROM chat_participants WHERE room_id=? AND user_id=?", (room_id, user_id))
+        conn.execute("DELETE FROM channel_members WHERE room_id=? AND user_id=?", (room_id, user_id))
         # If no participants left, clean up room and messages
         c = conn.cursor()
-        c.execute("SELECT COUNT(*) FROM chat_participants WHERE room_id=?", (room_id,))
-        if c.fetchone()[0] == 0:
+        c.execute("""
+            SELECT EXISTS (SELECT 1 FROM chat_participants WHERE room_id=?)
+                OR EXISTS (SELECT 1 FROM channel_members WHERE room_id=?)
+        """, (room_id, room_id))
+        if not c.fetchone()[0]:
             conn.execute("DELETE FROM rooms WHERE room_id=?", (room_id,))
             conn.execute("DELETE FROM messages WHERE room_id=?", (room_id,))
+            conn.after_commit(room_cache.drop, room_id)
+            conn.execute("DELETE FROM message_tombstones WHERE room_id=?", (room_id,))
         conn.commit()
+    leave_user_sockets(user_id, channel_feed(room_id))
     emit('chat_deleted', {'room_id': room_id}, room=user_id)
 
+def resolve_message_id(c, room_id, message_id, sender_id):
+    # Every message the client shows has its server id (history rows, broadcasts and send acks);
+    # only its sender may edit or delete it
+    try:
+        message_id = int(message_id)
+    except (TypeError, ValueError):
+        return None
+    c.execute("SELECT id FROM messages WHERE id=? AND room_id=? AND sender_id=?", (message_id, room_id, sender_id))
+    row = c.fetchone()
+    return row[0] if row else None
+
 @socketio.on('delete_message')
 def on_delete_message(data):
     room_id = data['room_id']
-    message_id = data.get('message_id')
-    sender_id = data['sender_id']
-    timestamp = data['timestamp']
+    sender_id = current_user_id()
 
-    with sqlite3.connect(DB_FILE) as conn:
+    with db_connect() as conn:
         c = conn.cursor()
-        # Find the message by ID first, then by sender_id and timestamp as fallback
-        if message_id:
-            c.execute("DELETE FROM messages WHERE id=?", (message_id,))
-        else:
-            # Fallback: Match HH:MM timestamp. Use subquery to target only the most recent matching message.
-            c.execute("""
-                DELETE FROM messages
-                WHERE id = (
-                    SELECT id FROM messages 
-                    WHERE room_id=? AND sender_id=? AND strftime('%H:%M', timestamp) = ?
-                    ORDER BY id DESC LIMIT 1
-                )
-            """, (room_id, sender_id, timestamp))
+        message_id = resolve_message_id(c, room_id, data.get('message_id'), sender_id)
+        if message_id is None:
+            return
+
+        c.execute("DELETE FROM messages WHERE id=?", (message_id,))
+        seq = next_room_seq(c, room_id)
+        c.execute("INSERT INTO message_tombstones (room_id, seq, message_id) VALUES (?, ?, ?)", (room_id, seq, message_id))
+        c.db.after_commit(room_cache.on_delete, room_id, message_id, seq)
         conn.commit()
 
-        if c.rowcount > 0:
-            # Notify all users in the room
-            emit('message_deleted', {
-                'room_id': room_id,
-                'message_id': message_id,
-                'sender_id': sender_id,
-                'timestamp': timestamp
-            }, room=room_id)
+    # Notify all users in the room
+    emit('message_deleted', {
+        'room_id': room_id,
+        'message_id': message_id,
+        'sender_id': sender_id,
+        'seq': seq
+    }, room=room_id)
 
 @socketio.on('edit_message')
 def on_edit_message(data):
     room_id = data['room_id']
-    message_id = data.get('message_id')
-    sender_id = data['sender_id']
-    timestamp = data['timestamp']
+    sender_id = current_user_id()
     new_content = data['new_content']
 
-    with sqlite3.connect(DB_FILE) as conn:
+    with db_connect() as conn:
         c = conn.cursor()
-        # Update the message content by ID first, then by sender_id and timestamp as fallback
-        if message_id:
-            c.execute("UPDATE messages SET content=? WHERE id=?", (new_content, message_id))
-        else:
-            # Fallback: Match HH:MM timestamp. Use subquery to target only the most recent matching message.
-            c.execute("""
-                UPDATE messages
-                SET content=?
-                WHERE id = (
-                    SELECT id FROM messages 
-                    WHERE room_id=? AND sender_id=? AND strftime('%H:%M', timestamp) = ?
-                    ORDER BY id DESC LIMIT 1
-                )
-            """, (new_content, room_id, sender_id, timestamp))
+        message_id = resolve_message_id(c, room_id, data.get('message_id'), sender_id)
+        if message_id is None:
+            return
+
+        # The edit takes a fresh seq so sync_room re-sends the message
+        seq = next_room_seq(c, room_id)
+        c.execute("UPDATE messages SET content=?, seq=? WHERE id=?", (new_content, seq, message_id))
+        c.db.after_commit(room_cache.on_edit, room_id, message_id, new_content, seq)
         conn.commit()
 
-        if c.rowcount > 0:
-            # Notify all users in the room
-            emit('message_edited', {
-                'room_id': room_id,
-                'message_id': message_id,
-                'sender_id': sender_id,
-                'timestamp': timestamp,
-                'new_content': new_content
-            }, room=room_id)
+    # Notify all users in the room
+    emit('message_edited', {
+        'room_id': room_id,
+        'message_id': message_id,
+        'sender_id': sender_id,
+        'new_content': new_content,
+        'seq': seq
+    }, room=room_id)
 
 @socketio.on('avatar_update')
 def on_avatar_update(data):
-    emit('user_avatar_updated', data, broadcast=True)
+    session['user']['avatar'] = data.get('avatar')
+    emit('user_avatar_updated', {'user_id': current_user_id(), 'avatar': data.get('avatar')}, broadcast=True)
 
 @socketio.on('update_room_avatar')
 def on_update_room_avatar(data):
     room_id = data['room_id']
     # Fix: Use 'avatar' which is what the frontend sends
     avatar_url = data['avatar']
-    
-    with sqlite3.connect(DB_FILE) as conn:
+    # Only a picture /upload_room_avatar stored, set by someone who may change the room
+    if not (isinstance(avatar_url, str) and avatar_url.startswith('/uploads/')
+            and VERSIONED_AVATAR_RE.match(avatar_url[len('/uploads/'):])):
+        emit('error', {'message': 'Invalid avatar'})
+        return
+
+    with db_connect() as conn:
+        if not can_edit_room(conn.cursor(), room_id, current_user_id()):
+            emit('error', {'message': 'Not allowed to change this chat'})
+            return
         conn.execute("UPDATE rooms SET room_avatar=? WHERE room_id=?", (avatar_url, room_id))
         conn.commit()
     
@@ -2129,9 +5038,22 @@ def on_update_room_avatar(data):
     emit('room_avatar_updated', {'room_id': room_id, 'avatar_url': avatar_url}, room=room_id)
 
 if __name__ == "__main__":
+    port = int(os.environ.get('PORT', 5000))
+    app.logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
+    if QUERY_REPORT_SECONDS > 0:
+        socketio.start_background_task(query_report_loop)
+    if TRACEMALLOC_FRAMES > 0:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    if MEMORY_REPORT_SECONDS > 0:
+        socketio.start_background_task(memory_report_loop)
+    if TRACING:
+        socketio.start_background_task(trace_export_loop)
+    if RECORD_FILE:
+        socketio.start_background_task(record_flush_loop)
+    socketio.start_background_task(hub_lag_monitor)
     print("\n💎 ZYLO LINK Ultimate Running Successfully")
-    print("👉 http://127.0.0.1:5000")
-    socketio.run(app, host="0.0.0.0", port=5000, debug=False)
+    print(f"👉 http://127.0.0.1:{port}")
+    socketio.run(app, host="0.0.0.0", port=port, debug=False)
 
 
 
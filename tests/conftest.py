@@ -0,0 +1,58 @@
+import itertools
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+user_numbers = itertools.count(1)
+
+
+@pytest.fixture(scope='session')
+def message(tmp_path_factory):
+    # message.py creates its DB and upload folder relative to the CWD on import
+    # and opens the DB by that relative path later, so the CWD stays put until the end
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("zylo"))
+    sys.path.insert(0, ROOT)
+    try:
+        import message
+        yield message
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture(autouse=True)
+def fresh_rate_buckets(request):
+    # Every test starts with full token buckets
+    if 'message' in request.fixturenames:
+        request.getfixturevalue('message').rate_buckets.clear()
+
+
+@pytest.fixture
+def login(message):
+    # login('alice') -> (user_id, connected Socket.IO test client); names are unique per call
+    clients = []
+
+    def connect(name):
+        res = message.app.test_client().post('/auth', json={'name': f"{name}_{next(user_numbers)}", 'pass': 'pw'})
+        body = res.get_json()
+        client = message.socketio.test_client(message.app, auth={'token': body['token']})
+        clients.append(client)
+        return body['user']['id'], client
+
+    yield connect
+    for client in clients:
+        if client.is_connected():
+            client.disconnect()
+
+
+def received(client, event):
+    # The test client hands 'message' events over as the bare payload, others as an argument list
+    return [packet['args'] if isinstance(packet['args'], dict) else packet['args'][0]
+            for packet in client.get_received() if packet['name'] == event]
+
+
+def create_chat(client, target_id):
+    client.emit('create_chat', {'target_id': target_id})
+    return received(client, 'chat_created')[-1]['room_id']
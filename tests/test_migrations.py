@@ -0,0 +1,58 @@
+"""
+Schema migrations against a database written by the release before them.
+
+Run with: python -m pytest -q tests
+"""
+import calendar
+import contextlib
+import sqlite3
+import time
+
+import pytest
+
+# The release before versioned migrations: text timestamps, no seq, no rooms.seq/last_msg_id
+LEGACY_SCHEMA = """
+    CREATE TABLE users (user_id TEXT PRIMARY KEY, username TEXT, password TEXT, avatar_url TEXT,
+                        ai_usage INTEGER DEFAULT 0, groq_key TEXT);
+    CREATE TABLE chat_participants (room_id TEXT, user_id TEXT, chat_name TEXT, PRIMARY KEY (room_id, user_id));
+    CREATE TABLE messages (id INTEGER PRIMARY KEY AUTOINCREMENT, room_id TEXT, sender_id TEXT, msg_type TEXT,
+                           content TEXT, filename TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                           status TEXT DEFAULT 'sent');
+    CREATE TABLE rooms (room_id TEXT PRIMARY KEY, room_name TEXT, room_avatar TEXT, is_group INTEGER DEFAULT 0);
+"""
+
+
+@pytest.fixture
+def new_york(monkeypatch):
+    # SQLite's 'utc' modifier reads the process timezone
+    monkeypatch.setenv('TZ', 'America/New_York')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def utc_ms(text):
+    return calendar.timegm(time.strptime(text, '%Y-%m-%d %H:%M:%S')) * 1000
+
+
+def test_epoch_timestamps_keep_utc_default_rows(message, new_york, tmp_path):
+    rows = [
+        # sender, type, content, stored timestamp, expected UTC
+        ('U1', 'text', 'evening', '2024-01-15 23:05:00', '2024-01-16 04:05:00'),           # local, EST
+        ('U1', 'text', 'summer', '2024-07-01 12:00:00', '2024-07-01 16:00:00'),            # local, EDT
+        ('SYSTEM', 'system', 'U1 added U2', '2024-07-01 12:00:00', '2024-07-01 16:00:00'),  # local
+        (message.AI_BOT_ID, 'text', 'reply', '2024-01-16 04:05:00', '2024-01-16 04:05:00'),  # CURRENT_TIMESTAMP
+        ('SYSTEM', 'system', 'Conversation started', '2024-07-01 16:00:00', '2024-07-01 16:00:00'),
+    ]
+    with contextlib.closing(sqlite3.connect(tmp_path / 'legacy.db')) as conn:
+        conn.executescript(LEGACY_SCHEMA)
+        conn.executemany("INSERT INTO messages (room_id, sender_id, msg_type, content, timestamp) VALUES ('R1', ?, ?, ?, ?)",
+                         [row[:4] for row in rows])
+        conn.commit()
+
+        version, steps = message.migrate(conn)
+
+        assert version == 0 and len(steps) == len(message.MIGRATIONS)
+        migrated = [ts for (ts,) in conn.execute("SELECT timestamp FROM messages ORDER BY id")]
+    assert migrated == [utc_ms(row[4]) for row in rows]
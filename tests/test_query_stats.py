@@ -0,0 +1,33 @@
+"""
+Query profiler aggregates updated from several DB executor threads at once.
+"""
+import types
+
+
+def test_record_query_from_many_threads(message, monkeypatch):
+    monkeypatch.setattr(message, 'MAX_QUERY_FINGERPRINTS', 50)
+    monkeypatch.setattr(message, 'query_stats', {})
+    threads, calls = 8, 3000
+    errors = []
+
+    def run(worker):
+        cursor = types.SimpleNamespace(elapsed=0.0, reported_slow=True, connection=None)
+        try:
+            for i in range(calls):
+                # One statement every thread shares, plus a flood of distinct ones that forces eviction
+                message.record_query(cursor, "SELECT 1 FROM users WHERE user_id=?", None, 0.001)
+                message.record_query(cursor, f"SELECT c{worker * calls + i} FROM rooms", None, 0.0)
+        except Exception as e:  # surfaced by the assertion below
+            errors.append(e)
+
+    # Real OS threads, as in the DB executor, not green ones
+    workers = [message.real_threading.Thread(target=run, args=(n,)) for n in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert errors == []
+    assert len(message.query_stats) <= message.MAX_QUERY_FINGERPRINTS
+    (shared,) = [stats for _, stats in message.query_stats_snapshot() if stats['label'].startswith('select users')]
+    assert shared['count'] == threads * calls
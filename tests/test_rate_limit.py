@@ -0,0 +1,68 @@
+"""
+Token buckets rejecting bursts of socket events beyond their size.
+"""
+import pytest
+
+from conftest import create_chat, received
+
+
+@pytest.fixture
+def chat(login):
+    alice_id, alice = login('alice')
+    bob_id, bob = login('bob')
+    room_id = create_chat(alice, bob_id)
+    for client in (alice, bob):
+        client.emit('join_room', {'room_id': room_id})
+        client.get_received()
+    return room_id, alice, bob
+
+
+def limits(message, monkeypatch, **buckets):
+    # A refill rate far below the test's duration, so only the burst counts
+    monkeypatch.setattr(message, 'RATE_LIMITS', {cls: (0.001, burst) for cls, burst in buckets.items()})
+
+
+def send(client, room_id, n):
+    return client.emit('send_message', {'room_id': room_id, 'content': f"burst {n}", 'client_id': f"client-burst-{n}"},
+                       callback=True)
+
+
+def stored_contents(message, room_id):
+    with message.db_read() as conn:
+        return [content for (content,) in conn.execute(
+            "SELECT content FROM messages WHERE room_id=? AND msg_type='text' ORDER BY id", (room_id,))]
+
+
+def test_send_burst_beyond_the_user_bucket_is_rejected(message, monkeypatch, chat):
+    room_id, alice, _ = chat
+    limits(message, monkeypatch, send=3)
+
+    acks = [send(alice, room_id, n) for n in range(5)]
+
+    assert [ack['success'] for ack in acks] == [True, True, True, False, False]
+    assert {(ack['error'], ack['scope'], ack['room_id']) for ack in acks[3:]} == {('rate_limited', 'user', room_id)}
+    assert all(ack['retry_after_ms'] > 0 for ack in acks[3:])
+    assert [error['event'] for error in received(alice, 'rate_limited')] == ['send_message', 'send_message']
+    assert stored_contents(message, room_id) == ['burst 0', 'burst 1', 'burst 2']
+
+
+def test_room_bucket_is_shared_by_its_senders(message, monkeypatch, chat):
+    room_id, alice, bob = chat
+    limits(message, monkeypatch, room=3)
+
+    acks = [send(alice, room_id, 0), send(alice, room_id, 1), send(bob, room_id, 2), send(bob, room_id, 3)]
+
+    assert [ack['success'] for ack in acks] == [True, True, True, False]
+    assert acks[3]['scope'] == 'room'
+    assert received(alice, 'rate_limited') == []
+
+
+def test_typing_burst_reports_once(message, monkeypatch, chat):
+    room_id, alice, bob = chat
+    limits(message, monkeypatch, typing=2)
+
+    for _ in range(5):
+        alice.emit('typing', {'room_id': room_id})
+
+    assert len(received(bob, 'typing_status')) == 2
+    assert [error['scope'] for error in received(alice, 'rate_limited')] == ['user']
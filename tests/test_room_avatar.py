@@ -0,0 +1,46 @@
+"""
+Who may change a room's avatar, over HTTP and over the socket.
+"""
+import io
+
+from conftest import create_chat, received
+
+
+def upload(message, room_id, token=None):
+    headers = {'Authorization': f"Bearer {token}"} if token else {}
+    return message.app.test_client().post('/upload_room_avatar', headers=headers, data={
+        'room_id': room_id, 'file': (io.BytesIO(b'not really a png'), 'avatar.png')})
+
+
+def token_of(message, user_id):
+    return message.session_tokens.dumps(user_id)
+
+
+def test_upload_needs_a_participant(message, login):
+    alice_id, alice = login('alice')
+    bob_id, _ = login('bob')
+    eve_id, _ = login('eve')
+    room_id = create_chat(alice, bob_id)
+
+    assert upload(message, room_id).status_code == 401
+    assert upload(message, room_id, token_of(message, eve_id)).status_code == 403
+    res = upload(message, room_id, token_of(message, alice_id))
+    assert res.status_code == 200 and res.get_json()['url'].startswith('/uploads/room_')
+
+
+def test_socket_update_needs_a_participant_and_an_uploaded_avatar(message, login):
+    alice_id, alice = login('alice')
+    bob_id, _ = login('bob')
+    _, eve = login('eve')
+    room_id = create_chat(alice, bob_id)
+    url = upload(message, room_id, token_of(message, alice_id)).get_json()['url']
+
+    eve.emit('update_room_avatar', {'room_id': room_id, 'avatar': url})
+    assert received(eve, 'error') == [{'message': 'Not allowed to change this chat'}]
+    alice.emit('update_room_avatar', {'room_id': room_id, 'avatar': '" onerror="alert(1)'})
+    assert received(alice, 'error') == [{'message': 'Invalid avatar'}]
+
+    alice.emit('join_room', {'room_id': room_id})
+    alice.get_received()
+    alice.emit('update_room_avatar', {'room_id': room_id, 'avatar': url})
+    assert received(alice, 'room_avatar_updated') == [{'room_id': room_id, 'avatar_url': url}]
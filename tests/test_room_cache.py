@@ -0,0 +1,63 @@
+"""
+The per-room message cache against the messages table after writes commit or roll back.
+"""
+import pytest
+
+from conftest import create_chat
+
+
+@pytest.fixture
+def chat(login):
+    alice_id, alice = login('alice')
+    bob_id, _ = login('bob')
+    room_id = create_chat(alice, bob_id)
+    # Joining loads the history, which fills the cache for the room
+    alice.emit('join_room', {'room_id': room_id})
+    alice.get_received()
+    return room_id, alice_id, alice
+
+
+def send(client, room_id, content, client_id):
+    return client.emit('send_message', {'room_id': room_id, 'content': content, 'client_id': client_id}, callback=True)
+
+
+def cached_and_stored(message, room_id):
+    with message.db_read() as conn:
+        c = conn.cursor()
+        room = message.room_cache.get(c, room_id)
+        assert room is not None and room.complete
+        c.execute(message.HISTORY_SQL, (room_id,))
+        stored = message.format_messages(c.fetchall())
+        c.execute("SELECT seq FROM rooms WHERE room_id=?", (room_id,))
+        (seq,) = c.fetchone()
+    return (list(room.messages.values()), room.seq), (stored, seq)
+
+
+def test_cache_follows_edits_and_deletes(message, chat):
+    room_id, _, alice = chat
+    first = send(alice, room_id, 'first', 'client-first')
+    second = send(alice, room_id, 'second', 'client-second')
+    alice.emit('edit_message', {'room_id': room_id, 'message_id': first['id'], 'new_content': 'first, edited'})
+    alice.emit('delete_message', {'room_id': room_id, 'message_id': second['id']})
+
+    cached, stored = cached_and_stored(message, room_id)
+
+    assert cached == stored
+    assert [m['content'] for m in cached[0] if m['type'] == 'text'] == ['first, edited']
+    with message.db_read() as conn:
+        delta = message.room_cache.delta(conn.cursor(), room_id, second['seq'])
+    assert [m['content'] for m in delta['messages']] == ['first, edited'] and delta['deleted'] == [second['id']]
+
+
+def test_rolled_back_insert_never_reaches_the_cache(message, chat):
+    room_id, alice_id, alice = chat
+    with pytest.raises(RuntimeError):
+        with message.db_connect() as conn:
+            message.insert_message(conn.cursor(), room_id, alice_id, 'text', 'rolled back')
+            raise RuntimeError
+    # The next commit on the same writer must not replay the discarded insert
+    send(alice, room_id, 'kept', 'client-kept')
+
+    cached, stored = cached_and_stored(message, room_id)
+    assert cached == stored
+    assert [m['content'] for m in cached[0] if m['type'] == 'text'] == ['kept']
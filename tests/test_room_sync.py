@@ -0,0 +1,76 @@
+"""
+join_room / sync_room deltas against per-room sequence numbers.
+"""
+import pytest
+
+from conftest import create_chat, received
+
+
+@pytest.fixture
+def chat(login):
+    alice_id, alice = login('alice')
+    bob_id, bob = login('bob')
+    room_id = create_chat(alice, bob_id)
+    alice.emit('join_room', {'room_id': room_id})
+    alice.get_received()
+    return room_id, alice, bob
+
+
+def send(client, room_id, content, client_id):
+    return client.emit('send_message', {'room_id': room_id, 'content': content, 'client_id': client_id}, callback=True)
+
+
+def sync(client, room_id, since_seq):
+    client.emit('sync_room', {'room_id': room_id, 'since_seq': since_seq})
+    return received(client, 'room_delta')
+
+
+def test_delta_carries_new_messages_and_tombstones(chat):
+    room_id, alice, _ = chat
+    first = send(alice, room_id, 'first', 'client-first')
+    second = send(alice, room_id, 'second', 'client-second')
+    alice.emit('edit_message', {'room_id': room_id, 'message_id': first['id'], 'new_content': 'first, edited'})
+    alice.emit('delete_message', {'room_id': room_id, 'message_id': second['id']})
+    alice.get_received()
+
+    (delta,) = sync(alice, room_id, second['seq'])
+
+    assert not delta['full'] and delta['since_seq'] == second['seq']
+    assert [m['content'] for m in delta['messages']] == ['first, edited']
+    assert delta['deleted'] == [second['id']]
+
+
+def test_up_to_date_delta_is_empty(chat):
+    room_id, alice, _ = chat
+    ack = send(alice, room_id, 'hello', 'client-hello')
+
+    (delta,) = sync(alice, room_id, ack['seq'])
+
+    assert delta['seq'] == ack['seq'] and delta['messages'] == [] and delta['deleted'] == []
+
+
+@pytest.mark.parametrize('since_seq', ['x', -1, [1], {'seq': 1}])
+def test_bad_since_seq_is_rejected(chat, since_seq):
+    room_id, alice, _ = chat
+
+    assert sync(alice, room_id, since_seq) == []
+    alice.emit('join_room', {'room_id': room_id, 'since_seq': since_seq})
+    assert [p['name'] for p in alice.get_received()] == ['error']
+
+
+def test_numeric_string_since_seq_is_accepted(chat):
+    room_id, alice, _ = chat
+    send(alice, room_id, 'hello', 'client-hello')
+
+    (delta,) = sync(alice, room_id, '1')
+
+    assert delta['since_seq'] == 1
+
+
+def test_non_members_get_no_delta(chat, login):
+    room_id, _, _ = chat
+    _, eve = login('eve')
+
+    assert sync(eve, room_id, 0) == []
+    eve.emit('join_room', {'room_id': room_id})
+    assert 'history' not in [p['name'] for p in eve.get_received()]
@@ -0,0 +1,44 @@
+"""
+Send acknowledgements and retries keyed on the client-generated id.
+"""
+from conftest import create_chat, received
+
+
+def test_retry_returns_the_original_message(login):
+    alice_id, alice = login('alice')
+    bob_id, bob = login('bob')
+    room_id = create_chat(alice, bob_id)
+    bob.emit('join_room', {'room_id': room_id})
+    bob.get_received()
+    payload = {'room_id': room_id, 'content': 'hello', 'client_id': 'retry-0001'}
+
+    first = alice.emit('send_message', payload, callback=True)
+    retry = alice.emit('send_message', payload, callback=True)
+
+    assert first['success'] and 'duplicate' not in first
+    assert retry == {'success': True, 'id': first['id'], 'seq': first['seq'], 'time': first['time'],
+                     'client_id': 'retry-0001', 'duplicate': True}
+    # Delivered once
+    assert [m['id'] for m in received(bob, 'message')] == [first['id']]
+
+
+def test_client_ids_are_per_sender(login):
+    alice_id, alice = login('alice')
+    bob_id, bob = login('bob')
+    room_id = create_chat(alice, bob_id)
+    payload = {'room_id': room_id, 'content': 'hello', 'client_id': 'shared-0001'}
+
+    mine = alice.emit('send_message', payload, callback=True)
+    theirs = bob.emit('send_message', payload, callback=True)
+
+    assert theirs['success'] and 'duplicate' not in theirs and theirs['id'] != mine['id']
+
+
+def test_malformed_client_id_is_rejected(login):
+    alice_id, alice = login('alice')
+    bob_id, _ = login('bob')
+    room_id = create_chat(alice, bob_id)
+
+    ack = alice.emit('send_message', {'room_id': room_id, 'content': 'hello', 'client_id': 'x'}, callback=True)
+
+    assert ack == {'success': False, 'message': 'Invalid client_id'}
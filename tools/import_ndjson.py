@@ -0,0 +1,208 @@
+"""
+Bulk import of NDJSON exports written by /admin/export.
+
+Loads one or more export files (plain or gzip'd) into a ZYLO_chat.db, creating
+or migrating its schema first. Rows go in through executemany in large
+transactions; rows that already exist (same user, room, membership or message
+id) are kept as they are, so importing a file twice changes nothing. A message
+whose id is taken by a message of another room is not imported either: those id
+collisions are listed as errors and the import exits with status 1. Afterwards
+the derived room state (seq and last message id) is rebuilt for every imported
+room and the planner statistics refreshed. --drop-indexes also drops the
+message indexes during the load and rebuilds them from their saved definitions,
+which pays off for large imports into an empty or small database.
+
+Run it with the server stopped: the running server's room cache would not see
+the imported messages.
+
+    curl -H "X-Admin-Token: $ZYLO_ADMIN_TOKEN" "http://127.0.0.1:5000/admin/export?room_id=R&gzip=1" -o room.ndjson.gz
+    python tools/import_ndjson.py room.ndjson.gz --db ZYLO_chat.db
+    python tools/import_ndjson.py exports/*.ndjson.gz --db restored/ZYLO_chat.db --drop-indexes
+"""
+import argparse
+import gzip
+import json
+import operator
+import os
+import sys
+import tempfile
+import time
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BATCH = 100_000
+MAX_REPORTED_COLLISIONS = 20
+MESSAGE_INDEXES = ("idx_messages_room_time", "idx_messages_sender", "idx_messages_room_seq", "idx_messages_room_timestamp")
+
+
+def load_app():
+    # message.py creates its DB and upload folder relative to the CWD
+    os.chdir(tempfile.mkdtemp(prefix="zylo_import_"))
+    sys.path.insert(0, ROOT)
+    import message
+    return message
+
+
+def open_export(path):
+    with open(path, 'rb') as f:
+        gzipped = f.read(2) == b'\x1f\x8b'
+    return gzip.open(path, 'rb') if gzipped else open(path, 'rb')
+
+
+def read_records(path, schema_version):
+    with open_export(path) as f:
+        header = loads(f.readline() or b'{}')
+        if header.get('type') != 'export':
+            raise SystemExit(f"{path} is not a /admin/export file")
+        if header.get('schema_version', 0) > schema_version:
+            raise SystemExit(f"{path} was exported at schema version {header['schema_version']}, "
+                             f"newer than this build ({schema_version})")
+        for line in f:
+            if line.strip():
+                yield loads(line)
+
+
+class Importer:
+    def __init__(self, conn, records):
+        self.conn = conn
+        self.sql = {kind: f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+                    for kind, (table, columns) in records.items()}
+        self.columns = {kind: columns for kind, (_, columns) in records.items()}
+        self.getters = {kind: operator.itemgetter(*columns) for kind, (_, columns) in records.items()}
+        self.batches = {kind: [] for kind in records}
+        self.read = dict.fromkeys(records, 0)
+        self.inserted = dict.fromkeys(records, 0)
+        self.pending = 0
+        self.rooms = set()
+        self.collisions = []  # (message id, room_id in the file, room_id in the database)
+        self.message_key = operator.itemgetter(self.columns['message'].index('id'),
+                                               self.columns['message'].index('room_id'))
+        conn.execute("CREATE TEMP TABLE imported_messages (id INTEGER, room_id TEXT)")
+
+    def add(self, record):
+        kind = record.get('type')
+        if kind not in self.batches:
+            return
+        try:
+            row = self.getters[kind](record)
+        except KeyError:  # written by an older export without some column
+            row = tuple(record.get(column) for column in self.columns[kind])
+        self.batches[kind].append(row)
+        self.read[kind] += 1
+        if 'room_id' in record:
+            self.rooms.add(record['room_id'])
+        self.pending += 1
+        if self.pending >= BATCH:
+            self.flush()
+
+    def flush(self):
+        # One transaction per batch of rows, whatever their types
+        for kind, rows in self.batches.items():
+            if rows:
+                before = self.conn.total_changes
+                self.conn.executemany(self.sql[kind], rows)
+                self.inserted[kind] += self.conn.total_changes - before
+                if kind == 'message':
+                    self.check_message_ids(rows)
+                rows.clear()
+        self.conn.commit()
+        self.pending = 0
+
+    def check_message_ids(self, rows):
+        # INSERT OR IGNORE keys on the id alone, so a message whose id belongs to another
+        # room (in the database or earlier in this import) was dropped, not already present
+        self.conn.executemany("INSERT INTO imported_messages VALUES (?, ?)", map(self.message_key, rows))
+        self.collisions += self.conn.execute("""
+            SELECT i.id, i.room_id, m.room_id FROM imported_messages i JOIN messages m ON m.id = i.id
+            WHERE m.room_id IS NOT i.room_id
+        """).fetchall()
+        self.conn.execute("DELETE FROM imported_messages")
+
+
+def rebuild_rooms(conn, room_ids):
+    conn.execute("CREATE TEMP TABLE imported_rooms (room_id TEXT PRIMARY KEY) WITHOUT ROWID")
+    conn.executemany("INSERT OR IGNORE INTO imported_rooms VALUES (?)", ((r,) for r in room_ids))
+    conn.execute("""
+        UPDATE rooms SET
+            seq = MAX(seq, (SELECT COALESCE(MAX(seq), 0) FROM messages m WHERE m.room_id = rooms.room_id)),
+            last_msg_id = MAX(last_msg_id, (SELECT COALESCE(MAX(id), 0) FROM messages m WHERE m.room_id = rooms.room_id))
+        WHERE room_id IN (SELECT room_id FROM imported_rooms)
+    """)
+    conn.execute("DROP TABLE imported_rooms")
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='+', help="files written by /admin/export")
+    parser.add_argument('--db', default='ZYLO_chat.db', help="database to import into (created if missing)")
+    parser.add_argument('--drop-indexes', action='store_true', help="drop the message indexes during the load")
+    args = parser.parse_args()
+    files = [os.path.abspath(path) for path in args.files]
+    db_path = os.path.abspath(args.db)
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+    m = load_app()
+    m.DB_FILE = db_path
+    m.init_db()
+    conn = m.sqlite3.connect(db_path)
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA cache_size=-262144")
+    index_sql = []
+    if args.drop_indexes:
+        index_sql = [row[0] for row in conn.execute(
+            f"SELECT sql FROM sqlite_master WHERE type='index' AND name IN ({','.join('?' * len(MESSAGE_INDEXES))})",
+            MESSAGE_INDEXES)]
+        for name in MESSAGE_INDEXES:
+            conn.execute(f"DROP INDEX IF EXISTS {name}")
+
+    importer = Importer(conn, m.EXPORT_RECORDS)
+    started = start = time.perf_counter()
+    try:
+        for path in files:
+            for record in read_records(path, len(m.MIGRATIONS)):
+                importer.add(record)
+            print(f"read        {path}")
+        importer.flush()
+    finally:
+        load_seconds = time.perf_counter() - start
+        if index_sql:
+            # Put the indexes back even when the load failed half way
+            start = time.perf_counter()
+            for sql in index_sql:
+                conn.execute(sql)
+            conn.commit()
+            print(f"indexes     {len(index_sql):>12} rebuilt in {time.perf_counter() - start:.1f}s")
+
+    for kind in m.EXPORT_RECORDS:
+        read, inserted = importer.read[kind], importer.inserted[kind]
+        skipped = len(importer.collisions) if kind == 'message' else 0
+        print(f"{kind:<15} {read:>12,} read {inserted:>12,} inserted {read - inserted - skipped:>10,} already present")
+    for message_id, room_id, existing in importer.collisions[:MAX_REPORTED_COLLISIONS]:
+        print(f"error: message {message_id} of room {room_id} not imported, its id belongs to room {existing}",
+              file=sys.stderr)
+    if importer.collisions:
+        print(f"error: {len(importer.collisions):,} messages not imported, their ids belong to other rooms",
+              file=sys.stderr)
+    messages = importer.read['message']
+    print(f"load        {load_seconds:.1f}s, {messages / max(load_seconds, 1e-9):,.0f} messages/s")
+
+    start = time.perf_counter()
+    rebuild_rooms(conn, importer.rooms)
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+    print(f"rebuild     {len(importer.rooms):,} rooms and statistics in {time.perf_counter() - start:.1f}s")
+    total = time.perf_counter() - started
+    print(f"total       {total:.1f}s, {messages / max(total, 1e-9):,.0f} messages/s -> {db_path}")
+    if importer.collisions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()